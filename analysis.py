@@ -1,16 +1,99 @@
-import csv 
-import matplotlib.pyplot as plt 
-import matplotlib.patches as mpatches
+import collections
+import functools
 import numpy as np
+from race import loadRace, RaceIndex
+from pits import extractPitStops
+from gaps import GapMatrix, lapSpans
+
+def axesFor(ax, projection=None):
+    """Figure and axes to draw on: ax itself, or a new figure when ax is None."""
+    if ax is not None:
+        return ax.figure, ax
+    import matplotlib.pyplot as plt # only plotting pays for the matplotlib import
+    fig = plt.figure()
+    return fig, fig.add_subplot(projection=projection)
+
+
+def finishPlot(fig, show):
+    if show:
+        import matplotlib.pyplot as plt
+        plt.show()
+    return fig
+
+
+def freezeKey(value):
+    """Hashable version of an argument: lists and arrays become tuples."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(freezeKey(v) for v in value)
+    return value
+
+
+def freezeResult(value):
+    """Cached results are shared between callers: arrays read-only, lists as tuples."""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, list):
+        value = tuple(freezeResult(v) for v in value)
+    return value
+
+
+class ResultCache:
+    """Bounded LRU of derived results keyed by (method, arguments), with hit/miss counters."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key, compute):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = freezeResult(compute())
+        if self.maxsize > 0:
+            self.entries[key] = value
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self.entries), "maxsize": self.maxsize}
+
+
+def cached(method):
+    """Memoize a RaceAnalysis method in self.cache; list results come back as lists."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, freezeKey(args), freezeKey(tuple(sorted(kwargs.items()))))
+        value = self.cache.lookup(key, lambda: method(self, *args, **kwargs))
+        return list(value) if isinstance(value, tuple) else value
+    return wrapper
+
 
 # extend the hard variables to include information about every car in gtd.
 # Top 17 cars in gtd actually finished the race at the end of 24 hrs.
 
 class RaceAnalysis:
-    def __init__(self, path="./Daytona_24hrs_GTD_replay.csv(2023)"):
+    def __init__(self, path="./data/Daytona_24hrs_GTD_replay(2023).csv", cache_size=256):
+        """
+        Derived results (finishers, stints, pit counts, lap times, gaps) are
+        memoized per race in self.cache, an LRU of cache_size entries (0 turns
+        it off). The race table is read-only; swap in a changed one with
+        setRace so the cache and the derived tables are rebuilt.
+        """
         self.path = path 
-        self.header, self.data = self.read_data(path)
-        self.fixSessionTimes()
+        self.cache = ResultCache(cache_size)
+        header, race = self.read_data(path)
+        self.setRace(race)
 
         self.gtd_positions = ['27','44','70','66','12','93','78','1','16','023','77','19','57','80','32','91','96','83','21','42','92','75','47']
 
@@ -20,38 +103,51 @@ class RaceAnalysis:
                                 "1:21:07.333", "0:16:09.746", "3:39:29.159", "0:16:52.192"] #pit durations
 
 
+    def setRace(self, race):
+        """Use race (a RaceTable) from now on, dropping everything derived from the old one."""
+        self.header, self.race = race.header, race.freeze()
+        self.index = RaceIndex(self.race)
+        self.pits = extractPitStops(self.race, self.index)
+        self.gaps = GapMatrix(self.race, self.index)
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget every memoized result, e.g. after changing gtd_positions."""
+        self.cache.clear()
+
+    def cacheStats(self):
+        return self.cache.stats()
+
+
     def read_data(self, path):
         """
         Read the CSV file and return the header (column names) and the data
-        Path: ./CSV and Replay/WeatherTech Championship Daytona Race.csv"""
+        as a columnar RaceTable (see race.py).
+        Path: ./data/Daytona_24hrs_GTD_replay(2023).csv"""
         try:
-            file = open(path)
-            reader = csv.reader(file)
-            header = next(reader)
-            data = []
-            for row in reader:
-                data.append(row)
-            return header, data
+            race = loadRace(path)
+            return race.header, race
         except(FileNotFoundError):
             print("Wrong file path or the file is missing")
         
 
+    @cached
     def cars_that_finished(self, class_):
         """
         Given the class of car, return a list of cars that raced till the end.
         class_ can be "GTP", "LMP2", "LMP3", "GTD", "GTDPRO"
         """
         result = []
-        for i in range(len(self.data)-1, 0, -1):
-            if self.data[i][1] == class_:
-                result.append(self.data[i][0])
-                if len(result) > 1 and (result[0] == result[-1]):
-                    break
-        result.pop() # remove the repeated car from the end.
-        return result
+        class_rows = np.flatnonzero(self.race.mask("Class", class_))
+        for car in self.race.car[class_rows[::-1]]:
+            if car in result:
+                break # every car after this one already finished
+            result.append(car)
+        return self.race.names("Car", result)
 
         
 
+    @cached
     def avgStint(self, class_):
         """
         Plot a graph using matplotlib with x axis showing the finishing positions of the car
@@ -62,22 +158,14 @@ class RaceAnalysis:
         average_intervals = []
 
         for car in car_list:
-            average_interval_car = []
-            c=0
-            in_pit = False
-            for i in range(1, len(self.data)):
-                if self.data[i][0] == car and self.data[i][7] == "Pit" and in_pit == False:
-                    average_interval_car.append(int(self.data[i][3])-c)
-                    in_pit = True
-                elif self.data[i][0] == car and self.data[i][7] == "Track" and in_pit == True:
-                    in_pit = False
-                    c = int(self.data[i][3])
-            average_intervals.append(sum(average_interval_car)/len(average_interval_car))
+            average_interval_car = self.pits.stint[self.pits.carStops(car)]
+            average_intervals.append(float(average_interval_car.mean()))
 
         return average_intervals
 
 
 
+    @cached
     def totalPitstops(self):
         """
         Plot a graph with finishing position of cars in a given class
@@ -88,23 +176,11 @@ class RaceAnalysis:
         Check the function self.cars_that_finished()
         """
 
-        total_pits_all = []
         car_list = self.gtd_positions[:10]
-
-        for car in car_list:
-            pits = 0
-            in_pit = False 
-            for data in self.data:
-                if in_pit == False and data[0] == car and data[7] == "Pit":
-                    pits += 1
-                    in_pit = True
-                elif in_pit == True and data[0] == car and data[7] == "Track":
-                    in_pit = False
-            total_pits_all.append(pits)
-        
-        return total_pits_all
+        return [self.pits.count(car) for car in car_list]
 
 
+    @cached
     def GreenYellowPitRatio(self, class_):
         """
         Plot a graph where the x-axis occupies the finishing 
@@ -116,46 +192,42 @@ class RaceAnalysis:
         pit_ratios = []
         car_list = self.cars_that_finished(class_)
         for car in car_list:
-            yellow = 0
-            green = 0
-            in_pit = False
-            for data in self.data:
-                if in_pit == False and data[0] == car and data[7] == "Pit" and data[6] == "Green":
-                    green += 1
-                    in_pit = True
-                elif in_pit == False and data[0] == car and data[7] == "Pit" and data[6] == "Yellow":
-                    yellow += 1
-                    in_pit = True
-                elif in_pit == True and data[0] == car and data[7] == "Track":
-                    in_pit = False
+            yellow = self.pits.count(car, "Yellow")
+            green = self.pits.count(car, "Green")
             pit_ratios.append(yellow/green if green != 0 else 1)
         
         return pit_ratios
 
 
-    def plotAvgStint_vs_pos(self):
+    def plotAvgStint_vs_pos(self, ax=None, show=True):
         stint = self.avgStint("GTD")[:10]
         finish_pos = self.gtd_positions[:10]
 
-        plt.scatter(finish_pos, stint)
-        plt.xlabel("Finishing positions")
-        plt.ylabel("Average stint btwn pits (# of laps)")
-        plt.show()
+        fig, ax = axesFor(ax)
+        ax.scatter(finish_pos, stint)
+        ax.set_xlabel("Finishing positions")
+        ax.set_ylabel("Average stint btwn pits (# of laps)")
+        return finishPlot(fig, show)
+
+
+    def pitSummary(self, class_):
+        """
+        Cars that finished in class_ with their total pitstops, yellow/green
+        pit ratio and average stint, the data behind Plot3dScatter."""
+        car_list = self.cars_that_finished(class_)
+        total_pits = [self.pits.count(car) for car in car_list]
+        return car_list, total_pits, self.GreenYellowPitRatio(class_), self.avgStint(class_)
 
 
-    def Plot3dScatter(self, class_):
+    def Plot3dScatter(self, class_, ax=None, show=True):
         """
         Plots a 3D graph with x-axis displaying the total pitstops, 
         y-axis displaying ratio between yellow and green flag pit stops
         and lastly z-axis displaying the average stint in laps"""
-        car_list = self.cars_that_finished(class_)
-        car_pos = [self.finishing_pos[class_][c] for c in car_list]
-        average_stint = self.stint_duration_vs_pos(class_)
-        pit_ratio = self.GreenYellowPitRatio_vs_pos(class_)
-        total_pits = self.numberofpits_vs_pos(class_)
+        car_list, total_pits, pit_ratio, average_stint = self.pitSummary(class_)
+        car_pos = [self.gtd_positions.index(c)+1 if c in self.gtd_positions else '#'+c for c in car_list]
 
-        fig = plt.figure()
-        ax = fig.add_subplot(projection='3d')
+        fig, ax = axesFor(ax, projection='3d')
         ax.scatter(total_pits, pit_ratio, average_stint)
         ax.set_xlabel("Total pitstops")
         ax.set_ylabel("Ratio of pits yellow flag vs green flag")
@@ -164,23 +236,26 @@ class RaceAnalysis:
         for i in range(len(car_list)):
             ax.text(total_pits[i], pit_ratio[i], average_stint[i], str(car_pos[i]))
 
-        plt.show()
+        return finishPlot(fig, show)
 
 
+    @cached
     def avgLapTimes(self):
 
-        self.changeLaptimesToSeconds()
         car_list = self.gtd_positions[:10]
         # for the lap times calculate in green flag and avoid the lap after pitting.
         avg_laptimes = []
         car_pos = [self.gtd_positions.index(c)+1 for c in car_list]
 
+        green_track = self.race.mask("Flag", "Green") & self.race.mask("Location", "Track")
+
         for car in car_list:
-            car_laptimes = []
-            for d in range(1, len(self.data)):
-                if self.data[d][0] == car and self.data[d-1][6] == "Green" and self.data[d][6] == "Green" and self.data[d][7] == "Track" and self.data[d-1][7] == "Track":
-                    car_laptimes.append(self.data[d][4])
-            avg_laptimes.append(sum(car_laptimes)/len(car_laptimes))
+            car_rows = self.index.carRows(car)
+            clean = green_track[car_rows]
+            clean[1:] &= clean[:-1] # the car's previous lap has to be green and on track too
+            clean[0] = False
+            car_laptimes = self.race.lap_time[car_rows[clean]]
+            avg_laptimes.append(float(car_laptimes.mean()))
         
         # plt.scatter(total_pits, avg_laptimes)
         # plt.xlabel("Total pitstops")
@@ -192,28 +267,7 @@ class RaceAnalysis:
         return avg_laptimes
     
 
-    def changeLaptimesToSeconds(self):
-
-        for data in self.data:
-            if type(data[4]) is not str:
-                return
-            min, second = data[4].split(':')
-            data[4] = int(min)*60 + float(second)
-
-    def fixSessionTimes(self):
-        hour = 0
-        self.data[0][5] = '0:'+self.data[0][5]
-        for i in range(1, len(self.data)):
-            try:
-                if int(self.data[i-1][5].split(':')[1]) > int(self.data[i][5].split(':')[0]):
-                    hour += 1
-                self.data[i][5] = str(hour)+':'+self.data[i][5]
-            except:
-                print(i+1)
-
-
-
-    def plotAvgLaptime_vs_pitDuration(self):
+    def plotAvgLaptime_vs_pitDuration(self, ax=None, show=True):
         car_list = self.gtd_positions[:10]
         car_pos = [self.gtd_positions.index(c)+1 for c in car_list]
         avg_laptimes = self.avgLapTimes()
@@ -222,13 +276,14 @@ class RaceAnalysis:
             hours, min, second = pit_durations[i].split(':')
             pit_durations[i] = int(hours)*60 + int(min) + float(second)/60
         
-        plt.scatter(pit_durations, avg_laptimes)
-        plt.xlabel("Pit stop duration (minutes)")
-        plt.ylabel("Average lap times (seconds)")
-        plt.title("Plot for GTD")
+        fig, ax = axesFor(ax)
+        ax.scatter(pit_durations, avg_laptimes)
+        ax.set_xlabel("Pit stop duration (minutes)")
+        ax.set_ylabel("Average lap times (seconds)")
+        ax.set_title("Plot for GTD")
         for i in range(len(car_list)):
-            plt.annotate(str(self.gtd_positions[i]), (pit_durations[i], avg_laptimes[i]))
-        plt.show()        
+            ax.annotate(str(self.gtd_positions[i]), (pit_durations[i], avg_laptimes[i]))
+        return finishPlot(fig, show)
 
 
 
@@ -247,133 +302,98 @@ class RaceAnalysis:
             laptimes_after_last_pit = 0
             c = 0
             # collect avg lap time from the previous pit stop to the next
-            for d in range(1, len(self.data)-1):
+            car_rows = self.index.carRows(car)
+            location = self.race.location[car_rows]
+            lap_time = self.race.lap_time[car_rows]
+            pit, track = self.race.code("Location", "Pit"), self.race.code("Location", "Track")
+            for d in range(1, len(car_rows)-1):
                 # always use the top value on the stack for calculating pit duration
-                if self.data[d][0] == car and self.data[d][7] == "Pit" and in_pit == False and self.data[d+1][7] == "Track":
+                if location[d] == pit and in_pit == False and location[d+1] == track:
                     # record the pit duration
                     if c != 0:
                         avg_laptime_stack.append(laptimes_after_last_pit/c)
                         c=0
                         laptimes_after_last_pit = 0
-                    car_pit_duration.append(self.data[d][4]+self.data[d+1][4]-(2*avg_laptime_stack[-1]))
+                    car_pit_duration.append(lap_time[d]+lap_time[d+1]-(2*avg_laptime_stack[-1]))
                 
-                # elif self.data[d][0] == car and self.data[d][]
+                # elif location[d] == ...
 
 
+    @cached
     def carPits(self, car, laprange):
         # get the laps on which car pitted between the given lap range.
 
-        pit = []
-        for data in self.data:
-            if data[0] == car and (laprange[0] <= int(data[3]) <= laprange[1]) and data[7] == "Pit":
-                pit.append(int(data[3]))
-        return pit
+        entry_laps = self.pits.entry_lap[self.pits.carStops(car)]
+        in_range = (laprange[0] <= entry_laps) & (entry_laps <= laprange[1])
+        return entry_laps[in_range].tolist()
     
 
+    @cached
     def carGap2(self, car1, car2, laprange):
         """
-        Filter data out for each of the two cars in seperate variables and
-        compare their session times for the same lap and the difference between
-        that is their gap. 
+        Gap of car1 to car2 on every lap of laprange: the difference of
+        their session times for the same lap (see gaps.GapMatrix). 
+        Nothing is drawn, plotCarGap2 renders it.
         """
-        data1 = []
-        data2 = []
-        for data in self.data:
-            if data[0] == car1 and (laprange[0] <= int(data[3]) <= laprange[1]):
-                data1.append(data)
-
-            if data[0] == car2 and (laprange[0] <= int(data[3]) <= laprange[1]):
-                data2.append(data)
- 
-        car_gap = []
-        i=0
-        j=0
-        while (i < len(data1) and j < len(data2)):
-            hour1,min1,sec1 = data1[i][5].split(':')
-            hour2,min2,sec2 = data2[j][5].split(':')
-            if data1[i][3] == data2[j][3]:
-                gap = (int(hour1)-int(hour2))*60*60 + (int(min1)-int(min2))*60 + (float(sec1)-float(sec2))               
-                i+=1
-                j+=1
-            elif data1[i][3] > data2[j][3]:
-                gap = car_gap[-1]
-                j+=1
-            else:
-                gap = car_gap[-1]
-                i+=1
-
-            car_gap.append(gap)
-        i,j=0,0
-        is_yellow = False 
-        yellow_flags = []
-        yellow_start, yellow_end = 0,0
-        pit1 = self.carPits(car1, laprange)
-        pit2 = self.carPits(car2, laprange)
-
-        while (i < len(data1) and j < len(data2)):
-
-            if data1[i][3] == data2[j][3]:
-                if (data1[i][6] == "Yellow" or data2[j][6] == "Yellow") and is_yellow == False:
-                    is_yellow = True 
-                    yellow_start = data1[i][3]
-                elif (data1[i][6] == "Green" or data2[j][6] == "Green") and is_yellow == True:
-                    is_yellow = False 
-                    yellow_end = data1[i][3]
-                    yellow_flags.append([yellow_start, yellow_end])
-                i+=1
-                j+=1
+        return self.gaps.gap(car1, car2, laprange)
 
-            elif data1[i][3] > data2[j][3]:
-                j+=1 
-            else:
-                i+=1
-
-        if yellow_start > yellow_end:
-            yellow_flags.append([yellow_start, laprange[1]])
 
+    def plotCarGap2(self, car1, car2, laprange, ax=None, show=True):
+        import matplotlib.patches as mpatches
+        car_gap = self.carGap2(car1, car2, laprange)
+        laps = self.gaps.laps(laprange)
+        yellow_flags = lapSpans(self.gaps.yellowLaps([car1, car2], laprange), laps)
+        pit1 = self.carPits(car1, laprange)
+        pit2 = self.carPits(car2, laprange)
 
+        fig, ax = axesFor(ax)
         for flag in yellow_flags:
-            plt.axvspan(int(flag[0]), int(flag[1]), facecolor='yellow', alpha=0.5)
+            ax.axvspan(int(flag[0]), int(flag[1]), facecolor='yellow', alpha=0.5)
 
 
         for p1 in pit1:
-            plt.axvline(int(p1), color="red", alpha=0.5)
+            ax.axvline(int(p1), color="red", alpha=0.5)
         for p2 in pit2:
-            plt.axvline(int(p2), color="black", alpha=0.5)
+            ax.axvline(int(p2), color="black", alpha=0.5)
 
         patches = [mpatches.Patch(color='red', label='#'+car1+' pits'), mpatches.Patch(color='black', label='#'+car2+' pits'), mpatches.Patch(color='yellow', label='Yellow flag')]
-        plt.plot([i for i in range(laprange[0], laprange[1]+1)], car_gap)
-        plt.xlabel("Laps")
-        plt.ylabel("Gap(seconds)")
-        plt.title("Gap to #"+car2+" from #"+car1)
-        plt.legend(handles=patches)
-        plt.show()
-        # return car_gap
+        ax.plot(laps, car_gap)
+        ax.set_xlabel("Laps")
+        ax.set_ylabel("Gap(seconds)")
+        ax.set_title("Gap to #"+car2+" from #"+car1)
+        ax.legend(handles=patches)
+        return finishPlot(fig, show)
 
 
+    @cached
     def carGapn(self, laprange, *cars):
-        car_gaps = []
-        yellow_durations = []
+        """Gaps of every car to cars[0] over laprange, one row per car."""
+        return self.gaps.gaps(cars, cars[0], laprange)
+
+
+    def plotCarGapn(self, laprange, *cars, ax=None, show=True):
         pits = [self.carPits(c, laprange) for c in cars]
 
         colors = ['black', '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
 
-        for car in cars:
-            car_gaps.append(self.carGap2(cars[0], car, laprange))
+        car_gaps = self.carGapn(laprange, *cars)
+        laps = self.gaps.laps(laprange)
+        fig, ax = axesFor(ax)
         # leaving out the yellow flag for now 
         for j in range(len(car_gaps)):
-            plt.plot([i for i in range(laprange[0], laprange[1]+1)], car_gaps[j], color=colors[j], label=cars[j])
+            ax.plot(laps, car_gaps[j], color=colors[j % len(colors)], label=cars[j])
 
         for j in range(len(pits)):
             for p in pits[j]:
-                plt.axvline(p, color=colors[j], alpha=0.5)
+                ax.axvline(p, color=colors[j % len(colors)], alpha=0.5)
 
-        plt.xlabel("Laps")
-        plt.ylabel("Gap(seconds)")
-        plt.legend()
-        plt.title("Car gaps from #"+cars[0])
-        plt.show()
+        ax.set_xlabel("Laps")
+        ax.set_ylabel("Gap(seconds)")
+        ax.legend()
+        ax.set_title("Car gaps from #"+cars[0])
+        return finishPlot(fig, show)
 
+    @cached
     def avgPitDuration(self):
         total_pits = self.totalPitstops()
         average_pit_duration = [] # in seconds
@@ -385,25 +405,35 @@ class RaceAnalysis:
         return average_pit_duration
 
 
+    def undercut(self, class_, laprange):
+        """
+        Projected gaps and positions after a stop for every pair of cars of
+        class_ on every lap of laprange, see undercut.UndercutMatrix.
+        """
+        from undercut import UndercutMatrix # pulls in pandas
+        return UndercutMatrix(self.race, self.index, self.pits, self.gaps, class_, laprange)
+
+
     def gapAfterPitting(self, target_car, opp_car, lap):
         # 1) calculate gap from every other car first
         # 2) Print out the before pitting gap
-        # 3) Find the difference in gap time and print out the gap after pitting.
-        pos = self.gtd_positions.index(target_car)
-
-        car_gap = self.carGap2(target_car, opp_car, [lap, lap])
-        print("Gap before pitting:", car_gap[0])
-        print("Gap after pitting:", car_gap[0]-self.avgPitDuration()[pos])      
+        # 3) Add the pit loss of target_car measured on this race and print out the gap after pitting.
+        class_ = self.race.name("Class", self.gaps.car_class[self.race.code("Car", target_car)])
+        undercut = self.undercut(class_, (lap, lap))
+        car, rival = undercut.cars.index(target_car), undercut.cars.index(opp_car)
+        gap, gap_after, _, _ = undercut.projections(car, rival, 0)
+        print("Gap before pitting:", gap)
+        print("Gap after pitting:", gap_after)
 
                     
 
 if __name__ == '__main__':
     ra = RaceAnalysis()
     # ra.carGap('44', '27', (400, 600))
-    # ra.carGapn([200,400], '27', '44', '70', '12', '66')
+    # ra.plotCarGapn([200,400], '27', '44', '70', '12', '66')
     # ra.tireDegradationPlot('70')
-    ra.carGap2('27', '70', (1, 700))
-    print(ra.data[5350])
+    ra.plotCarGap2('27', '70', (1, 700))
+    print(ra.race.row(5350))
     
     
     
@@ -0,0 +1,207 @@
+"""
+Benchmarks of every stage from CSV parsing to one training epoch.
+
+The Daytona file is scaled up by copying its field (every car gets renamed
+copies running the same laps), so a 10x run has ten times the rows and cars
+of the real race. Every stage reports its best and median wall time, rows per
+second and the peak Python/NumPy allocation (tracemalloc). Results are
+written as JSON; --compare flags stages that got slower than a saved run.
+
+    python benchmark.py --scales 1 10 100 --out bench.json
+    python benchmark.py --scales 1 --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import race
+from race import readColumns, fixSessionTimes, parseLapTimes, parseSectors, readRace, loadRace
+
+DEFAULT_RACE = "./data/Daytona_24hrs_GTD_replay(2023).csv"
+
+
+def scaleRace(path, factor, out_path):
+    """Write a copy of the race with factor copies of every car (car "27" -> "27", "27x1", ...)."""
+    with open(path, encoding='utf-8-sig') as src, open(out_path, 'w') as out:
+        out.write(next(src))
+        for line in src:
+            car, rest = line.split(',', 1)
+            out.write(line)
+            for k in range(1, factor):
+                out.write("%sx%d,%s" % (car, k, rest))
+    return out_path
+
+
+def measure(fn, repeat, budget=10.0):
+    """Best and median seconds of up to repeat calls (fewer once budget s is spent) and peak MB."""
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat and (not times or time.perf_counter() - start < budget):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), float(np.median(times)), peak / 2**20
+
+
+class Bench:
+    def __init__(self, scale, repeat):
+        self.scale = scale
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, group, stage, fn, rows):
+        best, median, peak = measure(fn, self.repeat)
+        self.results.append({"scale": self.scale, "group": group, "stage": stage, "rows": rows,
+                             "best_s": best, "median_s": median,
+                             "rows_per_s": rows / best if best > 0 else None, "peak_mb": peak})
+        print("%4dx %-9s %-28s %9.4f s %12.0f rows/s %8.1f MB" % (self.scale, group, stage, best,
+                                                                   rows / best if best > 0 else 0, peak))
+
+    def skip(self, group, stage, reason):
+        self.results.append({"scale": self.scale, "group": group, "stage": stage, "skipped": reason})
+        print("%4dx %-9s %-28s skipped: %s" % (self.scale, group, stage, reason))
+
+
+def benchmarkScale(path, scale, repeat, train=True):
+    import analysis
+    import get_data
+
+    bench = Bench(scale, repeat)
+    header, raw = readColumns(path)
+    rows = len(raw["Lap"])
+
+    bench.run("parse", "read_data (csv)", lambda: readColumns(path), rows)
+    bench.run("parse", "fixSessionTimes", lambda: fixSessionTimes(raw["Session Time"]), rows)
+    bench.run("parse", "parseLapTimes", lambda: parseLapTimes(raw["Lap Time"]), rows)
+    bench.run("parse", "parseSectors (S01)", lambda: parseSectors(raw["S01"]), rows)
+    bench.run("parse", "readRace", lambda: readRace(path), rows)
+    loadRace(path) # write the cache so the next stage measures a warm load
+    bench.run("parse", "loadRace (warm cache)", lambda: loadRace(path), rows)
+
+    bench.run("analysis", "RaceAnalysis (index/pits/gaps)", lambda: analysis.RaceAnalysis(path), rows)
+    ra = analysis.RaceAnalysis(path, cache_size=0) # time the computation, not the memoized result
+    finished = ra.cars_that_finished("GTD")
+    laprange = (1, ra.gaps.max_lap)
+    bench.run("analysis", "avgStint", lambda: ra.avgStint("GTD"), rows)
+    bench.run("analysis", "totalPitstops", ra.totalPitstops, rows)
+    bench.run("analysis", "GreenYellowPitRatio", lambda: ra.GreenYellowPitRatio("GTD"), rows)
+    bench.run("analysis", "avgLapTimes", ra.avgLapTimes, rows)
+    bench.run("analysis", "carGap2", lambda: ra.carGap2(finished[0], finished[1], laprange), rows)
+    bench.run("analysis", "carGapn", lambda: ra.carGapn(laprange, *finished[:10]), rows)
+    bench.run("analysis", "avgPitDuration", ra.avgPitDuration, rows)
+    memo = analysis.RaceAnalysis(path)
+    memo.carGapn(laprange, *finished[:10])
+    bench.run("analysis", "carGapn (memoized)", lambda: memo.carGapn(laprange, *finished[:10]), rows)
+
+    import running
+    bench.run("analysis", "RunningOrder", lambda: running.RunningOrder(ra.race, ra.index), rows)
+    import sectors
+    bench.run("analysis", "sectorTable", lambda: sectors.sectorTable(ra.race, ra.index), rows)
+    bench.run("analysis", "UndercutMatrix", lambda: ra.undercut("GTD", laprange), rows)
+    import strategy
+    bench.run("analysis", "RaceModel", lambda: strategy.RaceModel(ra.race, ra.index, finished), rows)
+    race_model = strategy.RaceModel(ra.race, ra.index, finished)
+    plans = strategy.pitMatrix(strategy.evenStrategies(1, ra.gaps.max_lap, [22, 24]), 1, ra.gaps.max_lap)
+    bench.run("analysis", "simulateBatch (2x2000 races)", lambda: strategy.simulateBatch(race_model, plans, 0, 2000, 0),
+              plans.size * 2000) # simulated laps
+    import planner
+    bench.run("analysis", "PitPlanner (3 h drivers)",
+              lambda: planner.PitPlanner(race_model, 1, ra.gaps.max_lap, max_driver_laps=planner.driverLaps(race_model, 3)),
+              ra.gaps.max_lap) # planned laps
+
+    # every car of the class, so the feature rows grow with the scale
+    bench.run("features", "Dataset", lambda: get_data.Dataset(path, top=None), rows)
+    dt = get_data.Dataset(path, top=None)
+    n = len(dt.data)
+    for getter in ("getRaceProgress", "getTireAge", "getDriverDuration", "getRemainingPitStops",
+                   "getYellowFlag", "getPosition", "getLapsDown", "getCloseAhead", "getPursuerTireChange"):
+        bench.run("features", getter, getattr(dt, getter), n)
+    bench.run("features", "makeData", dt.makeData, n)
+
+    data = dt.makeData()
+    encoded = lambda: get_data.encode(get_data.normalizeNumericalData(data.copy()))
+    bench.run("model", "encode", encoded, n)
+    if not train:
+        bench.skip("model", "FFNN epoch", "disabled")
+        return bench.results
+    try:
+        import model
+    except ImportError as e:
+        bench.skip("model", "FFNN epoch", "TensorFlow unavailable (%s)" % e)
+        return bench.results
+    X = encoded().to_numpy(dtype=np.float32)
+    y = dt.getPitNextLap()
+    net = model.buildModel(X.shape[1])
+    weights = model.classWeights(y)
+    epoch = lambda: net.fit(X, y, epochs=1, batch_size=256, class_weight=weights, verbose=0)
+    bench.run("model", "FFNN epoch", epoch, n)
+    return bench.results
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file, threshold):
+    """Stages at least threshold times slower than in the baseline run."""
+    with open(baseline_file) as file:
+        baseline = {(r["scale"], r["stage"]): r for r in json.load(file)["results"] if "best_s" in r}
+    regressions = []
+    for r in results:
+        old = baseline.get((r["scale"], r["stage"]))
+        if old is None or "best_s" not in r or old["best_s"] <= 0:
+            continue
+        ratio = r["best_s"] / old["best_s"]
+        flag = "REGRESSION" if ratio >= threshold else ""
+        print("%4dx %-28s %9.4f -> %9.4f s  x%.2f %s" % (r["scale"], r["stage"], old["best_s"], r["best_s"], ratio, flag))
+        if ratio >= threshold:
+            regressions.append(r["stage"])
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every stage at several multiples of a race's size.")
+    parser.add_argument("--race", default=DEFAULT_RACE)
+    parser.add_argument("--scales", nargs='+', type=int, default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-train", action='store_true', help="skip the FFNN epoch")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        race.CACHE_DIR = os.path.join(workdir, "cache") # keep scaled races out of the real cache
+        for scale in args.scales:
+            path = scaleRace(args.race, scale, os.path.join(workdir, "race_x%d.csv" % scale))
+            results += benchmarkScale(path, scale, args.repeat, train=not args.no_train)
+
+    meta = {"commit": gitCommit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "race": args.race,
+            "python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    with open(args.out, 'w') as file:
+        json.dump({"meta": meta, "results": results}, file, indent=1)
+    print("wrote", args.out)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        sys.exit(1 if regressions else 0)
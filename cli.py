@@ -0,0 +1,346 @@
+"""
+One command line for the race analyses, feature building, training and prediction.
+
+    python cli.py gaps RACE --cars 27 70 12 --laps 1 700
+    python cli.py stints RACE --cars 27
+    python cli.py pits RACE --class GTD
+    python cli.py degradation RACE --cars 27 93 [--plot deg.png]
+    python cli.py sectors RACE [--by car|stint|driver] [--cars 27 93]
+    python cli.py strategy RACE --cars 27 --from-lap 400 [--stops 10 11 12]
+    python cli.py plan RACE --cars 27 --from-lap 300 --tire-age 12 [--max-driver-hours 3]
+    python cli.py undercut RACE --laps 300 310 [--cars 27] [--max-gap 30]
+    python cli.py build-features ./data [--out .shards]
+    python cli.py train [--shards .shards] [--export pit_model.npz]
+    python cli.py predict pit_model.npz RACE [--cars 27]
+    python cli.py startup [--budget 0.3]
+
+Every subcommand imports what it needs when it runs: gaps, stints and pits
+only load NumPy, degradation, sectors, strategy, plan, undercut and predict add pandas, and only train
+imports TensorFlow. `startup` checks that importing this module and
+printing the help stays within a time budget without pulling in any of
+the HEAVY_MODULES. Tables print as text, or as --format csv/json.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_RACE = "./data/Daytona_24hrs_GTD_replay(2023).csv"
+HEAVY_MODULES = ("pandas", "matplotlib", "sklearn", "tensorflow", "keras")
+STARTUP_BUDGET = 0.3 # seconds for `python cli.py --help`
+
+
+def printTable(header, rows, fmt="text"):
+    if fmt == "json":
+        print(json.dumps([dict(zip(header, row)) for row in rows], indent=1))
+        return
+    if fmt == "csv":
+        import csv
+        writer = csv.writer(sys.stdout)
+        writer.writerow(header)
+        writer.writerows(rows)
+        return
+    cells = [[str(h) for h in header]] + [["%.3f" % v if isinstance(v, float) else str(v) for v in row]
+                                          for row in rows]
+    widths = [max(len(row[k]) for row in cells) for k in range(len(header))]
+    for row in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def raceAnalysis(args):
+    from analysis import RaceAnalysis
+    return RaceAnalysis(args.race)
+
+
+def carsOf(args, ra):
+    """Cars from --cars, or every car that finished in the class."""
+    return args.cars or ra.cars_that_finished(args.class_)
+
+
+def lapRange(args, ra):
+    return tuple(args.laps) if args.laps else (1, ra.gaps.max_lap)
+
+
+def gapsCommand(args):
+    ra = raceAnalysis(args)
+    cars = carsOf(args, ra)[:args.max_cars]
+    laprange = lapRange(args, ra)
+    laps = ra.gaps.laps(laprange)
+    if args.leader:
+        gaps = ra.gaps.gapToLeader(cars, laprange, args.class_)
+        header = ["Lap"] + ["#%s to leader" % c for c in cars]
+    else:
+        gaps = ra.carGapn(laprange, *cars)
+        header = ["Lap"] + ["#%s to #%s" % (c, cars[0]) for c in cars]
+    rows = [[int(lap)] + [round(float(g), 3) for g in gaps[:, k]] for k, lap in enumerate(laps)]
+    printTable(header, rows, args.format)
+
+
+def stintsCommand(args):
+    ra = raceAnalysis(args)
+    pits = ra.pits
+    rows = []
+    for car in carsOf(args, ra):
+        for k, stop in enumerate(pits.carStops(car)):
+            rows.append([car, k + 1, int(pits.entry_lap[stop]), int(pits.exit_lap[stop]),
+                         ra.race.name("Flag", pits.flag[stop]), int(pits.stint[stop])])
+    printTable(["Car", "Stop", "In lap", "Out lap", "Flag", "Stint laps"], rows, args.format)
+
+
+def pitsCommand(args):
+    ra = raceAnalysis(args)
+    car_list, total_pits, ratios, stints = ra.pitSummary(args.class_)
+    rows = [[car, total, round(ratio, 3), round(stint, 2)]
+            for car, total, ratio, stint in zip(car_list, total_pits, ratios, stints)]
+    printTable(["Car", "Pit stops", "Yellow/green", "Avg stint"], rows, args.format)
+
+
+def degradationCommand(args):
+    from degradation import fitStints, carDegradation
+    ra = raceAnalysis(args)
+    cars = carsOf(args, ra)
+    stints = fitStints(ra.race, ra.index, cars, method=args.method)
+    if args.per_stint:
+        printTable(list(stints.columns), stints.itertuples(index=False), args.format)
+    else:
+        per_car = carDegradation(stints)
+        printTable(["Car", "Degradation (s/h)"], [[c, round(float(per_car.get(c, float("nan"))), 4)] for c in cars],
+                   args.format)
+    if args.plot:
+        import matplotlib
+        matplotlib.use("Agg")
+        import Pit
+        fig = Pit.tireDegradationPlot(cars[0], ra, show=False)
+        fig.savefig(args.plot, dpi=100, bbox_inches='tight')
+
+
+def sectorsCommand(args):
+    from sectors import sectorTable, sectorSummary
+    ra = raceAnalysis(args)
+    summary = sectorSummary(sectorTable(ra.race, ra.index, args.window), args.by)
+    if args.cars:
+        summary = summary[summary["Car"].isin(args.cars)] if "Car" in summary else summary
+    printTable(list(summary.columns), summary.itertuples(index=False), args.format)
+
+
+def strategyCommand(args):
+    import strategy
+    ra = raceAnalysis(args)
+    model = strategy.RaceModel(ra.race, ra.index, carsOf(args, ra))
+    to_lap = args.to_lap or ra.gaps.max_lap
+    fewest = strategy.minimumStops(args.from_lap, to_lap, model.max_stint, args.tire_age)
+    candidates = strategy.evenStrategies(args.from_lap, to_lap, args.stops or range(fewest, fewest + 4), args.tire_age)
+    times = strategy.runStrategies(model, candidates, args.from_lap, to_lap, args.tire_age, args.scenarios,
+                                   args.workers, seed=args.seed)
+    summary = strategy.summarize(candidates, times, model, args.from_lap, to_lap, args.tire_age)
+    printTable(list(summary.columns), summary.itertuples(index=False), args.format)
+
+
+def planCommand(args):
+    import planner
+    import strategy
+    ra = raceAnalysis(args)
+    model = strategy.RaceModel(ra.race, ra.index, carsOf(args, ra))
+    to_lap = args.to_lap or ra.gaps.max_lap
+    max_driver_laps = planner.driverLaps(model, args.max_driver_hours) if args.max_driver_hours else None
+    caution = planner.cautionChances(model, args.from_lap, to_lap, args.yellow_left)
+    pit_planner = planner.PitPlanner(model, args.from_lap, to_lap, args.max_stops or planner.MAX_STOPS, args.max_stint,
+                                     max_driver_laps, caution, args.stops_used)
+    best = pit_planner.plan(args.from_lap, args.tire_age, args.stops_used, planner.driverLaps(model, args.driver_hours))
+    if not best["stops"] and best["expected"] == float("inf"):
+        sys.exit("no schedule finishes the race within the limits")
+    rows, last = [], args.from_lap - args.tire_age - 1
+    for k, lap in enumerate(best["stops"], args.stops_used + 1):
+        rows.append((k, lap, lap - last, lap in best["driver changes"]))
+        last = lap
+    printTable(["Stop", "Lap", "Stint laps", "Driver change"], rows, args.format)
+    if args.format == "text":
+        print("expected %.1f s to the end of lap %d" % (best["expected"], to_lap))
+
+
+def undercutCommand(args):
+    ra = raceAnalysis(args)
+    laprange = lapRange(args, ra)
+    table = ra.undercut(args.class_, laprange).table(args.cars, max_gap=args.max_gap)
+    if args.works:
+        table = table[table["Undercut"] | table["Overcut"]]
+    printTable(list(table.columns), table.itertuples(index=False), args.format)
+
+
+def buildFeaturesCommand(args):
+    import shards
+    start = time.perf_counter()
+    manifest = shards.writeShards(args.source, args.out, args.class_, args.top, args.rows_per_shard, args.workers)
+    rows = [[e["race"], e["rows"], e["positives"], len(e["files"])] for e in manifest["races"]]
+    printTable(["Race", "Rows", "Pit next lap", "Shards"], rows, args.format)
+    print("wrote %s in %.2f s" % (args.out, time.perf_counter() - start), file=sys.stderr)
+
+
+def trainCommand(args):
+    import shards
+    import model
+    from inference import exportModel
+    manifest = shards.readManifest(args.shards, verify=True) # stale shards stop here, before training
+    net, means = model.FFNNShards(args.shards, args.test_races, args.epochs, args.batch_size)
+    if args.export:
+        exportModel(net, args.export, manifest["columns"], means)
+        print("exported", args.export, file=sys.stderr)
+    if args.save:
+        net.save(args.save)
+
+
+def predictCommand(args):
+    from inference import PitModel
+    from get_data import Dataset, FEATURE_COLUMNS
+    pit_model = PitModel(args.model)
+    dataset = Dataset(args.race, args.cars or None, args.class_, args.top)
+    probabilities = pit_model.predictColumns(dataset.makeData()[FEATURE_COLUMNS])
+    race = dataset.data
+    rows = [[car, int(lap), round(float(p), 4)]
+            for car, lap, p in zip(race.names("Car", race.car), race.lap, probabilities)]
+    if args.last:
+        last = {}
+        for row in rows:
+            last[row[0]] = row
+        rows = list(last.values())
+    printTable(["Car", "Lap", "Pit probability"], rows, args.format)
+
+
+def startupCommand(args):
+    """Time `cli.py --help` in fresh interpreters and check no heavy module is imported."""
+    script = os.path.abspath(__file__)
+    check = ("import sys, runpy; sys.argv = [%r, '--help']\n"
+             "try: runpy.run_path(%r, run_name='__main__')\n"
+             "except SystemExit: pass\n"
+             "print('heavy:' + ','.join(m for m in %r if m in sys.modules))") % (script, script, HEAVY_MODULES)
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True).stdout
+        times.append(time.perf_counter() - start)
+    heavy = out.rsplit("heavy:", 1)[-1].strip()
+    best = min(times)
+    print("startup %.3f s (budget %.3f s), heavy modules: %s" % (best, args.budget, heavy or "none"))
+    if best > args.budget or heavy:
+        sys.exit(1)
+
+
+def outputArguments():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--format", default="text", choices=["text", "csv", "json"])
+    return parser
+
+
+def raceArguments(parser, cars=True):
+    parser.add_argument("race", nargs="?", default=DEFAULT_RACE, help="timing CSV of the race")
+    parser.add_argument("--class", dest="class_", default="GTD")
+    if cars:
+        parser.add_argument("--cars", nargs='+', help="car numbers (default: every car that finished)")
+
+
+def makeParser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Pit stop analysis and prediction.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    output = [outputArguments()]
+
+    p = sub.add_parser("gaps", parents=output, help="gap of every car to the first one (or to the class leader) per lap")
+    raceArguments(p)
+    p.add_argument("--laps", nargs=2, type=int, metavar=("FIRST", "LAST"))
+    p.add_argument("--leader", action='store_true', help="gap to the class leader on each lap instead")
+    p.add_argument("--max-cars", type=int, default=11)
+    p.set_defaults(run=gapsCommand)
+
+    p = sub.add_parser("stints", parents=output, help="every pit stop with its in/out lap, flag and the stint before it")
+    raceArguments(p)
+    p.set_defaults(run=stintsCommand)
+
+    p = sub.add_parser("pits", parents=output, help="pit stops, yellow/green ratio and average stint of the class finishers")
+    raceArguments(p, cars=False)
+    p.set_defaults(run=pitsCommand)
+
+    p = sub.add_parser("degradation", parents=output, help="tire degradation per car or per stint")
+    raceArguments(p)
+    p.add_argument("--method", default="huber", choices=["huber", "ols"])
+    p.add_argument("--per-stint", action='store_true')
+    p.add_argument("--plot", help="save the degradation plot of the first car to this file")
+    p.set_defaults(run=degradationCommand)
+
+    p = sub.add_parser("sectors", parents=output, help="best sectors, theoretical best and sector degradation")
+    raceArguments(p)
+    p.add_argument("--by", default="car", choices=["car", "stint", "driver"])
+    p.add_argument("--window", type=int, default=5, help="clean laps in the rolling sector medians")
+    p.set_defaults(run=sectorsCommand)
+
+    p = sub.add_parser("strategy", parents=output, help="simulate the rest of the race for several stop counts")
+    raceArguments(p)
+    p.add_argument("--from-lap", type=int, default=1)
+    p.add_argument("--to-lap", type=int, help="last lap (default: the last lap of the race)")
+    p.add_argument("--tire-age", type=int, default=0, help="laps on the tires at --from-lap")
+    p.add_argument("--stops", nargs='+', type=int, help="stop counts (default: the fewest feasible and 3 more)")
+    p.add_argument("--scenarios", type=int, default=10000)
+    p.add_argument("--workers", type=int)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(run=strategyCommand)
+
+    p = sub.add_parser("plan", parents=output, help="minimum expected time pit schedule for the rest of the race")
+    raceArguments(p)
+    p.add_argument("--from-lap", type=int, default=1)
+    p.add_argument("--to-lap", type=int, help="last lap (default: the last lap of the race)")
+    p.add_argument("--tire-age", type=int, default=0, help="laps on the tires at --from-lap")
+    p.add_argument("--stops-used", type=int, default=0)
+    p.add_argument("--max-stops", type=int, help="stops allowed in the whole race (default: get_data.MAX_STOPS)")
+    p.add_argument("--max-stint", type=int, help="laps a set of tires lasts (default: from the race)")
+    p.add_argument("--max-driver-hours", type=float, help="longest a driver may stay in the car")
+    p.add_argument("--driver-hours", type=float, default=0.0, help="time the current driver has done")
+    p.add_argument("--yellow-left", type=int, default=0, help="laps left of a caution that is out")
+    p.set_defaults(run=planCommand)
+
+    p = sub.add_parser("undercut", parents=output, help="projected gap and position after a stop against every rival")
+    raceArguments(p)
+    p.add_argument("--laps", nargs=2, type=int, metavar=("FIRST", "LAST"))
+    p.add_argument("--max-gap", type=float, default=30.0, help="only rivals within this many seconds")
+    p.add_argument("--works", action='store_true', help="only the pairs where the undercut or overcut works")
+    p.set_defaults(run=undercutCommand)
+
+    p = sub.add_parser("build-features", parents=output, help="write training shards of every race in SOURCE")
+    p.add_argument("source", nargs="?", default="./data", help="directory, manifest file or CSV")
+    p.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".shards"))
+    p.add_argument("--class", dest="class_", default="GTD")
+    p.add_argument("--top", type=int, default=10)
+    p.add_argument("--rows-per-shard", type=int, default=65536)
+    p.add_argument("--workers", type=int)
+    p.set_defaults(run=buildFeaturesCommand)
+
+    p = sub.add_parser("train", parents=output, help="train the FFNN on the shards, holding out whole races")
+    p.add_argument("--shards", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".shards"))
+    p.add_argument("--test-races", nargs='+')
+    p.add_argument("--epochs", type=int, default=10)
+    p.add_argument("--batch-size", type=int, default=256)
+    p.add_argument("--export", default="pit_model.npz", help="NumPy model file for predict ('' to skip)")
+    p.add_argument("--save", help="also save the Keras model here")
+    p.set_defaults(run=trainCommand)
+
+    p = sub.add_parser("predict", parents=output, help="pit probability of every lap (or the last one) of the tracked cars")
+    p.add_argument("model", help=".npz written by train --export")
+    raceArguments(p)
+    p.add_argument("--top", type=int, default=10)
+    p.add_argument("--last", action='store_true', help="only the latest lap of every car")
+    p.set_defaults(run=predictCommand)
+
+    p = sub.add_parser("startup", parents=output, help="check the start-up time budget")
+    p.add_argument("--budget", type=float, default=STARTUP_BUDGET)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(run=startupCommand)
+    return parser
+
+
+def main(argv=None):
+    args = makeParser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Tire degradation of every stint of every car, fitted in one pass.
+
+A stint is a run of clean laps: neither the lap nor the one before it was
+under yellow or in the pits (the same laps Pit.tireDegradation keeps). Each stint
+gets a straight line lap time = intercept + slope * session hours, fitted
+for all stints at once from per-stint sums (ordinary least squares) or with
+a few rounds of iteratively reweighted least squares for a Huber fit.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def segmentSums(seg, n_segs, x, y, w):
+    sw = np.bincount(seg, w, n_segs)
+    sx = np.bincount(seg, w*x, n_segs)
+    sy = np.bincount(seg, w*y, n_segs)
+    sxx = np.bincount(seg, w*x*x, n_segs)
+    sxy = np.bincount(seg, w*x*y, n_segs)
+    return sw, sx, sy, sxx, sxy
+
+
+def weightedLines(seg, n_segs, x, y, w):
+    """Slope and intercept of the weighted least squares line of every segment."""
+    sw, sx, sy, sxx, sxy = segmentSums(seg, n_segs, x, y, w)
+    with np.errstate(all='ignore'):
+        denom = sw*sxx - sx*sx
+        slope = np.where(denom > 0, (sw*sxy - sx*sy) / denom, 0.0)
+        intercept = (sy - slope*sx) / sw
+    return slope, intercept
+
+
+def segmentMedian(seg, starts, counts, values):
+    """Median of values within every segment (rows of a segment are contiguous)."""
+    ordered = values[np.lexsort((values, seg))]
+    lo = ordered[starts + (counts - 1) // 2]
+    hi = ordered[starts + counts // 2]
+    return (lo + hi) / 2
+
+
+def huberLines(seg, starts, counts, x, y, epsilon=1.35, iterations=20, tol=1e-6):
+    """Batched IRLS Huber fit, starting from the least squares lines."""
+    n_segs = len(counts)
+    w = np.ones(len(x))
+    slope, intercept = weightedLines(seg, n_segs, x, y, w)
+    for _ in range(iterations):
+        residual = np.abs(y - intercept[seg] - slope[seg]*x)
+        scale = 1.4826 * segmentMedian(seg, starts, counts, residual)
+        limit = (epsilon * scale)[seg]
+        with np.errstate(all='ignore'):
+            w = np.where((residual > limit) & (limit > 0), limit / residual, 1.0)
+        new_slope, new_intercept = weightedLines(seg, n_segs, x, y, w)
+        done = np.allclose(new_slope, slope, atol=tol) and np.allclose(new_intercept, intercept, atol=tol)
+        slope, intercept = new_slope, new_intercept
+        if done:
+            break
+    return slope, intercept
+
+
+def cleanLaps(race, index, cars=None):
+    """
+    Row positions (cars in lap order) and mask of the laps used for the fits:
+    not the first lap of a car, and neither the lap nor the one before it
+    under yellow or in the pits.
+    """
+    car_rows = index.car_rows if cars is None else [index.carRows(c) for c in cars]
+    order = np.concatenate(car_rows) if car_rows else np.arange(0)
+    car = race.car[order]
+    first = np.r_[True, car[1:] != car[:-1]]
+    dirty = race.mask("Flag", "Yellow")[order] | race.mask("Location", "Pit")[order]
+    clean = ~dirty & ~first & ~np.r_[False, dirty[:-1]]
+    return order, first, clean
+
+
+def referenceLaps(race, index):
+    """Median clean lap time of every car (by car code), NaN for a car without clean laps."""
+    order, _, clean = cleanLaps(race, index)
+    rows = order[clean]
+    reference = np.full(len(race.categories["Car"]), np.nan)
+    car = race.car[rows]
+    if len(rows):
+        counts = np.bincount(car, minlength=len(reference))
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        has = counts > 0
+        reference[has] = segmentMedian(car, starts[has], counts[has], race.lap_time[rows])
+    return reference
+
+
+def fitStints(race, index, cars=None, method="huber", min_laps=3):
+    """
+    Degradation table with one row per stint of at least min_laps clean laps:
+    Car, Stint (per car, from 0), first/last lap, laps, start time (h),
+    slope (s of lap time per hour), intercept (lap time at the start of the
+    stint) and spread (standard deviation of the residuals).
+    """
+    order, first, clean = cleanLaps(race, index, cars)
+    prev_clean = np.r_[False, clean[:-1]] & ~first
+    start = clean & ~prev_clean
+
+    rows = order[clean]
+    seg = np.cumsum(start)[clean] - 1
+    counts = np.bincount(seg) if len(seg) else np.zeros(0, dtype=np.int64)
+    keep = counts >= min_laps
+    rows, seg = rows[keep[seg]], seg[keep[seg]]
+    seg = np.cumsum(np.r_[True, seg[1:] != seg[:-1]]) - 1 if len(seg) else seg
+    counts = np.bincount(seg) if len(seg) else np.zeros(0, dtype=np.int64)
+    starts = np.r_[0, np.cumsum(counts)[:-1]].astype(np.int64)
+
+    hours = race.session_time[rows] / 3600
+    start_hour = hours[starts] if len(starts) else hours[:0]
+    x = hours - start_hour[seg] # fit from the start of the stint for precision
+    y = race.lap_time[rows]
+
+    if method == "huber":
+        slope, intercept = huberLines(seg, starts, counts, x, y)
+    elif method == "ols":
+        slope, intercept = weightedLines(seg, len(counts), x, y, np.ones(len(x)))
+    else:
+        raise ValueError("method has to be 'huber' or 'ols'")
+
+    residual = y - intercept[seg] - slope[seg]*x
+    with np.errstate(all='ignore'):
+        spread = np.sqrt(np.bincount(seg, residual**2, len(counts)) / np.maximum(counts - 2, 1))
+
+    ends = starts + counts - 1
+    car = race.car[rows[starts]] if len(starts) else np.zeros(0, dtype=np.int32)
+    car_start = np.r_[True, car[1:] != car[:-1]]
+    stint = np.arange(len(car)) - np.maximum.accumulate(np.where(car_start, np.arange(len(car)), 0))
+    return pd.DataFrame({"Car": race.names("Car", car),
+                         "Stint": stint,
+                         "First lap": race.lap[rows[starts]] if len(starts) else [],
+                         "Last lap": race.lap[rows[ends]] if len(starts) else [],
+                         "Laps": counts,
+                         "Start time": start_hour,
+                         "Slope": slope,
+                         "Intercept": intercept,
+                         "Spread": spread})
+
+
+def trendLine(race, stints, rows, car):
+    """Fitted lap time on every row of car in rows (lap order), NaN outside the fitted stints."""
+    hours = race.session_time[rows] / 3600
+    laps = race.lap[rows]
+    trend = np.full(len(rows), np.nan)
+    mine = stints[stints["Car"] == car]
+    for first, last, start, slope, intercept in zip(mine["First lap"], mine["Last lap"], mine["Start time"],
+                                                    mine["Slope"], mine["Intercept"]):
+        inside = (laps >= first) & (laps <= last)
+        trend[inside] = intercept + slope * (hours[inside] - start)
+    return trend
+
+
+def carDegradation(stints):
+    """Average positive stint slope of every car, the number tireDegradation reports."""
+    rising = stints[stints["Slope"] > 0]
+    return rising.groupby("Car", sort=False)["Slope"].mean()
+
+
+if __name__ == "__main__":
+    import time
+    import analysis
+    ra = analysis.RaceAnalysis()
+    start = time.perf_counter()
+    stints = fitStints(ra.race, ra.index)
+    print("%d stints in %.1f ms" % (len(stints), (time.perf_counter() - start) * 1000))
+    print(stints.head(10))
+    print(carDegradation(stints))
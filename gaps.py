@@ -0,0 +1,97 @@
+"""
+Cars x laps session-time matrix for gap traces.
+
+times[c, lap] is the session time (s) at which car c completed lap, NaN if
+it never did. Every gap series is then a subtraction between rows of the
+matrix, and a lap missing on either side repeats the last known gap.
+"""
+
+import numpy as np
+
+
+def forwardFill(values):
+    """Replace NaNs along the last axis by the last valid value before them."""
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(values.shape[-1]), 0)
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    filled = np.take_along_axis(values, idx, axis=-1)
+    # nothing to repeat before the first valid value
+    filled[np.cumsum(valid, axis=-1) == 0] = np.nan
+    return filled
+
+
+def lapSpans(mask, laps):
+    """[first, last] lap of every run of True in mask (laps[i] is the lap of mask[i])."""
+    edges = np.diff(np.r_[0, mask.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return [[int(laps[s]), int(laps[e])] for s, e in zip(starts, ends)]
+
+
+class GapMatrix:
+    def __init__(self, race, index):
+        self.race = race
+        n_cars = len(race.categories["Car"])
+        self.max_lap = int(race.lap.max()) if len(race) else 0
+        self.times = np.full((n_cars, self.max_lap + 1), np.nan)
+        self.flags = np.full((n_cars, self.max_lap + 1), -1, dtype=np.int32)
+
+        # the first crossing of a lap wins if the timing feed logged it twice
+        order = np.concatenate(index.car_rows)
+        keys = race.car[order].astype(np.int64) * (self.max_lap + 1) + race.lap[order]
+        _, first = np.unique(keys, return_index=True)
+        rows = order[first]
+        self.times[race.car[rows], race.lap[rows]] = race.session_time[rows]
+        self.flags[race.car[rows], race.lap[rows]] = race.flag[rows]
+
+        # class of every car, taken from its first row
+        self.car_class = np.full(n_cars, -1, dtype=np.int32)
+        for c, car_rows in enumerate(index.car_rows):
+            if len(car_rows):
+                self.car_class[c] = race.class_[car_rows[0]]
+
+    def codes(self, cars):
+        """Car codes of the car names, KeyError naming any car not in the race."""
+        codes = np.array([self.race.code("Car", c) for c in cars], dtype=np.intp)
+        if (codes < 0).any():
+            raise KeyError("cars not in the race: %s" % ", ".join(str(c) for c, code in zip(cars, codes) if code < 0))
+        return codes
+
+    def laps(self, laprange):
+        """Laps of laprange that exist in the race, the x values of every series."""
+        return np.arange(laprange[0], min(laprange[1], self.max_lap) + 1)
+
+    def lapSlice(self, laprange):
+        return slice(laprange[0], min(laprange[1], self.max_lap) + 1)
+
+    def gap(self, car, ref, laprange):
+        """Gap (s) of car behind ref on every lap of laprange."""
+        return self.gaps([car], ref, laprange)[0]
+
+    def gaps(self, cars, ref, laprange):
+        """len(cars) x laps gaps of every car to the reference car."""
+        laps = self.lapSlice(laprange)
+        times = self.times[self.codes(cars), laps]
+        ref_times = self.times[self.codes([ref])[0], laps]
+        return forwardFill(times - ref_times)
+
+    def gapToLeader(self, cars, laprange, class_=None):
+        """
+        Gap of every car to whoever completed each lap first, among the cars of
+        class_ (the whole field if None).
+        """
+        laps = self.lapSlice(laprange)
+        field = self.times if class_ is None else self.times[self.car_class == self.race.code("Class", class_)]
+        with np.errstate(all='ignore'):
+            leader = np.nanmin(field[:, laps], axis=0) if len(field) else np.nan
+        return forwardFill(self.times[self.codes(cars), laps] - leader)
+
+    def pairwise(self, cars, laprange):
+        """cars x cars x laps matrix, [i, j] is the gap of cars[i] to cars[j]."""
+        times = self.times[self.codes(cars), self.lapSlice(laprange)]
+        return forwardFill(times[:, None, :] - times[None, :, :])
+
+    def yellowLaps(self, cars, laprange):
+        """Laps of laprange where any of the cars was under a yellow flag."""
+        flags = self.flags[self.codes(cars), self.lapSlice(laprange)]
+        return (flags == self.race.code("Flag", "Yellow")).any(axis=0)
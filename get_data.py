@@ -1,6 +1,9 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import pandas as pd
-import csv
+from race import loadRace, RaceIndex, finishingOrder
+from pits import extractPitStops
+from running import RunningOrder
 
 CAR_POSITIONS_2023 = ['27','44','70','66','12','93','78','1','16','023','77','19','57','80','32','91','96','83','21','42','92','75','47']
 
@@ -8,204 +11,233 @@ CAR_POSITIONS_2022 = ["16", "44", "32", "21", "70", "57", "64", "71",
                       "27", "99", "19", "98", "66", "47", "12", "42",
                       "39", "96", "59", "28", "75", "34"]
 
+RACE_SECONDS = 90000 # times are scaled by this before going into the model
+MAX_GAP = 2 # seconds to the car behind for "Is close ahead"
+MAX_STOPS = 25
+
+FEATURE_COLUMNS = ["Race Progress", "Tire age", "Driver duration", "Remaing pit stops",
+                   "Yellow flag", "Position", "Laps down", "Is close ahead", "Pursuer tire change"]
+NUMERICAL_COLUMNS = ["Race Progress", "Tire age", "Driver duration", "Position", "Laps down"]
+CATEGORICAL_COLUMNS = ["Yellow flag", "Is close ahead", "Pursuer tire change"]
+LABEL_COLUMN = "Pit next lap"
+
+# Bump whenever a feature, the label or encode changes so stored training shards are rebuilt
+# and models exported with older features are refused.
+# pandas is only imported where a frame is built, so inference can check this without it.
+FEATURE_VERSION = 2
+
 class Dataset:
-    def __init__(self, path, all_cars):
-        _, self.data = self.read_data(path)
-        self.all_cars = all_cars[:10]
-        self.filterGTDdata()
-        self.fixSessionTimes()
-        self.sessionTimeToSeconds()
+    def __init__(self, path, all_cars=None, class_="GTD", top=10):
+        """
+        all_cars is the finishing order of the class, derived from the
+        timing data when not given. Only the first `top` cars are kept."""
+        self.data = loadRace(path)
+        # running order of the whole field, before filtering leaves only the top cars;
+        # self.rows maps the rows of self.data back to it
+        self.field = self.data
+        self.running = RunningOrder(self.field, RaceIndex(self.field))
+        self.rows = np.arange(len(self.field))
+        self.class_ = class_
+        if all_cars is None:
+            all_cars = finishingOrder(self.data, class_)
+        self.all_cars = all_cars[:top]
+        self.filterClassData()
+        self.sortByLap()
+        self.index = RaceIndex(self.data)
+        self.pits = extractPitStops(self.data, self.index)
         # make data for all GTD cars first then use only top 10 to train the model.
 
 
-    def fixSessionTimes(self):
-        hour = 0
-        self.data[0][5] = '0:' + self.data[0][5]
-        data_copy = self.data
-        for i in range(1, len(self.data)):
-            try:
-                if int(self.data[i-1][5].split(':')[1]) > int(self.data[i][5].split(':')[0]):
-                    hour += 1
-                self.data[i][5] = str(hour)+':'+self.data[i][5]
-            except:
-                print(i)
+    def filterClassData(self):
+        car_codes = [self.data.code("Car", c) for c in self.all_cars]
+        keep = self.data.mask("Class", self.class_) & np.isin(self.data.car, car_codes)
+        self.data = self.data.take(keep)
+        self.rows = self.rows[keep]
+
 
+    def sortByLap(self):
+        # session times are already in seconds (see race.readRace), order by lap then time
+        order = np.lexsort((self.data.session_time, self.data.lap))
+        self.data = self.data.take(order)
+        self.rows = self.rows[order]
 
-    def read_data(self, path):
+
+    def carOrder(self):
+        """
+        Row positions grouped by car, each car in lap order, and a mask of the
+        first row of every car in that order.
         """
-        Read the CSV file and return the header (column names) and the data
-        Path: ./CSV and Replay/WeatherTech Championship Daytona Race.csv"""
-        try:
-            file = open(path)
-            reader = csv.reader(file)
-            header = next(reader)
-            data = []
-            for row in reader:
-                data.append(row)
-            return header, data
-        except(FileNotFoundError):
-            print("Wrong file path or the file is missing")
-
-
-    def filterGTDdata(self):
-        temp = []
-        for d in self.data:
-            if d[1] == "GTD" and (d[0] in self.all_cars):
-                temp.append(d)
-        self.data = temp 
+        order = np.concatenate(self.index.car_rows)
+        car = self.data.car[order]
+        return order, np.r_[True, car[1:] != car[:-1]]
 
 
     def getRaceProgress(self):
-        race_progress = []        
-        for d in self.data:
-            seconds = d[5]
-            race_progress.append(seconds / 90000)
-        return race_progress    
+        return self.data.session_time / RACE_SECONDS
     
 
     def getTireAge(self):
         # assuming a new tire set every pit stop
         # ** many times consecutive pit stops are made very close to each other **
-        tire_age = []
-        most_recent_tire_time = {}
-        for c in self.all_cars:
-            most_recent_tire_time[c] = 0
-        for d in self.data:
-            mins, sec = d[4].split(':')
-            seconds = (int(mins)*60) + (float(sec))
-            if d[7] == "Track":
-                if d[6] == "Yellow":
-                    tire_age.append(most_recent_tire_time[d[0]] + (seconds / 90000)*0.75)
-                    most_recent_tire_time[d[0]] += (seconds / 90000)*0.75
-                else:
-                    tire_age.append(most_recent_tire_time[d[0]] + (seconds / 90000))
-                    most_recent_tire_time[d[0]] += seconds / 90000
-
-            else:
-                tire_age.append(0)
-                most_recent_tire_time[d[0]] = 0
+        # tire age restarts after every stop, stints are told apart by the number of stops started.
+        wear = self.data.lap_time / RACE_SECONDS
+        wear[self.data.mask("Flag", "Yellow")] *= 0.75
+        in_pit = self.data.mask("Location", "Pit")
+        wear[in_pit] = 0
+
+        order, first_of_car = self.carOrder()
+        stint = self.pits.stopsStarted()[order]
+        first = first_of_car | np.r_[True, stint[1:] != stint[:-1]]
+        tire_age = np.empty(len(self.data))
+        tire_age[order] = groupCumsum(wear[order], first)
+        tire_age[in_pit] = 0
         return tire_age             
         
 
     def getYellowFlag(self):
-        yellow_flags = []
-        for d in self.data:
-            if d[6] == "Yellow":
-                yellow_flags.append(True)
-            else:
-                yellow_flags.append(False)
-        return yellow_flags
+        return self.data.mask("Flag", "Yellow")
     
 
     def getDriverDuration(self):
-        driver_duration = []
-        driver_change_time = {}
-        for c in self.all_cars:            
-            driver_change_time[c] = [None, 0]
-
-        for d in self.data:
-            seconds = d[5]
-            if d[7] == "Track":
-                if d[2] != driver_change_time[d[0]][0]:
-                    # driver was changed in the pit
-                    driver_change_time[d[0]] = [d[2], seconds]
-
-            driver_duration.append((seconds-driver_change_time[d[0]][1]) / 90000)
+        # the driver is taken as changed on the first lap back on track with a new name
+        order, first_of_car = self.carOrder()
+        driver = self.data.driver[order]
+        seconds = self.data.session_time[order]
+        on_track = np.flatnonzero(self.data.location[order] == self.data.code("Location", "Track"))
+
+        new_driver = first_of_car[on_track].copy()
+        new_driver[1:] |= driver[on_track[1:]] != driver[on_track[:-1]]
+        changed = np.zeros(len(order), dtype=bool)
+        changed[on_track[new_driver]] = True
+
+        # session time of the last change of the same car, 0 before its first one
+        last_change = np.maximum.accumulate(np.where(changed, np.arange(len(order)), -1))
+        car_start = np.maximum.accumulate(np.where(first_of_car, np.arange(len(order)), 0))
+        change_time = np.where(last_change >= car_start, seconds[np.maximum(last_change, 0)], 0)
+
+        driver_duration = np.empty(len(self.data))
+        driver_duration[order] = (seconds - change_time) / RACE_SECONDS
         return driver_duration
     
 
     def getPosition(self):
-        positions = []
-        leading_cars = [None]
-        current_lap = '0'
-        for d in self.data:
-            if d[3] != current_lap:
-                leading_cars.append(d[0])
-                current_lap = d[3]
-        for d in self.data:
-            if d[0] == leading_cars[int(d[3])]:
-                positions.append('leader')
-            else:
-                positions.append('pursuer')
-        return positions
-    
+        # class position among every car of the class, not only the kept ones
+        return self.running.position[self.rows]
+
+
+    def getLapsDown(self):
+        return self.running.laps_down[self.rows]
+
 
     def getCloseAhead(self):
-        close_ahead = []
-        all_pursuers = [None]
-        car_and_pursuer_gaps = {}
-        MAX_GAP = 2
-
-        for d in range(len(self.data)-1):
-
-            if self.data[d][3] == self.data[d+1][3]:
-                car_and_pursuer_gaps[self.data[d][0]] = (self.data[d+1][5]-self.data[d][5])
-            else:
-                car_and_pursuer_gaps[self.data[d][0]] = 5 # Random value higher than 2.
-                all_pursuers.append(car_and_pursuer_gaps)
-                car_and_pursuer_gaps = {}
-
-        car_and_pursuer_gaps[self.data[-1][0]] = 5        
-        all_pursuers.append(car_and_pursuer_gaps)
-
-        for d in self.data:
-            if (d[0] in all_pursuers[int(d[3])]) and all_pursuers[int(d[3])][d[0]] < MAX_GAP:
-                close_ahead.append(True)
-            else:
-                close_ahead.append(False)    
-        return close_ahead
-    
+        # the car behind in the class is within MAX_GAP, none for the last car of the lap
+        return self.running.interval_behind[self.rows] < MAX_GAP
+
 
     def getPursuerTireChange(self):
-        pursuer_tire_change = []
-        car_tire_change = {} 
-        for c in self.all_cars:
-            car_tire_change[c] = False
-        
-        for d in range(len(self.data)-1):
-            if self.data[d][3] == self.data[d+1][3]:
-                pursuer_tire_change.append(car_tire_change[self.data[d+1][0]])
-                if self.data[d+1][7] == "Pit":
-                    car_tire_change[self.data[d+1][0]] = True
-                else:
-                    car_tire_change[self.data[d+1][0]] = False
-            else:
-                pursuer_tire_change.append(False) # There is no pursuer behind / last car.
-        pursuer_tire_change.append(False)
-
-        return pursuer_tire_change
-    
+        # whether the car behind in the class was in the pit on its previous crossing
+        behind = self.running.behind[self.rows]
+        previous = np.where(behind >= 0, self.running.previous[behind], -1)
+        pit = self.field.mask("Location", "Pit")
+        return (previous >= 0) & pit[previous]
+
 
     def getRemainingPitStops(self):
-        MAX_STOPS = 25
-        completed_stops = {}
-        remaining_stops = []
-        for c in self.all_cars:
-            completed_stops[c] = 0
-        for d in self.data:
-            if d[7] == "Pit":
-                completed_stops[d[0]] += 1
-            remaining_stops.append(MAX_STOPS-completed_stops[d[0]])
-        return remaining_stops        
-
-
-    def sessionTimeToSeconds(self):
-        for d in self.data:
-            hours, mins, secs = d[5].split(':')
-            seconds = int(hours)*60*60 + int(mins)*60 + float(secs)
-            d[5] = seconds
-        self.data.sort(key = lambda x: (x[3], x[5]))
+        return MAX_STOPS - self.pits.stopsStarted()
+
+
+    def getPitNextLap(self):
+        # label: the car is on track now and its next crossing is in the pit lane
+        order, first_of_car = self.carOrder()
+        pit = self.data.mask("Location", "Pit")[order]
+        enters = np.zeros(len(order), dtype=bool)
+        enters[:-1] = pit[1:] & ~pit[:-1] & ~first_of_car[1:]
+        pit_next_lap = np.empty(len(self.data), dtype=bool)
+        pit_next_lap[order] = enters
+        return pit_next_lap
 
 
     def makeData(self):
-        df = pd.DataFrame((self.getRaceProgress(), self.getTireAge(), self.getDriverDuration(),
-                                   self.getRemainingPitStops(), self.getYellowFlag(), self.getPosition(),
-                                   self.getCloseAhead(), self.getPursuerTireChange()))
-        columns = ["Race Progress", "Tire age", "Driver duration", "Remaing pit stops",
-                                    "Yellow flag", "Position", "Is close ahead", "Pursuer tire change"]
-        df = df.transpose()
-        df.columns = columns
-        return df
+        import pandas as pd
+        features = (self.getRaceProgress(), self.getTireAge(), self.getDriverDuration(),
+                    self.getRemainingPitStops(), self.getYellowFlag(), self.getPosition(), self.getLapsDown(),
+                    self.getCloseAhead(), self.getPursuerTireChange())
+        return pd.DataFrame(dict(zip(FEATURE_COLUMNS, features)))
+
+
+def groupCumsum(values, group_start):
+    """
+    Cumulative sum of values that restarts wherever group_start is True.
+    NaN values (malformed lap times) add nothing, so they never spread into
+    the rest of the sum."""
+    values = np.nan_to_num(values, nan=0.0)
+    total = np.cumsum(values)
+    before = np.maximum.accumulate(np.where(group_start, total - values, -np.inf))
+    return total - before
+
+
+def numericalMeans(data):
+    return data[NUMERICAL_COLUMNS].mean().to_dict()
+
+
+def normalizeNumericalData(data, means=None):
+    """Center the numerical features, on their own means unless training means are given."""
+    numerical_data_mean = numericalMeans(data) if means is None else means
+    for column in NUMERICAL_COLUMNS:
+        data[column] -= numerical_data_mean[column]
+    return data
+
+
+def encode(data):
+    # fixed categories so every race gets the same dummy columns
+    import pandas as pd
+    data = data.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if data[column].dtype == bool:
+            data[column] = pd.Categorical(data[column], categories=[False, True])
+    return pd.get_dummies(data, columns=CATEGORICAL_COLUMNS)
+
+
+def racePaths(source):
+    """
+    CSV paths of the races in source: a directory (every *.csv in it), a
+    manifest file with one CSV path per line (relative to the manifest, #
+    starts a comment) or a list of paths."""
+    if isinstance(source, (list, tuple)):
+        return list(source)
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, f) for f in os.listdir(source) if f.lower().endswith(".csv"))
+    base = os.path.dirname(source)
+    with open(source) as file:
+        lines = [line.split('#')[0].strip() for line in file]
+    return [os.path.join(base, line) for line in lines if line]
+
+
+def raceId(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def buildRace(path, class_="GTD", top=10):
+    """Feature frame of one race with a "Race" column identifying it and the label."""
+    dataset = Dataset(path, class_=class_, top=top)
+    df = dataset.makeData()
+    df.insert(0, "Race", raceId(path))
+    df[LABEL_COLUMN] = dataset.getPitNextLap()
+    return df
+
+
+def buildDataset(source, class_="GTD", top=10, workers=None):
+    """
+    Build the feature frame of every race in source (see racePaths) in a
+    process pool and concatenate them into one training set.
+    The finishing order of every race is derived from its own data."""
+    import pandas as pd
+    paths = racePaths(source)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(buildRace, paths, [class_]*len(paths), [top]*len(paths)))
+    data = pd.concat(frames, ignore_index=True)
+    data["Race"] = pd.Categorical(data["Race"], categories=[raceId(p) for p in paths])
+    return data
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+"""
+TensorFlow-free inference for trained pit models.
+
+exportModel writes the Dense weights of a trained Keras FFNN together with
+the encoding schema (the encoded column names, which columns are
+numerical/categorical) and the normalization means into one .npz file.
+PitModel loads that file with NumPy only and runs batched forward passes,
+so predicting needs neither TensorFlow nor pandas to be imported.
+
+    exportModel(model, "pit_model.npz", columns, means)   # where Keras is available
+    PitModel("pit_model.npz").predictRecords(vectors)     # live.LiveFeatures vectors
+"""
+
+import json
+
+import numpy as np
+
+EXPORT_VERSION = 1
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 0.5 * (1 + np.tanh(0.5 * x)), # overflow free logistic
+    "tanh": np.tanh,
+}
+
+
+def exportModel(model, path, columns, means, numerical=None, categorical=None):
+    """
+    Write the Dense layers of a Keras model, the encoded column order and
+    the numerical means it was trained with to path (.npz).
+    """
+    import get_data
+    numerical = list(numerical or get_data.NUMERICAL_COLUMNS)
+    categorical = list(categorical or get_data.CATEGORICAL_COLUMNS)
+    arrays = {}
+    activations = []
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if not weights:
+            continue
+        activation = layer.get_config().get("activation", "linear")
+        if activation not in ACTIVATIONS:
+            raise ValueError("layer %s: activation %s has no NumPy version" % (layer.name, activation))
+        kernel, bias = weights
+        arrays["W%d" % len(activations)] = kernel.astype(np.float32)
+        arrays["b%d" % len(activations)] = bias.astype(np.float32)
+        activations.append(activation)
+    if arrays["W0"].shape[0] != len(columns):
+        raise ValueError("model takes %d inputs but %d columns were given" % (arrays["W0"].shape[0], len(columns)))
+
+    schema = {"version": EXPORT_VERSION, "feature_version": get_data.FEATURE_VERSION,
+              "columns": list(columns), "means": {c: float(means[c]) for c in numerical},
+              "numerical": numerical, "categorical": categorical, "activations": activations}
+    np.savez_compressed(path, schema=np.frombuffer(json.dumps(schema).encode(), dtype=np.uint8), **arrays)
+
+
+class PitModel:
+    """A model written by exportModel, evaluated with NumPy."""
+
+    def __init__(self, path):
+        import get_data
+        with np.load(path) as file:
+            self.schema = json.loads(file["schema"].tobytes().decode())
+            if self.schema["version"] != EXPORT_VERSION:
+                raise ValueError("%s was exported with version %d" % (path, self.schema["version"]))
+            if self.schema.get("feature_version") != get_data.FEATURE_VERSION:
+                raise ValueError("%s was trained on feature version %s, features are now version %d, "
+                                 "retrain it" % (path, self.schema.get("feature_version"), get_data.FEATURE_VERSION))
+            n = len(self.schema["activations"])
+            self.weights = [file["W%d" % k] for k in range(n)]
+            self.biases = [file["b%d" % k] for k in range(n)]
+        self.activations = [ACTIVATIONS[a] for a in self.schema["activations"]]
+        self.columns = self.schema["columns"]
+        self.offset = np.array([self.schema["means"].get(c, 0.0) for c in self.columns], dtype=np.float32)
+
+        # encoded column -> (feature, dummy value or None)
+        self.sources = []
+        for column in self.columns:
+            feature = next((c for c in self.schema["categorical"] if column.startswith(c + "_")), None)
+            if feature is None:
+                self.sources.append((column, None))
+            else:
+                self.sources.append((feature, column[len(feature) + 1:]))
+
+    def predict(self, X):
+        """Pit probabilities of encoded, normalized rows (n x columns)."""
+        x = np.asarray(X, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        for W, b, activation in zip(self.weights, self.biases, self.activations):
+            x = activation(x @ W + b)
+        return x.reshape(-1)
+
+    def encodeColumns(self, features):
+        """
+        Encoded, normalized rows from a mapping of feature name -> values
+        (a DataFrame of FEATURE_COLUMNS works), the same as
+        normalizeNumericalData(encode(...)) with the training means.
+        """
+        n = len(next(iter(features.values())) if isinstance(features, dict) else features)
+        X = np.empty((n, len(self.columns)), dtype=np.float32)
+        for k, (feature, dummy) in enumerate(self.sources):
+            values = np.asarray(features[feature])
+            if dummy is None:
+                X[:, k] = values
+            else:
+                X[:, k] = values.astype(str) == dummy
+        return X - self.offset
+
+    def encodeRecords(self, records):
+        """Encoded, normalized rows of a list of feature dicts (e.g. live.LiveFeatures vectors)."""
+        features = {feature: [r[feature] for r in records] for feature in {f for f, _ in self.sources}}
+        return self.encodeColumns(features)
+
+    def predictColumns(self, features):
+        return self.predict(self.encodeColumns(features))
+
+    def predictRecords(self, records):
+        return self.predict(self.encodeRecords(records))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Time loading an exported model and a batched forward pass.")
+    parser.add_argument("model", help=".npz written by exportModel")
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pit_model = PitModel(args.model)
+    loaded = time.perf_counter()
+    X = np.random.default_rng(0).normal(size=(args.rows, len(pit_model.columns))).astype(np.float32)
+    pit_model.predict(X)
+    print("load %.1f ms, %d rows in %.1f ms" % ((loaded - start) * 1000, args.rows,
+                                              (time.perf_counter() - loaded) * 1000))
@@ -0,0 +1,247 @@
+"""
+Incremental version of the Dataset features for live timing.
+
+LiveFeatures takes one timing row at a time, in the order the rows come off
+the timing feed, and keeps O(1) state per car plus the crossings of every
+lap. Every update returns the feature vector of the car that just crossed
+the line straight away. The running order features follow
+running.RunningOrder, so they need every car of the class, tracked or not,
+and the feed can log a crossing a little late (a pit lane crossing comes a
+few seconds after the cars that passed it on track). A crossing is
+therefore settled once the feed is `reorder` seconds past it: then nothing
+can still come in ahead of it, and "Position" and "Laps down" are final
+(the returned vector holds the estimate at the time of the crossing). "Is
+close ahead" and "Pursuer tire change" need the car behind, so the vector
+is completed when the car behind settles (or at flush() if no one does).
+The completed vectors are the same as the rows of Dataset.makeData up to
+float rounding, which replay() checks.
+"""
+
+import bisect
+import heapq
+import math
+
+import numpy as np
+import pandas as pd
+
+from get_data import Dataset, FEATURE_COLUMNS, RACE_SECONDS, MAX_GAP, MAX_STOPS
+from race import loadRace, finishingOrder, parseLapTime
+
+REORDER_SECONDS = 10.0 # how late a crossing may come off the feed
+
+
+class TimingParser:
+    """
+    Turns raw CSV rows of a live feed into the values LiveFeatures.update
+    (and sectors.SectorTracker.update) expects, rebuilding the hour the feed
+    leaves out of the session time.
+    """
+
+    def __init__(self):
+        self.hour = 0
+        self.prev_min = 0
+
+    def parse(self, row):
+        car, class_, driver, lap, lap_time, session_time, flag, location = row[:8]
+        mins, sec = session_time.split(':')
+        if int(mins) < self.prev_min:
+            self.hour += 1
+        self.prev_min = int(mins)
+        seconds = self.hour*60*60 + int(mins)*60 + float(sec)
+        sectors = [parseLapTime(s) if ':' in s else float(s) if s else float("nan") for s in row[8:11]]
+        return [car, class_, driver, int(lap), parseLapTime(lap_time), seconds, flag, location] + sectors
+
+
+class LiveFeatures:
+    def __init__(self, cars=None, class_=None, reorder=REORDER_SECONDS):
+        """
+        Feature vectors are made for the given cars (and class) only, like
+        Dataset's filtering; the running order takes every car of the class.
+        """
+        self.cars = set(cars) if cars is not None else None
+        self.class_ = class_
+        self.reorder = reorder
+        self.rows = 0
+        self.feed_rows = 0
+        self.latest = -np.inf
+
+        # per car
+        self.tire_age = {}
+        self.in_pit = {} # every car of the class
+        self.stops = {}
+        self.driver = {}
+        self.driver_since = {}
+
+        # per (class, lap): the crossings by (session time, feed row), and by car
+        self.lap_keys = {}
+        self.lap_crossings = {}
+        self.lap_cars = {}
+        self.unsettled = [] # heap of (session time, feed row, (class, lap))
+        # per class: most laps completed by any car, over the rows seen and over the settled crossings
+        self.lead_lap = {}
+        self.settled_lap = {}
+
+    def tracks(self, car, class_):
+        return (self.cars is None or car in self.cars) and (self.class_ is None or class_ == self.class_)
+
+    def update(self, row):
+        """
+        row holds Car, Class, Driver, Lap, Lap Time (s), Session Time (s),
+        Flag and Location, e.g. RaceTable.row(i) or TimingParser.parse(line).
+
+        Returns (vector, completed): the features of this crossing, with the
+        car-behind features still False, and the earlier vectors that are
+        now final. None for rows of cars that are not tracked.
+        """
+        car, class_, driver, lap, lap_time, session_time, flag, location = row[:8]
+        if self.class_ is not None and class_ != self.class_:
+            return None, []
+        key = (session_time, self.feed_rows)
+        self.feed_rows += 1
+        self.latest = max(self.latest, session_time)
+        pit = location == "Pit"
+        was_in_pit = self.in_pit.get(car, False)
+        self.in_pit[car] = pit
+        self.lead_lap[class_] = max(self.lead_lap.get(class_, lap), lap)
+
+        # the crossing of the lap, or the first one if the lap is logged twice
+        cars = self.lap_cars.setdefault((class_, lap), {})
+        crossing = cars.get(car)
+        if crossing is None:
+            keys = self.lap_keys.setdefault((class_, lap), [])
+            at = bisect.bisect(keys, key)
+            crossing = {"key": key, "previous pit": was_in_pit, "vectors": [], "done": False,
+                        "values": {"Position": at + 1, "Laps down": self.lead_lap[class_] - lap}}
+            keys.insert(at, key)
+            self.lap_crossings.setdefault((class_, lap), []).insert(at, crossing)
+            cars[car] = crossing
+            heapq.heappush(self.unsettled, key + ((class_, lap),))
+
+        vector = None
+        completed = []
+        if self.tracks(car, class_):
+            if pit:
+                tire_age = 0
+                if not was_in_pit:
+                    self.stops[car] = self.stops.get(car, 0) + 1
+            else:
+                wear = 0.0 if math.isnan(lap_time) else lap_time / RACE_SECONDS # malformed lap time
+                tire_age = self.tire_age.get(car, 0) + (wear*0.75 if flag == "Yellow" else wear)
+            self.tire_age[car] = tire_age
+
+            if location == "Track" and driver != self.driver.get(car):
+                # driver was changed in the pit
+                self.driver[car] = driver
+                self.driver_since[car] = session_time
+
+            vector = {"Row": self.rows, "Car": car, "Lap": lap, "Session Time": session_time,
+                      "Race Progress": session_time / RACE_SECONDS,
+                      "Tire age": tire_age,
+                      "Driver duration": (session_time - self.driver_since.get(car, 0)) / RACE_SECONDS,
+                      "Remaing pit stops": MAX_STOPS - self.stops.get(car, 0),
+                      "Yellow flag": flag == "Yellow",
+                      "Is close ahead": False,
+                      "Pursuer tire change": False}
+            vector.update(crossing["values"])
+            crossing["vectors"].append(vector)
+            self.rows += 1
+            if crossing["done"]:
+                completed.append(vector)
+            vector = dict(vector)
+
+        completed += self.settle(self.latest - self.reorder)
+        return vector, completed
+
+    def settle(self, until):
+        """Settle the crossings before session time until, returning the vectors this completes."""
+        completed = []
+        while self.unsettled and self.unsettled[0][0] < until:
+            session_time, feed_row, (class_, lap) = heapq.heappop(self.unsettled)
+            key = (session_time, feed_row)
+            at = bisect.bisect_left(self.lap_keys[class_, lap], key)
+            crossings = self.lap_crossings[class_, lap]
+            crossing = crossings[at]
+            # settled in session time order, so every earlier crossing of the class is in settled_lap
+            self.settled_lap[class_] = max(self.settled_lap.get(class_, lap), lap)
+            self.finish(crossing, {"Position": at + 1, "Laps down": self.settled_lap[class_] - lap})
+            if at > 0:
+                # the car ahead now has its car behind for good
+                ahead = crossings[at - 1]
+                completed += self.finish(ahead, {"Is close ahead": session_time - ahead["key"][0] < MAX_GAP,
+                                                 "Pursuer tire change": crossing["previous pit"]}, done=True)
+        return completed
+
+    def finish(self, crossing, values, done=False):
+        crossing["values"].update(values)
+        for vector in crossing["vectors"]:
+            vector.update(values)
+        if not done:
+            return []
+        crossing["done"] = True
+        return crossing["vectors"]
+
+    def flush(self):
+        """Settle every crossing and complete the last one of every lap (end of the race)."""
+        completed = self.settle(np.inf)
+        for crossings in self.lap_crossings.values():
+            if not crossings[-1]["done"]:
+                completed += self.finish(crossings[-1], {}, done=True)
+        return completed
+
+
+def replay(path, all_cars=None, class_="GTD", top=10):
+    """
+    Feed a recorded race through LiveFeatures row by row and return the
+    completed vectors in Dataset's row order (lap, then session time).
+    """
+    race = loadRace(path)
+    cars = (all_cars or finishingOrder(race, class_))[:top]
+    engine = LiveFeatures(cars, class_)
+
+    columns = race.columns()
+    decoded = [race.names(c, columns[c]) if c in race.categories else columns[c].tolist()
+               for c in ("Car", "Class", "Driver", "Lap", "Lap Time", "Session Time", "Flag", "Location")]
+    completed = []
+    for row in zip(*decoded):
+        _, done = engine.update(row)
+        completed += done
+    completed += engine.flush()
+
+    df = pd.DataFrame(completed).sort_values("Row")
+    df = df.sort_values(["Lap", "Session Time"], kind='stable', ignore_index=True)
+    return df
+
+
+def mismatches(batch, live, atol=1e-9):
+    """
+    Rows where the replayed vectors differ from the Dataset features, per
+    feature column; float features only differ beyond atol (summation order).
+    """
+    if len(batch) != len(live):
+        raise ValueError("%d feature rows but %d live vectors" % (len(batch), len(live)))
+    counts = {}
+    for column in FEATURE_COLUMNS:
+        expected, actual = batch[column].to_numpy(), live[column].to_numpy()
+        if expected.dtype.kind == 'f':
+            same = np.isclose(expected, actual.astype(float), rtol=0, atol=atol, equal_nan=True)
+        else:
+            same = expected == actual
+        counts[column] = int(np.count_nonzero(~same))
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+    failed = False
+    for year in ("2022", "2023"):
+        path = "./data/Daytona_24hrs_GTD_replay(%s).csv" % year
+        batch = Dataset(path).makeData()
+        live = replay(path)
+        print(path, len(batch), len(live))
+        for column, count in mismatches(batch, live).items():
+            if batch[column].dtype.kind == 'f':
+                print(" ", column, "max diff", np.abs(batch[column] - live[column]).max(), "mismatches", count)
+            else:
+                print(" ", column, "mismatches", count)
+            failed |= count > 0
+    sys.exit(1 if failed else 0)
@@ -2,48 +2,40 @@
 Hybrid neural network will be trained and tested here.
 """
 
-import get_data
-import analysis
-import pandas as pd
+import shards
+from inference import exportModel
 import tensorflow as tf 
 from tensorflow import keras
-from sklearn.utils.class_weight import compute_class_weight
 import numpy as np
 
-def normalizeNumericalData(data):
-    numerical_data_mean = data[["Race Progress", "Tire age", "Driver duration"]].mean()
-    data["Race Progress"] -= numerical_data_mean["Race Progress"]
-    data["Tire age"] -= numerical_data_mean["Tire age"]
-    data["Driver duration"] -= numerical_data_mean["Driver duration"]
-    return data
-
-
-def encode(data):
-    return pd.get_dummies(data, columns=["Yellow flag", "Position", "Is close ahead", "Pursuer tire change"])
-    # print(encoded_data.astype(float)) # might not need to convert all to float
-
-
-
-def FFNN(data):
+def buildModel(n_inputs, layers=(64, 64, 64), l2=0.0005, optimizer="nadam", learning_rate=None, metrics=None):
     num_classes = 1  # Binary classification, so one output node with sigmoid activation
 
     # Model architecture
     model = keras.models.Sequential()
-    model.add(keras.layers.Dense(64, activation='relu', kernel_regularizer=tf.keras.regularizers.l2(0.0005), input_shape=(data.shape[0],)))
-    model.add(keras.layers.Dense(64, activation='relu', kernel_regularizer=tf.keras.regularizers.l2(0.0005)))
-    model.add(keras.layers.Dense(64, activation='relu', kernel_regularizer=tf.keras.regularizers.l2(0.0005)))
+    model.add(keras.Input(shape=(n_inputs,)))
+    for units in layers:
+        model.add(keras.layers.Dense(units, activation='relu', kernel_regularizer=tf.keras.regularizers.l2(l2)))
     model.add(keras.layers.Dense(num_classes, activation='sigmoid'))  # Sigmoid activation for binary classification
 
     # Compile the model
-    optimizer = tf.keras.optimizers.Nadam()
-    model.compile(optimizer=optimizer, loss='binary_crossentropy', metrics=['accuracy'])
+    optimizer = tf.keras.optimizers.get(optimizer)
+    if learning_rate is not None:
+        optimizer.learning_rate = learning_rate
+    model.compile(optimizer=optimizer, loss='binary_crossentropy', metrics=metrics or ['accuracy'])
+    return model
 
-    # Assuming 'y_train' is your training labels
-    # Compute class weights
-    class_weights = compute_class_weight('balanced', classes=np.unique(y_train), y=y_train)
 
-    # Convert class weights to a dictionary for passing to the model
-    class_weight_dict = {0: class_weights[0], 1: class_weights[1]}
+def classWeights(y_train):
+    # 'balanced' class weights, the same as compute_class_weight('balanced', ...) on both classes;
+    # unit weights when y_train has a single class
+    y_train = np.asarray(y_train)
+    return shards.balancedWeights(len(y_train), int(np.count_nonzero(y_train)))
+
+
+def FFNN(X_train, y_train, X_test, y_test):
+    model = buildModel(X_train.shape[1])
+    class_weight_dict = classWeights(y_train)
 
     # Train the model with class weights and specified batch size
     model.fit(X_train, y_train, epochs=10, batch_size=256, class_weight=class_weight_dict)
@@ -51,18 +43,29 @@ def FFNN(data):
     # Evaluate the model on the test set
     accuracy = model.evaluate(X_test, y_test)[1]
     print(f"Test Accuracy: {accuracy * 100:.2f}%")
+    return model
 
 
+def FFNNShards(shard_dir=shards.SHARD_DIR, test_races=None, epochs=10, batch_size=256):
+    """
+    Train on the shards written by shards.writeShards, streamed through
+    tf.data, holding out whole races (the last one unless test_races is given).
+    """
+    manifest = shards.readManifest(shard_dir)
+    train_races, test_races = shards.splitRaces(manifest, test_races)
+    means = shards.trainingMeans(manifest, train_races)
+    train = shards.makeDataset(manifest, train_races, means, shard_dir, batch_size)
+    test = shards.makeDataset(manifest, test_races, means, shard_dir, batch_size, shuffle=False)
 
-if __name__ == "__main__":
-    ra = analysis.RaceAnalysis()
-    features = get_data.Features(ra.data, ra.gtd_positions)
-    data = features.makeData()
-    # print(data[:, 0])
-    data = normalizeNumericalData(data)
-    data = encode(data)
-    print(data)
-
+    model = buildModel(len(manifest["columns"]))
+    model.fit(train, epochs=epochs, class_weight=shards.classWeights(manifest, train_races))
 
+    accuracy = model.evaluate(test)[1]
+    print(f"Test Accuracy ({', '.join(test_races)}): {accuracy * 100:.2f}%")
+    return model, means
 
 
+if __name__ == "__main__":
+    manifest = shards.loadShards("./data")
+    model, means = FFNNShards()
+    exportModel(model, "pit_model.npz", manifest["columns"], means)
@@ -0,0 +1,116 @@
+"""
+Pit-stop table extracted from a RaceTable in a single pass.
+
+A stop starts on the first "Pit" row of a run of pit rows for a car and
+ends on the next row where the car is back on track. Everything the
+analysis needs about stops (counts, stint lengths, flags, pit lanes times)
+is an aggregation over this table.
+"""
+
+import numpy as np
+
+MAX_PIT_LOSS = 300.0 # s, longer stops are repairs rather than strategy
+
+
+class PitStops:
+    """
+    One row per pit stop, grouped by car and in lap order within a car.
+
+    car          car code (see RaceTable.categories["Car"])
+    entry_row    table row of the first pit lap
+    exit_row     table row where the car is back on track, -1 if it never left
+    entry_lap    lap of entry_row
+    exit_lap     lap of exit_row, -1 if it never left
+    flag         flag code at entry
+    in_time      session time (s) at entry_row
+    out_time     session time (s) at exit_row, NaN if it never left
+    stint        laps since the previous exit (since the start for the first stop)
+    """
+
+    def __init__(self, race, index, car, entry_row, exit_row):
+        self.race = race
+        self.index = index
+        self.car = car
+        self.entry_row = entry_row
+        self.exit_row = exit_row
+        left = exit_row >= 0
+        self.entry_lap = race.lap[entry_row]
+        self.exit_lap = np.where(left, race.lap[exit_row], -1)
+        self.flag = race.flag[entry_row]
+        self.in_time = race.session_time[entry_row]
+        self.out_time = np.where(left, race.session_time[exit_row], np.nan)
+
+        first = np.r_[True, car[1:] != car[:-1]]
+        last_exit = np.r_[0, self.exit_lap[:-1]]
+        self.stint = self.entry_lap - np.where(first, 0, last_exit)
+
+        self.bounds = np.searchsorted(car, np.arange(len(race.categories["Car"]) + 1))
+
+    def __len__(self):
+        return len(self.car)
+
+    def carStops(self, car):
+        """Positions in the table of the stops made by car (name)."""
+        code = self.race.code("Car", car)
+        if code < 0:
+            return np.arange(0)
+        return np.arange(self.bounds[code], self.bounds[code+1])
+
+    def count(self, car, flag=None):
+        """Number of stops made by car, optionally only those started under flag."""
+        stops = self.carStops(car)
+        if flag is not None:
+            stops = stops[self.flag[stops] == self.race.code("Flag", flag)]
+        return len(stops)
+
+    def timeLost(self, reference):
+        """
+        Seconds every stop cost compared with lapping at reference (s per
+        lap, one value per stop): the time from the start of the in lap to
+        the end of the out lap minus as many reference laps. NaN for a stop
+        the car never left.
+        """
+        laps = self.exit_lap - self.entry_lap + 1
+        start = self.in_time - self.race.lap_time[self.entry_row]
+        return self.out_time - start - laps*reference
+
+    def stopsStarted(self):
+        """For every table row, how many stops its car has started up to and including that row."""
+        entered = np.zeros(len(self.race), dtype=np.int64)
+        entered[self.entry_row] = 1
+        order = np.concatenate(self.index.car_rows)
+        counts = np.cumsum(entered[order])
+        car = self.race.car[order]
+        first = np.r_[True, car[1:] != car[:-1]]
+        before = np.maximum.accumulate(np.where(first, counts - entered[order], 0))
+        started = np.empty_like(counts)
+        started[order] = counts - before
+        return started
+
+
+def extractPitStops(race, index):
+    """
+    Build the PitStops table of race with one run-length pass over the
+    Location column, walked car by car in lap order (index is the RaceIndex).
+    """
+    order = np.concatenate(index.car_rows)
+    car = race.car[order]
+    pit = race.location[order] == race.code("Location", "Pit")
+
+    same_car = np.r_[False, car[1:] == car[:-1]]
+    prev_pit = np.r_[False, pit[:-1]] & same_car
+    entries = np.flatnonzero(pit & ~prev_pit)
+
+    # the run of pit rows starting at each entry ends on the next non pit row
+    not_pit = np.flatnonzero(~pit)
+    after = np.searchsorted(not_pit, entries)
+    exits = np.full(len(entries), -1)
+    found = after < len(not_pit)
+    exits[found] = not_pit[after[found]]
+    same = np.zeros(len(entries), dtype=bool)
+    same[found] = car[exits[found]] == car[entries[found]]
+    exits[~same] = -1
+
+    entry_row = order[entries]
+    exit_row = np.where(exits >= 0, order[np.maximum(exits, 0)], -1)
+    return PitStops(race, index, car[entries], entry_row, exit_row)
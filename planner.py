@@ -0,0 +1,231 @@
+"""
+Minimum expected time pit schedule for the rest of a race.
+
+PitPlanner solves the stop or stay out decision of every lap by dynamic
+programming over (lap, tire age, stops used), plus the laps the current
+driver has done when a driver time limit is set. The expected cost of a
+lap comes from a strategy.RaceModel fitted on the race: green pace and
+degradation at the tire age, yellow laps and pit losses weighted by the
+chance the lap is under caution, and the model's driver change time.
+Constraints:
+
+    max_stint         laps a set of tires (and a tank of fuel) lasts
+    max_stops         stops allowed in the whole race
+    max_driver_laps   laps a driver may do without a change; drivers
+                      only change at stops
+
+The backward pass fills a decision table for every state of every lap
+once. plan() then only walks that table from the current state, so a live
+re-plan every lap costs O(laps) until the caution outlook changes. Only
+the stop counts a car can be on are kept per lap: given the stops it had
+made at start_lap it has made at least one stop per max_stint laps since,
+at most one per lap, and never so many that it cannot finish on the stops
+left, which near max_stops leaves a handful of the max_stops + 1 counts.
+
+    python planner.py --cars 27 --from-lap 300 --tire-age 12 --max-driver-hours 3
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from get_data import MAX_STOPS
+from race import loadRace, RaceIndex, finishingOrder
+from strategy import RaceModel
+
+CONTINUE, STOP, STOP_CHANGE = 0, 1, 2 # decisions, STOP_CHANGE also changes the driver
+
+
+def cautionChances(model, start_lap, end_lap, yellow_left=0):
+    """
+    Chance every lap of start_lap..end_lap is run under caution: 1 for the
+    yellow_left laps of a caution already out, then the share of laps the
+    model's cautions cover in the long run.
+    """
+    length = float(np.mean(model.yellow_laps)) if len(model.yellow_laps) else 0.0
+    share = model.yellow_hazard * length / (1 + model.yellow_hazard * length)
+    chances = np.full(end_lap - start_lap + 1, share)
+    chances[:yellow_left] = 1.0
+    return chances
+
+
+def driverLaps(model, hours):
+    """Laps of green running at the model's base pace in hours."""
+    return int(hours * 3600 / model.base_mean)
+
+
+class PitPlanner:
+    """
+    Decision tables of the remaining race from start_lap to end_lap (see
+    the module docstring) for a car that had made stops stops before
+    start_lap. caution holds the chance of a caution on every lap of the
+    range (cautionChances by default).
+    """
+
+    def __init__(self, model, start_lap, end_lap, max_stops=MAX_STOPS, max_stint=None, max_driver_laps=None,
+                 caution=None, stops=0):
+        self.model = model
+        self.start_lap = start_lap
+        self.end_lap = end_lap
+        self.max_stops = max_stops
+        self.stops = stops
+        self.max_stint = max_stint or model.max_stint
+        self.max_driver_laps = max_driver_laps
+        laps = end_lap - start_lap + 1
+        self.caution = cautionChances(model, start_lap, end_lap) if caution is None else np.asarray(caution, float)
+        if len(self.caution) != laps:
+            raise ValueError("caution has %d laps, the range %d" % (len(self.caution), laps))
+
+        green_loss = float(np.median(model.green_losses))
+        yellow_loss = float(np.median(model.yellow_losses))
+        yellow_lap = float(np.median(model.yellow_times)) if len(model.yellow_times) else model.base_mean
+        age = np.arange(self.max_stint + 1)
+        green_lap = model.base_mean + model.slope_mean * age
+        p = self.caution[:, None]
+        self.lap_cost = (1 - p) * green_lap[None, :] + p * yellow_lap # laps x tire age
+        self.stop_cost = (1 - self.caution) * green_loss + self.caution * yellow_loss
+        self.decisions, self.solve_seconds = self.solve()
+
+    def stopRange(self, j):
+        """First and last stop count a car can be on at the start of lap start_lap + j (empty if first > last)."""
+        laps = self.end_lap - self.start_lap + 1
+        M = self.max_stint
+        first = self.stops + max(0, math.ceil(j / M) - 1)
+        # the stops left have to cover the laps left, M laps a set
+        last = min(self.stops + j, self.max_stops - max(0, math.ceil((laps - j) / M) - 1))
+        return first, last
+
+    def solve(self):
+        """
+        Backward induction; decisions[lap][tire age, stops used - low[lap],
+        driver laps] (driver laps always 0 without a driver limit).
+        """
+        start = time.perf_counter()
+        A = self.max_stint + 1
+        drivers = self.max_driver_laps is not None
+        D = self.max_driver_laps + 1 if drivers else 1
+        laps = self.end_lap - self.start_lap + 1
+        self.low = [self.stopRange(j)[0] for j in range(laps + 1)]
+
+        def nextValues(value, low, first, count):
+            """value of stop counts first.. first + count - 1, inf outside the range value covers."""
+            out = np.full((A, count, D), np.inf)
+            lo, hi = max(first, low), min(first + count, low + value.shape[1])
+            if lo < hi:
+                out[:, lo - first:hi - first] = value[:, lo - low:hi - low]
+            return out
+
+        decisions = [None] * laps
+        first, last = self.stopRange(laps)
+        value = np.zeros((A, max(0, last - first + 1), D))
+        for j in range(laps - 1, -1, -1):
+            next_low = self.low[j + 1]
+            first, last = self.stopRange(j)
+            S = max(0, last - first + 1)
+            # staying out: one lap older tires, one lap more for the driver
+            same = nextValues(value, next_low, first, S)
+            stay = np.full((A, S, D), np.inf)
+            if drivers:
+                stay[:-1, :, :-1] = same[1:, :, 1:]
+            else:
+                stay[:-1] = same[1:]
+            # stopping: fresh tires, one stop more, the same driver
+            more = nextValues(value, next_low, first + 1, S)[0]
+            fresh = np.full((S, D), np.inf)
+            if drivers:
+                fresh[:, :-1] = more[:, 1:]
+            else:
+                fresh[:] = more
+            stop = self.stop_cost[j] + fresh
+            best = np.where(stop < stay, STOP, CONTINUE).astype(np.int8)
+            np.minimum(stay, stop, out=stay)
+            if drivers:
+                # or with a new driver, who starts the next lap at 0
+                change = self.stop_cost[j] + self.model.driver_change + more[:, 0]
+                better = change[None, :, None] < stay
+                best[better] = STOP_CHANGE
+                np.minimum(stay, change[None, :, None], out=stay)
+            value = self.lap_cost[j][:, None, None] + stay
+            value[self.max_stint] = np.inf
+            if drivers:
+                value[:, :, self.max_driver_laps] = np.inf
+            decisions[j] = best
+        self.value = value # at start_lap, stop counts from low[0]
+        return decisions, time.perf_counter() - start
+
+    def plan(self, lap=None, tire_age=0, stops=None, driver_laps=None):
+        """
+        Best schedule from the start of lap (start_lap by default) for a
+        car on tires tire_age laps old, after stops stops (the planner's
+        by default), its driver in the car for driver_laps laps (tire_age
+        if None). Returns the stop laps, the laps with a driver change and
+        the expected time (s) to the end of end_lap; no stop laps and an
+        infinite time if the state cannot finish within the limits.
+        ValueError for a stop count the car cannot be on at lap from the
+        planner's start.
+        """
+        lap = self.start_lap if lap is None else lap
+        stops = self.stops if stops is None else stops
+        first, _ = self.stopRange(lap - self.start_lap)
+        if stops < first or stops > self.stops + lap - self.start_lap:
+            raise ValueError("a car with %d stops at lap %d cannot have made %d stops by lap %d"
+                             % (self.stops, self.start_lap, stops, lap))
+        infeasible = {"stops": [], "driver changes": [], "expected": np.inf}
+        drivers = self.max_driver_laps is not None
+        a, s = tire_age, stops
+        d = (tire_age if driver_laps is None else driver_laps) if drivers else 0
+        pit_laps, changes, expected = [], [], 0.0
+        for j in range(lap - self.start_lap, self.end_lap - self.start_lap + 1):
+            if a >= self.max_stint or s - self.low[j] >= self.decisions[j].shape[1] or \
+                    (drivers and d >= self.max_driver_laps):
+                return infeasible
+            decision = self.decisions[j][a, s - self.low[j], d]
+            expected += self.lap_cost[j, a]
+            if decision == CONTINUE:
+                a += 1
+            else:
+                expected += self.stop_cost[j]
+                pit_laps.append(self.start_lap + j)
+                a, s = 0, s + 1
+            if decision == STOP_CHANGE:
+                expected += self.model.driver_change
+                changes.append(self.start_lap + j)
+                d = 0
+            elif drivers:
+                d += 1
+        if not np.isfinite(expected):
+            return infeasible
+        return {"stops": pit_laps, "driver changes": changes, "expected": expected}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the pit stops of the rest of a race.")
+    parser.add_argument("--race", default="./data/Daytona_24hrs_GTD_replay(2023).csv")
+    parser.add_argument("--class", dest="class_", default="GTD")
+    parser.add_argument("--cars", nargs='+', help="cars the model is fitted on (default: the class finishers)")
+    parser.add_argument("--from-lap", type=int, default=1)
+    parser.add_argument("--to-lap", type=int, help="last lap (default: the last lap of the race)")
+    parser.add_argument("--tire-age", type=int, default=0)
+    parser.add_argument("--stops-used", type=int, default=0)
+    parser.add_argument("--max-stops", type=int, default=MAX_STOPS)
+    parser.add_argument("--max-stint", type=int, help="default: from the race")
+    parser.add_argument("--max-driver-hours", type=float)
+    parser.add_argument("--driver-hours", type=float, default=0.0, help="time the current driver has done")
+    parser.add_argument("--yellow-left", type=int, default=0, help="laps left of a caution that is out")
+    args = parser.parse_args()
+
+    race = loadRace(args.race)
+    model = RaceModel(race, RaceIndex(race), args.cars or finishingOrder(race, args.class_))
+    to_lap = args.to_lap or int(race.lap.max())
+    max_driver_laps = driverLaps(model, args.max_driver_hours) if args.max_driver_hours else None
+    planner = PitPlanner(model, args.from_lap, to_lap, args.max_stops, args.max_stint, max_driver_laps,
+                         cautionChances(model, args.from_lap, to_lap, args.yellow_left), args.stops_used)
+    start = time.perf_counter()
+    best = planner.plan(args.from_lap, args.tire_age, args.stops_used, driverLaps(model, args.driver_hours))
+    print("solved %d laps in %.1f ms, plan in %.2f ms" % (to_lap - args.from_lap + 1, planner.solve_seconds * 1000,
+                                                        (time.perf_counter() - start) * 1000))
+    print("expected %.1f s, %d stops: %s" % (best["expected"], len(best["stops"]), best["stops"]))
+    if best["driver changes"]:
+        print("driver changes:", best["driver changes"])
@@ -0,0 +1,371 @@
+"""
+Columnar race table shared by RaceAnalysis and Dataset.
+
+The timing CSV is loaded once into NumPy arrays: lap numbers as integers,
+lap/session/sector times as float seconds and the text columns (Car, Class,
+Driver, Flag, Location) as integer codes into a per-column category list.
+"""
+
+import collections
+import csv
+import hashlib
+import os
+import numpy as np
+
+CATEGORICAL = ("Car", "Class", "Driver", "Flag", "Location")
+
+# Bump whenever readRace changes what ends up in the table so old caches are ignored.
+PARSER_VERSION = 2
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".race_cache")
+
+
+MalformedRow = collections.namedtuple("MalformedRow", "row column value")
+
+
+def parseLapTime(value):
+    """Convert a "mm:ss.s" lap time to seconds (one value, for live feeds)."""
+    mins, sec = value.split(':')
+    return int(mins)*60 + float(sec)
+
+
+def textBytes(values):
+    """
+    values as a rows x width uint8 matrix of their UTF-8 bytes, zero padded,
+    and the byte length of every value. The column is encoded in one go and
+    split on the newlines that join it.
+    """
+    n = len(values)
+    flat = np.frombuffer("\n".join(values).encode(), dtype=np.uint8)
+    newline = flat == ord('\n')
+    if n == 0 or newline.sum() != n - 1: # values with newlines of their own
+        text = np.char.encode(np.array(values, dtype=str), 'utf-8')
+        c = text.view(np.uint8).reshape(n, text.itemsize) if text.itemsize else np.zeros((n, 0), dtype=np.uint8)
+        return c, (c != 0).sum(axis=1)
+    ends = np.r_[np.flatnonzero(newline), len(flat)]
+    starts = np.r_[0, ends[:-1] + 1]
+    length = ends - starts
+    width = int(length.max())
+    if length.min() == width: # the usual fixed width "mm:ss.s" column
+        return np.r_[flat, np.uint8(0)].reshape(n, width + 1)[:, :width], length
+    c = np.zeros((n, width), dtype=np.uint8)
+    for size in np.unique(length):
+        rows = np.flatnonzero(length == size)
+        c[rows, :size] = flat[starts[rows, None] + np.arange(size)]
+    return c, length
+
+
+def parseClock(values, minutes_required=True):
+    """
+    Parse a whole column of "m:ss.s" times (any number of minute and decimal
+    digits; plain "ss.sss" too unless minutes_required) without a Python loop
+    over the rows. Returns (seconds, minutes, empty, bad): float seconds, the
+    minutes field (-1 where there is none), and masks of the empty and the
+    malformed rows; both get NaN seconds.
+    """
+    c, length = textBytes(values)
+    n, width = c.shape
+    chars = np.ascontiguousarray(c.T) # one row per character position, so every step is a flat array op
+
+    # first pass: where the colon and the dot are, anything that is not a digit
+    colon_at = np.full(n, -1)
+    dot_at = np.full(n, -1)
+    separators = np.zeros(n, dtype=np.int64)
+    junk = np.zeros(n, dtype=bool)
+    for j in range(width):
+        ch = chars[j]
+        colon, dot = ch == ord(':'), ch == ord('.')
+        junk |= ((ch - ord('0')) >= 10) & ~colon & ~dot & (j < length) # uint8 wraps below '0'
+        separators += colon & (colon_at >= 0)
+        separators += dot & (dot_at >= 0) # a second colon or dot
+        colon_at[colon & (colon_at < 0)] = j
+        dot_at[dot & (dot_at < 0)] = j
+    has_dot = dot_at >= 0
+    dot_at = np.where(has_dot, dot_at, length)
+
+    empty = length == 0
+    bad = (junk | (separators > 0) | (dot_at < colon_at) | (colon_at == 0) | (dot_at - colon_at == 1)
+           | (length > 15)) # more digits than int64 arithmetic below can hold
+    if minutes_required:
+        bad |= colon_at < 0
+    bad &= ~empty
+
+    # second pass, Horner's rule: minutes from the digits before the colon and
+    # every digit after it as one integer with the dot left out ("17.25" -> 1725)
+    minutes = np.zeros(n, dtype=np.int64)
+    scaled = np.zeros(n, dtype=np.int64)
+    for j in range(width):
+        digit = chars[j].astype(np.int64) - ord('0')
+        before = j < colon_at
+        after = (j > colon_at) & (j < length) & (j != dot_at)
+        minutes = np.where(before, minutes*10 + digit, minutes)
+        scaled = np.where(after, scaled*10 + digit, scaled)
+    decimals = np.where(has_dot, length - dot_at - 1, 0)
+    # a single rounding from the exact decimal value, like float("...")
+    seconds = (minutes*60*10**decimals + scaled) / 10.0**decimals
+    failed = empty | bad
+    seconds[failed] = np.nan
+    minutes = np.where((colon_at >= 0) & ~failed, minutes, -1)
+    return seconds, minutes, empty, bad
+
+
+def parseLapTimes(values):
+    """Float seconds of a Lap Time column and the positions of the malformed rows."""
+    seconds, _, empty, bad = parseClock(values)
+    return seconds, np.flatnonzero(empty | bad)
+
+
+def parseSessionTimes(values):
+    """
+    The session times in the CSV drop the hour ("mm:ss.s"). Rebuild it with a
+    cumulative count of the rows where the minutes go backwards and return
+    float seconds and the positions of the malformed rows. Malformed rows
+    get NaN and do not count as a rollover.
+    """
+    seconds, minutes, empty, bad = parseClock(values)
+    valid = ~(empty | bad)
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(minutes)), -1))
+    filled = np.where(last_valid >= 0, minutes[np.maximum(last_valid, 0)], 0)
+    wraps = np.cumsum(np.r_[False, filled[1:] < filled[:-1]])
+    return seconds + wraps*60*60, np.flatnonzero(~valid)
+
+
+def fixSessionTimes(session_times):
+    """Float seconds of "mm:ss.s" session times with the hour rebuilt (see parseSessionTimes)."""
+    return parseSessionTimes(session_times)[0]
+
+
+def parseSectors(values):
+    """Float sector times, NaN where missing, and the positions of the malformed rows."""
+    try:
+        # plain decimals, the usual case, convert fastest straight from the strings
+        return np.array([v or "nan" for v in values], dtype=float), np.arange(0)
+    except ValueError: # minutes or junk in the column
+        seconds, _, _, bad = parseClock(values, minutes_required=False)
+        return seconds, np.flatnonzero(bad)
+
+
+class RaceTable:
+    """
+    One race as parallel NumPy columns. Row i of every column is row i of
+    the CSV (after the header).
+
+    lap                   int32 lap number
+    lap_time              float seconds
+    session_time          float seconds from the start, hour rollover fixed
+    s1, s2, s3            float sector times (NaN when missing)
+    car, class_, driver,
+    flag, location        int32 codes, decoded through self.categories
+
+    malformed lists the times that could not be parsed (MalformedRow: CSV
+    row, column, raw value); those cells are NaN.
+    """
+
+    def __init__(self, header, columns, categories, malformed=()):
+        self.header = header
+        self.categories = categories
+        self.malformed = list(malformed)
+        self.car = columns["Car"]
+        self.class_ = columns["Class"]
+        self.driver = columns["Driver"]
+        self.flag = columns["Flag"]
+        self.location = columns["Location"]
+        self.lap = columns["Lap"]
+        self.lap_time = columns["Lap Time"]
+        self.session_time = columns["Session Time"]
+        self.s1 = columns["S01"]
+        self.s2 = columns["S02"]
+        self.s3 = columns["S03"]
+
+    def __len__(self):
+        return len(self.lap)
+
+    def columns(self):
+        return {"Car": self.car, "Class": self.class_, "Driver": self.driver,
+                "Lap": self.lap, "Lap Time": self.lap_time, "Session Time": self.session_time,
+                "Flag": self.flag, "Location": self.location,
+                "S01": self.s1, "S02": self.s2, "S03": self.s3}
+
+    def code(self, column, value):
+        """Integer code of value in a categorical column, -1 if it never occurs."""
+        try:
+            return self.categories[column].index(value)
+        except ValueError:
+            return -1
+
+    def mask(self, column, value):
+        """Boolean mask of the rows where the categorical column equals value."""
+        return self.columns()[column] == self.code(column, value)
+
+    def name(self, column, code):
+        return self.categories[column][code]
+
+    def names(self, column, codes):
+        return [self.categories[column][c] for c in codes]
+
+    def freeze(self):
+        """Make every column read-only, so results derived from the table stay valid."""
+        for values in self.columns().values():
+            values.flags.writeable = False
+        return self
+
+    def take(self, rows):
+        """Return a new table holding only the given rows (indices or mask), in that order."""
+        columns = {k: v[rows] for k, v in self.columns().items()}
+        return RaceTable(self.header, columns, self.categories, self.malformed)
+
+    def row(self, i):
+        """Decode row i back to the values of the CSV, mainly for debugging."""
+        row = []
+        for column, values in self.columns().items():
+            value = values[i]
+            row.append(self.categories[column][value] if column in CATEGORICAL else value.item())
+        return row
+
+
+
+class RaceIndex:
+    """
+    Row positions of a RaceTable grouped by car, built once per race.
+    Each car's rows are sorted by (lap, session time) so lap ranges and
+    single laps are found with a binary search instead of a full scan.
+    """
+
+    def __init__(self, race):
+        self.race = race
+        order = np.lexsort((race.session_time, race.lap, race.car))
+        bounds = np.searchsorted(race.car[order], np.arange(len(race.categories["Car"]) + 1))
+        self.car_rows = [order[bounds[c]:bounds[c+1]] for c in range(len(bounds)-1)]
+        self.car_laps = [race.lap[rows] for rows in self.car_rows]
+
+    def carRows(self, car):
+        """Rows of car (name) in lap order, empty if the car is not in the race."""
+        code = self.race.code("Car", car)
+        return self.car_rows[code] if code >= 0 else np.empty(0, dtype=np.intp)
+
+    def lapRange(self, car, laprange):
+        """Rows of car with laprange[0] <= lap <= laprange[1]."""
+        code = self.race.code("Car", car)
+        if code < 0:
+            return np.empty(0, dtype=np.intp)
+        laps = self.car_laps[code]
+        start = np.searchsorted(laps, laprange[0], side='left')
+        end = np.searchsorted(laps, laprange[1], side='right')
+        return self.car_rows[code][start:end]
+
+    def lapRow(self, car, lap):
+        """Row where car crossed the line to complete lap (first one if logged twice), -1 if none."""
+        rows = self.lapRange(car, (lap, lap))
+        return rows[0] if len(rows) else -1
+
+
+def encodeColumn(values):
+    """Map strings to integer codes in order of first appearance."""
+    lookup = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        codes[i] = lookup.setdefault(value, len(lookup))
+    return codes, list(lookup)
+
+
+def readColumns(path):
+    """Header and the raw string columns of the timing CSV at path."""
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        raw = [list(column) for column in zip(*reader)]
+    return header, dict(zip(header, raw))
+
+
+def readRace(path, errors="report"):
+    """
+    Read the timing CSV at path into a RaceTable.
+    Unparseable times become NaN and are listed in race.malformed, or raise
+    a ValueError with errors="raise".
+    Path: ./data/Daytona_24hrs_GTD_replay(2023).csv"""
+    header, raw = readColumns(path)
+    columns = {}
+    categories = {}
+    for name in CATEGORICAL:
+        columns[name], categories[name] = encodeColumn(raw[name])
+    columns["Lap"] = np.array(raw["Lap"], dtype=np.int32)
+    parsers = [("Lap Time", parseLapTimes), ("Session Time", parseSessionTimes),
+               ("S01", parseSectors), ("S02", parseSectors), ("S03", parseSectors)]
+    malformed = []
+    for name, parse in parsers:
+        columns[name], bad_rows = parse(raw[name])
+        malformed += [MalformedRow(int(r), name, raw[name][r]) for r in bad_rows]
+    malformed.sort()
+    if malformed and errors == "raise":
+        raise ValueError("%s: %d malformed times, first %s" % (path, len(malformed), malformed[0]))
+    return RaceTable(header, columns, categories, malformed)
+
+
+def fileHash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cachePath(path, cache_dir=None):
+    """Cache file for the race at path, keyed by its content hash and the parser version."""
+    cache_dir = cache_dir or CACHE_DIR
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, "%s-%s-v%d.npz" % (stem, fileHash(path)[:16], PARSER_VERSION))
+
+
+def saveRace(race, cache_file):
+    arrays = {"header": np.array(race.header, dtype=str)}
+    for column, values in race.columns().items():
+        arrays["col:" + column] = values
+    for column in CATEGORICAL:
+        arrays["cat:" + column] = np.array(race.categories[column], dtype=str)
+    arrays["malformed"] = np.array([[str(v) for v in m] for m in race.malformed], dtype=str).reshape(-1, 3)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp = cache_file + ".%d.tmp" % os.getpid()
+    with open(tmp, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(tmp, cache_file) # never leave a half written cache behind
+
+
+def loadCachedRace(cache_file):
+    with np.load(cache_file, allow_pickle=False) as npz:
+        header = npz["header"].tolist()
+        columns = {k[4:]: npz[k] for k in npz.files if k.startswith("col:")}
+        categories = {k[4:]: npz[k].tolist() for k in npz.files if k.startswith("cat:")}
+        malformed = [MalformedRow(int(row), column, value) for row, column, value in npz["malformed"].tolist()]
+    return RaceTable(header, columns, categories, malformed)
+
+
+def loadRace(path, cache_dir=None, use_cache=True):
+    """
+    Same as readRace but goes through an on-disk cache of the parsed table.
+    The first run for a file writes the cache, later runs load it directly.
+    Editing the CSV or bumping PARSER_VERSION gives a new cache key."""
+    if not use_cache:
+        return readRace(path)
+    cache_file = cachePath(path, cache_dir)
+    if os.path.exists(cache_file):
+        try:
+            return loadCachedRace(cache_file)
+        except (OSError, ValueError, KeyError):
+            pass # unreadable cache, parse again and overwrite it
+    race = readRace(path)
+    try:
+        saveRace(race, cache_file)
+    except OSError:
+        pass # read-only location, still return the parsed race
+    return race
+
+
+def finishingOrder(race, class_):
+    """
+    Cars of class_ in finishing order: most laps completed first, ties broken
+    by who completed their last lap earliest."""
+    rows = np.flatnonzero(race.mask("Class", class_))
+    rows = rows[np.lexsort((race.session_time[rows], race.lap[rows], race.car[rows]))]
+    car = race.car[rows]
+    last = rows[np.r_[car[1:] != car[:-1], True]] if len(rows) else rows
+    last = last[np.lexsort((race.session_time[last], -race.lap[last]))]
+    return race.names("Car", race.car[last])
@@ -0,0 +1,155 @@
+"""
+Post-race report: render every analysis plot of a race to image files with
+a non-interactive backend, spread over a process pool, plus an index.html
+linking them. Figures whose inputs (race file, plot arguments and plotting
+code) are unchanged since the last run are skipped.
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import analysis
+import Pit
+from race import fileHash
+
+REPORT_VERSION = 1
+SOURCES = ("analysis.py", "Pit.py", "degradation.py", "gaps.py", "pits.py", "race.py", "report.py")
+
+# kind -> function(ra, *args, ax=None, show=True) returning the figure
+PLOTS = {
+    "avg_stint": lambda ra, **kw: ra.plotAvgStint_vs_pos(**kw),
+    "pit_scatter_3d": lambda ra, class_, **kw: ra.Plot3dScatter(class_, **kw),
+    "laptime_vs_pitduration": lambda ra, **kw: ra.plotAvgLaptime_vs_pitDuration(**kw),
+    "gap": lambda ra, car1, car2, laprange, **kw: ra.plotCarGap2(car1, car2, laprange, **kw),
+    "field_gaps": lambda ra, laprange, *cars, **kw: ra.plotCarGapn(laprange, *cars, **kw),
+    "degradation": lambda ra, car, **kw: Pit.tireDegradationPlot(car, ra, **kw),
+}
+
+RACE = None # RaceAnalysis of the worker process
+
+
+def reportJobs(ra, class_, laprange=None):
+    """(name, kind, args) of every figure of the report for class_."""
+    laprange = laprange or (1, ra.gaps.max_lap)
+    finished = ra.cars_that_finished(class_)
+    jobs = [("pit_scatter_3d-%s" % class_, "pit_scatter_3d", (class_,))]
+    if class_ == "GTD": # these two use the hard coded GTD results
+        jobs.append(("avg_stint", "avg_stint", ()))
+        jobs.append(("laptime_vs_pitduration", "laptime_vs_pitduration", ()))
+    if finished:
+        jobs.append(("field_gaps-%s" % class_, "field_gaps", (list(laprange),) + tuple(finished[:11])))
+    for car in finished:
+        jobs.append(("degradation-%s" % car, "degradation", (car,)))
+        if car != finished[0]:
+            jobs.append(("gap-%s-%s" % (car, finished[0]), "gap", (car, finished[0], list(laprange))))
+    return jobs
+
+
+def sourceHash():
+    sha = hashlib.sha1()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCES:
+        with open(os.path.join(here, name), 'rb') as file:
+            sha.update(file.read())
+    return sha.hexdigest()
+
+
+def jobKey(race_hash, code_hash, kind, args, fmt):
+    spec = json.dumps([REPORT_VERSION, race_hash, code_hash, kind, args, fmt])
+    return hashlib.sha1(spec.encode()).hexdigest()
+
+
+def initWorker(path):
+    global RACE
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+    RACE = analysis.RaceAnalysis(path)
+
+
+def renderJob(name, kind, args, out_file):
+    import matplotlib.pyplot as plt
+    try:
+        fig = PLOTS[kind](RACE, *args, show=False)
+        fig.savefig(out_file, dpi=100, bbox_inches='tight')
+        plt.close(fig)
+        return name, None
+    except Exception as e: # one bad figure should not stop the report
+        plt.close('all')
+        return name, "%s: %s" % (type(e).__name__, e)
+
+
+def writeIndex(out_dir, names, fmt, failed):
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'><title>Race report</title></head><body>"]
+    for name in names:
+        lines.append("<h3>%s</h3>" % html.escape(name))
+        if name in failed:
+            lines.append("<p>failed: %s</p>" % html.escape(failed[name]))
+        else:
+            lines.append("<img src='%s.%s'>" % (html.escape(name), fmt))
+    lines.append("</body></html>")
+    with open(os.path.join(out_dir, "index.html"), 'w') as file:
+        file.write("\n".join(lines))
+
+
+def renderReport(path, out_dir, classes=("GTD",), laprange=None, workers=None, fmt="png"):
+    """
+    Render the report of the race at path into out_dir. Returns a dict with
+    the names of the rendered, skipped and failed figures.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_file = os.path.join(out_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as file:
+            manifest = json.load(file)
+
+    ra = analysis.RaceAnalysis(path)
+    race_hash, code_hash = fileHash(path), sourceHash()
+    jobs = [job for class_ in classes for job in reportJobs(ra, class_, laprange)]
+
+    todo, skipped = [], []
+    for name, kind, args in jobs:
+        key = jobKey(race_hash, code_hash, kind, args, fmt)
+        out_file = os.path.join(out_dir, "%s.%s" % (name, fmt))
+        if manifest.get(name) == key and os.path.exists(out_file):
+            skipped.append(name)
+        else:
+            todo.append((name, kind, args, out_file, key))
+
+    failed = {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(path,)) as pool:
+            futures = [pool.submit(renderJob, name, kind, args, out_file) for name, kind, args, out_file, _ in todo]
+            for (name, _, _, _, key), future in zip(todo, futures):
+                _, error = future.result()
+                if error is None:
+                    manifest[name] = key
+                else:
+                    failed[name] = error
+                    manifest.pop(name, None)
+
+    with open(manifest_file, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    writeIndex(out_dir, [job[0] for job in jobs], fmt, failed)
+    rendered = [job[0] for job in todo if job[0] not in failed]
+    return {"rendered": rendered, "skipped": skipped, "failed": failed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render every analysis plot of a race to files.")
+    parser.add_argument("race", help="timing CSV of the race")
+    parser.add_argument("out_dir")
+    parser.add_argument("--classes", nargs='+', default=["GTD"])
+    parser.add_argument("--laps", nargs=2, type=int, metavar=("FIRST", "LAST"))
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--format", default="png", choices=["png", "svg", "pdf"])
+    args = parser.parse_args()
+
+    result = renderReport(args.race, args.out_dir, args.classes, args.laps, args.workers, args.format)
+    print("rendered %d, skipped %d, failed %d" % (len(result["rendered"]), len(result["skipped"]), len(result["failed"])))
+    for name, error in result["failed"].items():
+        print(name, error)
@@ -0,0 +1,110 @@
+"""
+Running order of every class at every lap crossing.
+
+RunningOrder ranks the crossings of each lap among the cars of the same
+class by session time, so the car ahead of a crossing is the one that
+completed the same lap just before it. With one sort of the whole race on
+numeric (class, lap, session time) keys it gives, for every row of the
+race (in race row order):
+
+    position          class position when the car completed the lap, 1 for
+                      the first car of the class to complete it
+    ahead, behind     row of the car directly ahead / behind on the same
+                      lap, -1 for none
+    interval_ahead    s to the car ahead, NaN for the leader
+    interval_behind   s to the car behind, NaN for the last car of the lap
+    gap_to_leader     s behind the first car of the class on the same lap
+    laps_down         laps the class leader had completed more at that
+                      moment, 0 on the lead lap
+    lapped            laps_down > 0
+    previous          row of the same car's previous crossing, -1 for its
+                      first one
+
+A lap logged twice for a car counts once, at its first crossing (as
+RaceIndex.lapRow); the second row takes the values of the first. Session
+time ties keep the order of the rows in the CSV.
+"""
+
+import numpy as np
+
+
+class RunningOrder:
+    def __init__(self, race, index):
+        n = len(race)
+        self.position = np.zeros(n, dtype=np.int32)
+        self.ahead = np.full(n, -1, dtype=np.intp)
+        self.behind = np.full(n, -1, dtype=np.intp)
+        self.interval_ahead = np.full(n, np.nan)
+        self.interval_behind = np.full(n, np.nan)
+        self.gap_to_leader = np.full(n, np.nan)
+        self.laps_down = np.zeros(n, dtype=np.int32)
+        self.previous = np.full(n, -1, dtype=np.intp)
+        if n == 0:
+            self.lapped = self.laps_down > 0
+            return
+
+        # every car's rows in (lap, session time) order
+        order = np.concatenate(index.car_rows)
+        car, lap = race.car[order], race.lap[order]
+        new_car = np.r_[True, car[1:] != car[:-1]]
+        self.previous[order[~new_car]] = order[np.flatnonzero(~new_car) - 1]
+        first = new_car | np.r_[True, lap[1:] != lap[:-1]]
+        crossing_of = np.empty(n, dtype=np.intp) # row -> row of its first crossing
+        crossing_of[order] = order[np.maximum.accumulate(np.where(first, np.arange(n), 0))]
+
+        # the crossings of every (class, lap) by session time, ties in CSV order
+        rows = order[first]
+        time, lap, class_ = race.session_time[rows], race.lap[rows], race.class_[rows]
+        by_lap = np.lexsort((rows, time, lap, class_))
+        rows, time, lap, class_ = rows[by_lap], time[by_lap], lap[by_lap], class_[by_lap]
+        m = len(rows)
+        start = np.r_[True, (class_[1:] != class_[:-1]) | (lap[1:] != lap[:-1])]
+        end = np.r_[start[1:], True]
+        leader = np.maximum.accumulate(np.where(start, np.arange(m), 0))
+
+        self.position[rows] = np.arange(m) - leader + 1
+        self.ahead[rows[~start]] = rows[:-1][~start[1:]]
+        self.behind[rows[~end]] = rows[1:][~end[:-1]]
+        self.interval_ahead[rows[~start]] = np.diff(time)[~start[1:]]
+        self.interval_behind[rows[~end]] = np.diff(time)[~end[:-1]]
+        self.gap_to_leader[rows] = time - time[leader]
+
+        # laps of the class leader at every crossing: the running maximum lap of
+        # the class over session time, restarted per class by a class offset
+        by_time = np.lexsort((rows, time, class_))
+        offset = class_[by_time].astype(np.int64) * (int(lap.max()) + 1)
+        lead_lap = np.maximum.accumulate(offset + lap[by_time]) - offset
+        self.laps_down[rows[by_time]] = lead_lap - lap[by_time]
+
+        # a second crossing of the same lap takes the values of the first
+        again = np.flatnonzero(crossing_of != np.arange(n))
+        for values in (self.position, self.ahead, self.behind, self.interval_ahead, self.interval_behind,
+                       self.gap_to_leader, self.laps_down):
+            values[again] = values[crossing_of[again]]
+        self.lapped = self.laps_down > 0
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from race import loadRace, RaceIndex
+
+    parser = argparse.ArgumentParser(description="Time the running order of a race.")
+    parser.add_argument("--race", default="./data/Daytona_24hrs_GTD_replay(2023).csv")
+    parser.add_argument("--car", default="27")
+    parser.add_argument("--laps", nargs=2, type=int, default=[1, 10])
+    args = parser.parse_args()
+
+    race = loadRace(args.race)
+    index = RaceIndex(race)
+    start = time.perf_counter()
+    running = RunningOrder(race, index)
+    print("%d rows in %.1f ms" % (len(race), (time.perf_counter() - start) * 1000))
+    print("Lap  Position  Ahead  Interval  Behind  Interval  Gap to leader  Laps down")
+    for row in index.lapRange(args.car, args.laps):
+        ahead, behind = running.ahead[row], running.behind[row]
+        print("%3d  %8d  %5s  %8.1f  %6s  %8.1f  %13.1f  %9d" % (
+            race.lap[row], running.position[row], race.name("Car", race.car[ahead]) if ahead >= 0 else "-",
+            running.interval_ahead[row], race.name("Car", race.car[behind]) if behind >= 0 else "-",
+            running.interval_behind[row], running.gap_to_leader[row], running.laps_down[row]))
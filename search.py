@@ -0,0 +1,223 @@
+"""
+Hyperparameter search for the pit-stop FFNN with leave-one-race-out folds.
+
+Every candidate (layers, L2, optimizer, learning rate, batch size, epochs)
+is trained once per race held out, on the shards written by
+shards.writeShards, and scored by the mean validation AUC of its folds.
+Candidates run concurrently in a process pool, each worker limited to a
+few TensorFlow threads so the trials do not fight over the cores. The
+held out race of a fold is only scored once, after training: when a fold
+has two or more training races the last of them is set aside to stop
+training when its AUC has not improved for `patience` epochs, otherwise
+the fold trains for the candidate's epochs. A candidate whose mean AUC
+after a fold trails the best finished candidate by more than
+`prune_margin` skips its remaining folds.
+
+Every trial is appended to trials.jsonl in the output directory as it
+finishes; the best parameters are then trained on all races and saved
+as best.keras (and best.npz for inference.PitModel) next to best.json
+(parameters, score, normalization means).
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import shards
+from inference import exportModel
+
+SEARCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_results")
+
+# the current hard coded FFNN is the first grid point
+GRID = {"layers": [[64, 64, 64], [128, 64], [32, 32]],
+        "l2": [0.0005, 0.005],
+        "optimizer": ["nadam", "adam"],
+        "learning_rate": [0.001],
+        "batch_size": [256],
+        "epochs": [10]}
+
+# list: choose one; (low, high) floats: log uniform; (low, high) ints: uniform
+SPACE = {"layers": [[64, 64, 64], [128, 64], [64, 64], [32, 32], [128, 128, 64]],
+         "l2": (1e-5, 1e-2),
+         "optimizer": ["nadam", "adam", "rmsprop"],
+         "learning_rate": (1e-4, 1e-2),
+         "batch_size": [128, 256, 512],
+         "epochs": [10]}
+
+BEST_SCORE = None # multiprocessing.Value shared by the workers
+THREADS = 1
+
+
+def gridCandidates(grid):
+    """Every combination of the grid values, in order."""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def sampleCandidates(space, n, seed=0):
+    rng = random.Random(seed)
+    candidates = []
+    for _ in range(n):
+        params = {}
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    params[key] = rng.randint(low, high)
+                else:
+                    params[key] = math.exp(rng.uniform(math.log(low), math.log(high)))
+            else:
+                params[key] = rng.choice(values)
+        candidates.append(params)
+    return candidates
+
+
+def raceFolds(manifest):
+    """(train races, held out race) for every race."""
+    races = [entry["race"] for entry in manifest["races"]]
+    if len(races) < 2:
+        raise ValueError("leave-one-race-out needs at least two races")
+    return [([r for r in races if r != test], test) for test in races]
+
+
+def initWorker(best_score, threads):
+    """Limit the threads of this worker before TensorFlow is imported."""
+    global BEST_SCORE, THREADS
+    BEST_SCORE, THREADS = best_score, threads
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def fitFold(manifest, shard_dir, params, train_races, valid_races=None, patience=2, seed=0):
+    """Model trained on train_races, stopped early on valid_races if given."""
+    import tensorflow as tf
+    from tensorflow import keras
+    import model as ffnn
+
+    tf.keras.utils.set_random_seed(seed)
+    means = shards.trainingMeans(manifest, train_races)
+    train = shards.makeDataset(manifest, train_races, means, shard_dir, params["batch_size"], seed=seed)
+    net = ffnn.buildModel(len(manifest["columns"]), params["layers"], params["l2"], params["optimizer"],
+                          params["learning_rate"], metrics=['accuracy', keras.metrics.AUC(name="auc")])
+    fit = {"epochs": params["epochs"], "class_weight": shards.classWeights(manifest, train_races), "verbose": 0}
+    if valid_races:
+        fit["validation_data"] = shards.makeDataset(manifest, valid_races, means, shard_dir,
+                                                    params["batch_size"], shuffle=False)
+        fit["callbacks"] = [keras.callbacks.EarlyStopping(monitor="val_auc", mode="max", patience=patience,
+                                                          restore_best_weights=True)]
+    history = net.fit(train, **fit).history
+    return net, means, history
+
+
+def runTrial(trial, params, manifest, shard_dir, patience=2, prune_margin=0.05, seed=0):
+    """Train params on every fold and return the trial record."""
+    start = time.perf_counter()
+    folds = []
+    pruned = False
+    for train_races, test_race in raceFolds(manifest):
+        # the held out race never steers training, early stopping watches a training race
+        valid_races = train_races[-1:] if len(train_races) > 1 else []
+        fit_races = train_races[:len(train_races) - len(valid_races)]
+        net, means, history = fitFold(manifest, shard_dir, params, fit_races, valid_races, patience, seed)
+        test = shards.makeDataset(manifest, [test_race], means, shard_dir, params["batch_size"], shuffle=False)
+        result = net.evaluate(test, verbose=0, return_dict=True)
+        epochs = int(np.argmax(history["val_auc"])) + 1 if valid_races else len(history["loss"])
+        folds.append({"race": test_race, "auc": float(result["auc"]), "loss": float(result["loss"]),
+                      "accuracy": float(result["accuracy"]), "epochs": epochs})
+        score = np.mean([f["auc"] for f in folds])
+        if len(folds) < len(manifest["races"]) and score < BEST_SCORE.value - prune_margin:
+            pruned = True
+            break
+    score = float(np.mean([f["auc"] for f in folds]))
+    if not pruned:
+        with BEST_SCORE.get_lock():
+            BEST_SCORE.value = max(BEST_SCORE.value, score)
+    return {"trial": trial, "params": params, "score": score, "pruned": pruned, "folds": folds,
+            "seconds": time.perf_counter() - start, "threads": THREADS}
+
+
+def search(candidates, shard_dir=shards.SHARD_DIR, out_dir=SEARCH_DIR, workers=None, threads=1,
+           patience=2, prune_margin=0.05, seed=0):
+    """Run every candidate and train the best one on all races. Returns the trial records, best first."""
+    manifest = shards.readManifest(shard_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    # spawn so no worker inherits a TensorFlow runtime with the wrong thread pools
+    context = multiprocessing.get_context("spawn")
+    best_score = context.Value('d', -math.inf)
+
+    trials = []
+    with open(os.path.join(out_dir, "trials.jsonl"), 'a') as log, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initWorker,
+                                initargs=(best_score, threads)) as pool:
+        futures = [pool.submit(runTrial, k, params, manifest, shard_dir, patience, prune_margin, seed)
+                   for k, params in enumerate(candidates)]
+        for future in as_completed(futures):
+            record = future.result()
+            trials.append(record)
+            log.write(json.dumps(record) + "\n")
+            log.flush()
+            print("trial %d: auc %.4f%s  %s" % (record["trial"], record["score"],
+                                                 " (pruned)" if record["pruned"] else "", record["params"]))
+
+    trials.sort(key=lambda r: (r["pruned"], -r["score"]))
+    best = trials[0]
+    saveBest(best, manifest, shard_dir, out_dir, threads, seed)
+    return trials
+
+
+def saveBest(best, manifest, shard_dir, out_dir, threads=1, seed=0):
+    """Train the best parameters on every race for the mean early stopped epoch count and save it."""
+    initWorker(None, threads)
+    params = dict(best["params"], epochs=max(1, int(round(np.mean([f["epochs"] for f in best["folds"]])))))
+    races = [entry["race"] for entry in manifest["races"]]
+    net, means, _ = fitFold(manifest, shard_dir, params, races, seed=seed)
+    net.save(os.path.join(out_dir, "best.keras"))
+    exportModel(net, os.path.join(out_dir, "best.npz"), manifest["columns"], means)
+    with open(os.path.join(out_dir, "best.json"), 'w') as file:
+        json.dump({"params": params, "score": best["score"], "folds": best["folds"], "means": means,
+                   "columns": manifest["columns"], "races": races}, file, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leave-one-race-out hyperparameter search for the FFNN.")
+    parser.add_argument("--shards", default=shards.SHARD_DIR, help="directory written by shards.writeShards")
+    parser.add_argument("--races", default="./data", help="races the shards are built from (rebuilt when they changed)")
+    parser.add_argument("--space", help="JSON file with a grid (lists) or random space")
+    parser.add_argument("--random", type=int, metavar="N", help="sample N candidates instead of the full grid")
+    parser.add_argument("--epochs", type=int, help="override the epochs of every candidate")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int, default=1, help="TensorFlow threads per worker")
+    parser.add_argument("--patience", type=int, default=2)
+    parser.add_argument("--prune-margin", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=SEARCH_DIR)
+    args = parser.parse_args()
+
+    shards.loadShards(args.races, args.shards)
+    if args.space:
+        with open(args.space) as file:
+            # {"low": a, "high": b} for a range, a list for a choice
+            space = {k: (v["low"], v["high"]) if isinstance(v, dict) else v for k, v in json.load(file).items()}
+    else:
+        space = SPACE if args.random else GRID
+    candidates = sampleCandidates(space, args.random, args.seed) if args.random else gridCandidates(space)
+    if args.epochs:
+        candidates = [dict(c, epochs=args.epochs) for c in candidates]
+
+    trials = search(candidates, args.shards, args.out, args.workers, args.threads, args.patience,
+                    args.prune_margin, args.seed)
+    print("best: auc %.4f %s -> %s" % (trials[0]["score"], trials[0]["params"], os.path.join(args.out, "best.keras")))
@@ -0,0 +1,417 @@
+"""
+Sector level pace of every car, for a recorded race or lap by lap.
+
+The S01-S03 columns split every lap in three and show traffic and tire
+wear before the lap time does. Every crossing gets, for each sector:
+
+    median   rolling median of the car's last `window` clean times
+    slope    degradation (s per hour) over the clean laps of the car's
+             current stint so far, NaN below min_laps laps
+    delta    time lost to the class leader (the first car of the class to
+             complete the lap) in the same sector of the same lap, when
+             both laps are clean
+
+and the car's theoretical best lap, the sum of its best clean sectors so
+far. Clean laps are the ones degradation.cleanLaps keeps (green, on track,
+after a green lap on track) and a stint starts with every pit entry. The
+feed logs a sector it missed as 0; those count as missing.
+
+sectorTable computes all of it for a whole race with array operations.
+SectorTracker keeps O(1) state per car and per lap and returns each row as
+it comes off the timing feed. A crossing can be logged a few seconds late,
+so the class leader of a lap, and with it the deltas, is only final once
+the feed is live.REORDER_SECONDS past it; the tracker then hands back the
+rows with the same values as sectorTable (replay runs a recorded race
+through it). sectorSummary and SectorTracker.summary reduce the clean laps
+to best sectors and pooled degradation slopes per car, stint or driver.
+"""
+
+import collections
+import heapq
+import math
+
+import numpy as np
+import pandas as pd
+
+from degradation import cleanLaps
+from live import REORDER_SECONDS
+from pits import extractPitStops
+from race import loadRace, RaceIndex
+
+SECTORS = ("S01", "S02", "S03")
+WINDOW = 5 # clean laps in the rolling median
+MIN_LAPS = 3 # clean laps before a slope is reported
+GROUPS = {"car": ["Car"], "stint": ["Car", "Stint"], "driver": ["Driver"]}
+
+TABLE_COLUMNS = (["Row", "Car", "Driver", "Lap", "Stint", "Session Time", "Lap Time"] + list(SECTORS) + ["Clean"]
+                 + [s + " median" for s in SECTORS] + ["Theoretical best"]
+                 + [s + " slope" for s in SECTORS] + [s + " delta" for s in SECTORS])
+
+
+def median(values):
+    ordered = sorted(values)
+    k = len(ordered)
+    return (ordered[(k - 1) // 2] + ordered[k // 2]) / 2
+
+
+def lineSlope(n, sx, sy, sxx, sxy, min_laps=MIN_LAPS):
+    """Least squares slope from the sums of n points, NaN below min_laps points."""
+    with np.errstate(all='ignore'):
+        denom = n*sxx - sx*sx
+        slope = (n*sxy - sx*sy) / denom
+    return np.where((n >= min_laps) & (denom > 0), slope, np.nan)
+
+
+def rollingMedian(values, window):
+    """
+    Median of the last `window` non-NaN values of every column up to each
+    row, NaN before the first one (values: rows x columns).
+    """
+    medians = np.full(values.shape, np.nan)
+    for k in range(values.shape[1]):
+        valid = ~np.isnan(values[:, k])
+        v = values[valid, k]
+        if not len(v):
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(np.r_[np.full(window - 1, np.nan), v], window)
+        ordered = np.sort(windows, axis=1) # NaN padding sorts last
+        counts = np.minimum(np.arange(1, len(v) + 1), window)
+        rows = np.arange(len(v))
+        at = ordered[rows, (counts - 1) // 2], ordered[rows, counts // 2]
+        last = np.cumsum(valid) - 1 # the latest clean value on every row
+        medians[:, k] = np.where(last >= 0, ((at[0] + at[1]) / 2)[np.maximum(last, 0)], np.nan)
+    return medians
+
+
+def stintSlopes(values, hours, stint, clean, min_laps):
+    """
+    Slope of every column of values against hours over the rows of the
+    same stint up to each row (one car, rows in lap order), NaN where the
+    value itself is NaN.
+    """
+    new = np.r_[True, stint[1:] != stint[:-1]]
+    seg = np.cumsum(new) - 1
+    seg_start = np.flatnonzero(new)
+    # hours are counted from the first clean lap of the stint for precision
+    start = np.full(len(seg_start), np.nan)
+    segs, first = np.unique(seg[clean], return_index=True)
+    start[segs] = hours[clean][first]
+    x = hours - start[seg]
+
+    slopes = np.full(values.shape, np.nan)
+    for k in range(values.shape[1]):
+        valid = ~np.isnan(values[:, k])
+        xk = np.where(valid, x, 0)
+        yk = np.where(valid, values[:, k], 0)
+        terms = np.column_stack([valid, xk, yk, xk*xk, xk*yk])
+        total = np.cumsum(terms, axis=0)
+        running = total - (total - terms)[seg_start][seg] # cumulative sums restarted every stint
+        slopes[:, k] = np.where(valid, lineSlope(*running.T, min_laps=min_laps), np.nan)
+    return slopes
+
+
+def classLeaders(race):
+    """Row of the first crossing of every lap in every class (class codes x laps), -1 where none."""
+    max_lap = int(race.lap.max()) if len(race) else 0
+    leaders = np.full((len(race.categories["Class"]), max_lap + 1), -1)
+    rows = np.lexsort((race.session_time, race.lap, race.class_))
+    class_, lap = race.class_[rows], race.lap[rows]
+    first = np.r_[True, (class_[1:] != class_[:-1]) | (lap[1:] != lap[:-1])] if len(rows) else rows
+    leaders[class_[first], lap[first]] = rows[first]
+    return leaders
+
+
+def sectorTable(race, index, window=WINDOW, min_laps=MIN_LAPS):
+    """
+    Sector pace of every row of race (a RaceTable, index its RaceIndex) in
+    CSV row order, with the columns of TABLE_COLUMNS.
+    """
+    order, first, clean = cleanLaps(race, index)
+    stint = extractPitStops(race, index).stopsStarted()[order]
+    hours = race.session_time[order] / 3600
+    times = np.column_stack([race.s1, race.s2, race.s3])[order]
+    values = np.where(clean[:, None] & (times > 0), times, np.nan) # the clean sector times
+
+    n = len(order)
+    medians = np.full((n, 3), np.nan)
+    best = np.full((n, 3), np.nan)
+    slopes = np.full((n, 3), np.nan)
+    starts = np.flatnonzero(first)
+    for s, e in zip(starts, np.r_[starts[1:], n]):
+        best[s:e] = np.fmin.accumulate(values[s:e], axis=0)
+        medians[s:e] = rollingMedian(values[s:e], window)
+        slopes[s:e] = stintSlopes(values[s:e], hours[s:e], stint[s:e], clean[s:e], min_laps)
+
+    clean_times = np.full((len(race), 3), np.nan)
+    clean_times[order] = values
+    leader = classLeaders(race)[race.class_[order], race.lap[order]]
+    deltas = values - np.where((leader >= 0)[:, None], clean_times[np.maximum(leader, 0)], np.nan)
+
+    table = {"Row": order, "Car": race.names("Car", race.car[order]),
+             "Driver": race.names("Driver", race.driver[order]), "Lap": race.lap[order], "Stint": stint,
+             "Session Time": race.session_time[order], "Lap Time": race.lap_time[order]}
+    for k, sector in enumerate(SECTORS):
+        table[sector] = times[:, k]
+    table["Clean"] = clean
+    for k, sector in enumerate(SECTORS):
+        table[sector + " median"] = medians[:, k]
+    table["Theoretical best"] = best.sum(axis=1)
+    for k, sector in enumerate(SECTORS):
+        table[sector + " slope"] = slopes[:, k]
+    for k, sector in enumerate(SECTORS):
+        table[sector + " delta"] = deltas[:, k]
+    return pd.DataFrame(table).sort_values("Row", ignore_index=True)
+
+
+def sectorSummary(table, by="car", min_laps=MIN_LAPS):
+    """
+    Clean laps of a sectorTable per car, stint (car and stint) or driver:
+    clean laps, best time of every sector, theoretical best, best lap and
+    the degradation slope of every sector pooled over the group's stints
+    (each driver's part of a stint fitted around its own mean).
+    """
+    keys = GROUPS[by]
+    clean = table[table["Clean"]]
+    hours = clean["Session Time"] / 3600
+    hours = hours - hours.groupby([clean["Car"], clean["Stint"]]).transform("first")
+    times = clean[list(SECTORS)].where(clean[list(SECTORS)] > 0) # 0 is a missed sector
+    cell = [clean["Car"], clean["Stint"], clean["Driver"]]
+    groups = clean.groupby(keys, sort=True)
+    group_keys = [clean[k] for k in keys]
+
+    summary = pd.DataFrame({"Laps": groups.size()})
+    for sector in SECTORS:
+        summary[sector + " best"] = times[sector].groupby(group_keys).min()
+    summary["Theoretical best"] = summary[[s + " best" for s in SECTORS]].sum(axis=1, skipna=False)
+    summary["Best lap"] = groups["Lap Time"].min()
+    for sector in SECTORS:
+        y = times[sector]
+        valid = y.notna()
+        x = hours.where(valid)
+        xd = x - x.groupby(cell).transform("mean")
+        yd = y - y.groupby(cell).transform("mean")
+        sxx = (xd*xd).groupby(group_keys).sum()
+        sxy = (xd*yd).groupby(group_keys).sum()
+        n = valid.groupby(group_keys).sum()
+        with np.errstate(all='ignore'):
+            summary[sector + " slope"] = np.where((n >= min_laps) & (sxx > 0), sxy / sxx, np.nan)
+    return summary.reset_index()
+
+
+class SectorTracker:
+    """
+    Incremental sectorTable: update takes the rows of the race in the order
+    they come off the timing feed and returns the row of the table for each,
+    its deltas against the class leader seen so far, and the rows that are
+    now final.
+    """
+
+    def __init__(self, window=WINDOW, min_laps=MIN_LAPS, reorder=REORDER_SECONDS):
+        self.window = window
+        self.min_laps = min_laps
+        self.reorder = reorder
+        self.rows = 0
+        self.feed_rows = 0
+        self.latest = -math.inf
+
+        # per car
+        self.dirty = {} # the last lap was under yellow or in the pits
+        self.in_pit = {}
+        self.stint = {}
+        self.stint_start = {} # hour of the first clean lap of the current stint
+        self.sums = {} # per sector n, sx, sy, sxx, sxy over the current stint
+        self.recent = {} # per sector the last `window` clean times
+        self.best = {}
+
+        # per (car, stint, driver), for summary()
+        self.cells = {}
+        # per (class, lap): the first car over the line, (session time, feed row) and its
+        # clean sector times, and the rows waiting for it to settle
+        self.leaders = {}
+        self.unsettled = [] # heap of (session time, feed row, (class, lap)) of the leaders
+
+    def update(self, row):
+        """
+        row holds Car, Class, Driver, Lap, Lap Time (s), Session Time (s),
+        Flag, Location and the three sector times (s, NaN when missing),
+        e.g. RaceTable.row(i) or live.TimingParser.parse(line).
+
+        Returns (result, completed): the table row of this crossing, and the
+        rows whose class leader has settled, this one included if its lap
+        already had.
+        """
+        car, class_, driver, lap, lap_time, session_time, flag, location = row[:8]
+        key = (session_time, self.feed_rows)
+        self.feed_rows += 1
+        self.latest = max(self.latest, session_time)
+        pit = location == "Pit"
+        dirty = pit or flag == "Yellow"
+        clean = not dirty and self.dirty.get(car) is False
+        self.dirty[car] = dirty
+
+        if car not in self.stint:
+            self.stint[car] = 0
+            self.recent[car] = [collections.deque(maxlen=self.window) for _ in SECTORS]
+            self.best[car] = [math.nan]*len(SECTORS)
+        if pit and not self.in_pit.get(car, False):
+            self.stint[car] += 1
+            self.stint_start.pop(car, None)
+        self.in_pit[car] = pit
+        stint = self.stint[car]
+        if clean and car not in self.stint_start:
+            self.stint_start[car] = session_time / 3600
+            self.sums[car] = [[0.0]*5 for _ in SECTORS]
+
+        times = [float(t) for t in row[8:8 + len(SECTORS)]]
+        values = [t if clean and t > 0 else math.nan for t in times]
+        leader = self.leaders.get((class_, lap))
+        if leader is None or (not leader["settled"] and key < leader["key"]):
+            # the first crossing of the lap so far
+            leader = self.leaders[class_, lap] = {"key": key, "values": values, "settled": False,
+                                                  "waiting": leader["waiting"] if leader else []}
+            heapq.heappush(self.unsettled, key + ((class_, lap),))
+        if clean:
+            key = (car, stint, driver)
+            if key not in self.cells:
+                self.cells[key] = {"laps": 0, "best lap": math.nan, "best": [math.nan]*len(SECTORS),
+                                   "sums": [[0.0]*5 for _ in SECTORS]}
+            cell = self.cells[key]
+            cell["laps"] += 1
+            cell["best lap"] = min(cell["best lap"], lap_time) if not math.isnan(cell["best lap"]) else lap_time
+
+        x = session_time / 3600 - self.stint_start[car] if clean else math.nan
+        result = {"Row": self.rows, "Car": car, "Driver": driver, "Lap": lap, "Stint": stint,
+                  "Session Time": session_time, "Lap Time": lap_time}
+        medians, slopes, deltas = [], [], []
+        for k, sector in enumerate(SECTORS):
+            result[sector] = times[k]
+            value = values[k]
+            slope = math.nan
+            if not math.isnan(value):
+                self.recent[car][k].append(value)
+                best = self.best[car][k]
+                self.best[car][k] = value if math.isnan(best) else min(best, value)
+                point = (1, x, value, x*x, x*value)
+                sums = self.sums[car][k] = [a + b for a, b in zip(self.sums[car][k], point)]
+                n, sx, sy, sxx, sxy = sums
+                denom = n*sxx - sx*sx
+                if n >= self.min_laps and denom > 0:
+                    slope = (n*sxy - sx*sy) / denom
+                cell["sums"][k] = [a + b for a, b in zip(cell["sums"][k], point)]
+                cell_best = cell["best"][k]
+                cell["best"][k] = value if math.isnan(cell_best) else min(cell_best, value)
+            recent = self.recent[car][k]
+            medians.append(median(recent) if recent else math.nan)
+            slopes.append(slope)
+            deltas.append(value - leader["values"][k])
+        result["Clean"] = clean
+        for sector, value in zip(SECTORS, medians):
+            result[sector + " median"] = value
+        result["Theoretical best"] = sum(self.best[car])
+        for sector, value in zip(SECTORS, slopes):
+            result[sector + " slope"] = value
+        for sector, value in zip(SECTORS, deltas):
+            result[sector + " delta"] = value
+        self.rows += 1
+
+        completed = []
+        if leader["settled"]:
+            completed.append(result)
+        else:
+            leader["waiting"].append((result, values))
+        completed += self.settle(self.latest - self.reorder)
+        return dict(result), completed
+
+    def settle(self, until):
+        """Settle the leaders that crossed before session time until, returning the rows this completes."""
+        completed = []
+        while self.unsettled and self.unsettled[0][0] < until:
+            session_time, feed_row, lap_key = heapq.heappop(self.unsettled)
+            leader = self.leaders[lap_key]
+            if leader["key"] != (session_time, feed_row):
+                continue # replaced by an earlier crossing logged late
+            leader["settled"] = True
+            for result, values in leader.pop("waiting"):
+                for sector, value, leader_value in zip(SECTORS, values, leader["values"]):
+                    result[sector + " delta"] = value - leader_value
+                completed.append(result)
+        return completed
+
+    def flush(self):
+        """Settle every leader and return the rows still waiting (end of the race)."""
+        return self.settle(math.inf)
+
+    def summary(self, by="car"):
+        """sectorSummary of the rows seen so far."""
+        keys = GROUPS[by]
+        groups = {}
+        for (car, stint, driver), cell in self.cells.items():
+            named = {"Car": car, "Stint": stint, "Driver": driver}
+            groups.setdefault(tuple(named[k] for k in keys), []).append(cell)
+
+        rows = []
+        for key, cells in groups.items():
+            row = dict(zip(keys, key))
+            row["Laps"] = sum(c["laps"] for c in cells)
+            bests = [min((c["best"][k] for c in cells if not math.isnan(c["best"][k])), default=math.nan)
+                     for k in range(len(SECTORS))]
+            for sector, best in zip(SECTORS, bests):
+                row[sector + " best"] = best
+            row["Theoretical best"] = sum(bests)
+            row["Best lap"] = min((c["best lap"] for c in cells), default=math.nan)
+            for k, sector in enumerate(SECTORS):
+                # sums of squares around the mean of every cell, then pooled
+                sxx = sxy = n = 0.0
+                for c in cells:
+                    cn, sx, sy, cxx, cxy = c["sums"][k]
+                    if cn:
+                        n += cn
+                        sxx += cxx - sx*sx/cn
+                        sxy += cxy - sx*sy/cn
+                row[sector + " slope"] = sxy / sxx if n >= self.min_laps and sxx > 0 else math.nan
+            rows.append(row)
+        columns = keys + ["Laps"] + [s + " best" for s in SECTORS] + ["Theoretical best", "Best lap"] \
+            + [s + " slope" for s in SECTORS]
+        return pd.DataFrame(rows, columns=columns).sort_values(keys, ignore_index=True)
+
+
+def replay(path, window=WINDOW, min_laps=MIN_LAPS):
+    """Feed a recorded race through a SectorTracker row by row; returns the table and the tracker."""
+    race = loadRace(path)
+    tracker = SectorTracker(window, min_laps)
+    columns = race.columns()
+    decoded = [race.names(c, columns[c]) if c in race.categories else columns[c].tolist()
+               for c in ("Car", "Class", "Driver", "Lap", "Lap Time", "Session Time", "Flag", "Location",
+                         "S01", "S02", "S03")]
+    rows = []
+    for row in zip(*decoded):
+        rows += tracker.update(row)[1]
+    rows += tracker.flush()
+    return pd.DataFrame(rows, columns=TABLE_COLUMNS).sort_values("Row", ignore_index=True), tracker
+
+
+if __name__ == "__main__":
+    import time
+    for year in ("2022", "2023"):
+        path = "./data/Daytona_24hrs_GTD_replay(%s).csv" % year
+        race = loadRace(path)
+        index = RaceIndex(race)
+        start = time.perf_counter()
+        batch = sectorTable(race, index)
+        batch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        live, tracker = replay(path)
+        live_time = time.perf_counter() - start
+        print("%s: %d rows, table %.1f ms, tracker %.1f ms" % (path, len(batch), batch_time * 1000, live_time * 1000))
+        for column in TABLE_COLUMNS:
+            if batch[column].dtype.kind == 'f':
+                diff = np.abs(batch[column] - live[column])
+                nan_mismatches = int((batch[column].isna() != live[column].isna()).sum())
+                print("  %-18s max diff %.2e, NaN mismatches %d" % (column, diff.max(), nan_mismatches))
+            elif (batch[column] != live[column]).any():
+                print("  %-18s mismatches %d" % (column, int((batch[column] != live[column]).sum())))
+        for by in GROUPS:
+            a, b = sectorSummary(batch, by), tracker.summary(by)
+            numeric = [c for c in a.columns if a[c].dtype.kind == 'f']
+            print("  summary by %-6s %d groups, max diff %.2e" % (by, len(a), np.nanmax(np.abs(a[numeric].to_numpy()
+                                                                                            - b[numeric].to_numpy()))))
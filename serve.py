@@ -0,0 +1,206 @@
+"""
+Local pit-probability service.
+
+Loads a trained model once and answers "should car X pit this lap?" over
+HTTP on a TCP port or a Unix socket. Concurrent requests are collected into
+micro-batches (up to max_batch vectors or max_wait seconds) and scored with
+a single forward pass.
+
+    POST /predict   {"car": "27", "features": [...]}
+                    or {"vectors": [[...], ...]} for several cars at once
+                    -> {"car": "27", "probability": 0.12} / {"probabilities": [...]}
+                    400 for invalid JSON, vectors of the wrong width or more
+                    than max_request vectors
+    GET  /stats     request/batch counters, p50/p99 latency (ms) and throughput
+                    of the answered requests, failed requests and batches
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def loadPredictor(path):
+    """
+    Batch predict function (n x features array -> n probabilities) of a
+    model exported with inference.exportModel (.npz, no TensorFlow needed)
+    or a saved Keras model, and the number of features it takes."""
+    if path.endswith(".npz"):
+        from inference import PitModel
+        model = PitModel(path)
+        return model.predict, len(model.columns)
+    from tensorflow import keras # only the service pays for the TensorFlow import
+    model = keras.models.load_model(path)
+
+    def predict(x):
+        return np.asarray(model(x, training=False)).reshape(-1)
+    return predict, model.input_shape[-1]
+
+
+class MicroBatcher:
+    def __init__(self, predict, width=None, max_batch=64, max_wait=0.002, max_request=4096):
+        """
+        width is the number of features of a vector (not checked if None),
+        max_request the most vectors one request may send."""
+        self.predict = predict
+        self.width = width
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_request = max_request
+        self.queue = asyncio.Queue()
+        # one thread so forward passes never overlap and the event loop stays free
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.vectors = 0
+        self.batches = 0
+        self.errors = 0 # requests that failed
+        self.failed_batches = 0
+        self.latencies = collections.deque(maxlen=10000) # seconds, answered requests only
+
+    async def score(self, vectors):
+        """
+        Probabilities of a list of feature vectors, batched with other
+        callers. ValueError for anything but a non-empty list of at most
+        max_request vectors of the model's width, before it can reach a batch.
+        """
+        start = time.perf_counter()
+        try:
+            x = np.asarray(vectors, dtype=np.float32)
+            if x.ndim != 2 or len(x) == 0:
+                raise ValueError("expected a non-empty list of feature vectors")
+            if len(x) > self.max_request:
+                raise ValueError("at most %d vectors per request, got %d" % (self.max_request, len(x)))
+            if self.width is not None and x.shape[1] != self.width:
+                raise ValueError("expected %d features per vector, got %d" % (self.width, x.shape[1]))
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((x, future))
+            probabilities = await future
+        except Exception:
+            self.errors += 1
+            raise
+        self.requests += 1
+        self.latencies.append(time.perf_counter() - start)
+        return probabilities
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            try:
+                x = np.concatenate([vectors for vectors, _ in batch])
+                probabilities = await loop.run_in_executor(self.executor, self.predict, x)
+            except Exception as e:
+                self.failed_batches += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.vectors += len(x)
+            offset = 0
+            for vectors, future in batch:
+                if not future.done():
+                    future.set_result(probabilities[offset:offset + len(vectors)].tolist())
+                offset += len(vectors)
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        elapsed = time.perf_counter() - self.started
+        return {"requests": self.requests, "vectors": self.vectors, "batches": self.batches,
+                "errors": self.errors, "failed_batches": self.failed_batches,
+                "mean_batch": self.vectors / self.batches if self.batches else 0,
+                "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+                "requests_per_s": self.requests / elapsed if elapsed > 0 else 0}
+
+
+class PitService:
+    def __init__(self, predict, width=None, max_batch=64, max_wait=0.002, max_request=4096):
+        self.batcher = MicroBatcher(predict, width, max_batch, max_wait, max_request)
+
+    async def handle(self, method, path, body):
+        """(status, payload) for one request."""
+        if method == "GET" and path == "/stats":
+            return 200, self.batcher.stats()
+        if method == "POST" and path == "/predict":
+            try:
+                request = json.loads(body or b"{}")
+                if "vectors" in request:
+                    return 200, {"probabilities": await self.batcher.score(request["vectors"])}
+                probability = (await self.batcher.score([request["features"]]))[0]
+                return 200, {"car": request.get("car"), "probability": probability}
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {"error": "%s: %s" % (type(e).__name__, e)}
+        return 404, {"error": "not found"}
+
+    async def connection(self, reader, writer):
+        """HTTP/1.1 with keep-alive, enough for local clients polling every lap."""
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = dict(line.split(":", 1) for line in lines[1:] if ":" in line)
+                headers = {k.strip().lower(): v.strip() for k, v in headers.items()}
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self.handle(method, path, body)
+                data = json.dumps(payload).encode()
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}[status]
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                             % (status, reason.encode(), len(data)) + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix=None):
+        batcher = asyncio.ensure_future(self.batcher.run())
+        if unix:
+            server = await asyncio.start_unix_server(self.connection, path=unix)
+        else:
+            server = await asyncio.start_server(self.connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve pit-stop probabilities of a trained model.")
+    parser.add_argument("model", help="exported .npz model or saved Keras model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2)
+    parser.add_argument("--max-request", type=int, default=4096, help="most vectors in one request")
+    args = parser.parse_args()
+
+    service = PitService(*loadPredictor(args.model), args.max_batch, args.max_wait_ms / 1000, args.max_request)
+    asyncio.run(service.serve(args.host, args.port, args.unix))
@@ -0,0 +1,219 @@
+"""
+Sharded binary training data and the tf.data pipeline that reads it.
+
+writeShards builds the features of one race at a time in a process pool and
+writes them as fixed size float32 records (encoded features, then the
+label) into shard files of at most rows_per_shard rows, so no process ever
+holds more than one race. manifest.json lists the shards of every race
+with its row and label counts and the sums of the numerical columns.
+
+Normalization is left to the pipeline: makeDataset centers the numerical
+columns on the means of the training races only (trainingMeans), so the
+same shards serve any train/test split by race.
+
+The manifest also records what the shards were built from (shardKey): the
+SHA-1 of every source CSV, the class and top-N car selection (and the cars
+it picked in every race) and the normalized columns. loadShards rebuilds
+the shards whenever any of those differs, so an edited race file or a
+new selection never trains on stale shards.
+"""
+
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import get_data
+from race import loadRace, finishingOrder, fileHash
+
+SHARD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".shards")
+SHARD_VERSION = 1
+
+
+def writeRaceShards(path, out_dir, class_="GTD", top=10, rows_per_shard=65536):
+    """Write the shards of one race and return its manifest entry."""
+    race_id = get_data.raceId(path)
+    data = get_data.buildRace(path, class_, top)
+    cars = finishingOrder(loadRace(path), class_)[:top]
+    encoded = get_data.encode(data[get_data.FEATURE_COLUMNS])
+    records = np.column_stack([encoded.to_numpy(dtype=np.float32),
+                               data[get_data.LABEL_COLUMN].to_numpy(dtype=np.float32)])
+    files = []
+    for k, start in enumerate(range(0, len(records), rows_per_shard)):
+        name = "%s-%04d.bin" % (race_id, k)
+        tmp = os.path.join(out_dir, name + ".tmp")
+        records[start:start + rows_per_shard].tofile(tmp)
+        os.replace(tmp, os.path.join(out_dir, name))
+        files.append(name)
+    return {"race": race_id, "cars": cars, "files": files, "rows": len(records),
+            "positives": int(records[:, -1].sum()),
+            "sums": {c: float(data[c].sum()) for c in get_data.NUMERICAL_COLUMNS},
+            "columns": list(encoded.columns)}
+
+
+def writeShards(source, out_dir=SHARD_DIR, class_="GTD", top=10, rows_per_shard=65536, workers=None):
+    """
+    Write the shards of every race in source (see get_data.racePaths) into
+    out_dir and return the manifest."""
+    paths = get_data.racePaths(source)
+    os.makedirs(out_dir, exist_ok=True)
+    n = len(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        races = list(pool.map(writeRaceShards, paths, [out_dir]*n, [class_]*n, [top]*n, [rows_per_shard]*n))
+
+    columns = races[0]["columns"] if races else []
+    for entry in races:
+        if entry.pop("columns") != columns:
+            raise ValueError("race %s encodes to different columns" % entry["race"])
+    manifest = {"version": SHARD_VERSION, "feature_version": get_data.FEATURE_VERSION,
+                "class": class_, "top": top, "key": shardKey(paths, class_, top), "paths": paths,
+                "columns": columns, "races": races}
+    manifest["means"] = trainingMeans(manifest, [entry["race"] for entry in races]) if races else {}
+    tmp = os.path.join(out_dir, "manifest.json.tmp")
+    with open(tmp, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp, os.path.join(out_dir, "manifest.json"))
+    return manifest
+
+
+def shardKey(paths, class_="GTD", top=10):
+    """What the shards of paths are built from: every CSV's SHA-1, the car selection and the normalization."""
+    return {"sources": [[get_data.raceId(p), fileHash(p)] for p in paths], "class": class_, "top": top,
+            "normalization": {"method": "center", "columns": get_data.NUMERICAL_COLUMNS}}
+
+
+def staleReason(manifest, paths=None, class_=None, top=None):
+    """
+    Why the shards of manifest are not those of paths, class_ and top (by
+    default the ones they were built from), None if they are.
+    """
+    paths = manifest.get("paths", []) if paths is None else paths
+    class_ = manifest.get("class") if class_ is None else class_
+    top = manifest.get("top") if top is None else top
+    key = manifest.get("key", {})
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        return "source missing: %s" % ", ".join(missing)
+    for field, value in shardKey(paths, class_, top).items():
+        if key.get(field) != value:
+            return "%s changed" % field
+    return None
+
+
+def readManifest(out_dir=SHARD_DIR, verify=False):
+    """The manifest of the shards in out_dir; verify also checks them against their source CSVs."""
+    with open(os.path.join(out_dir, "manifest.json")) as file:
+        manifest = json.load(file)
+    if manifest["feature_version"] != get_data.FEATURE_VERSION:
+        raise ValueError("shards in %s are from an older feature version, rebuild them" % out_dir)
+    reason = staleReason(manifest) if verify else None
+    if reason:
+        raise ValueError("shards in %s are stale (%s), rebuild them" % (out_dir, reason))
+    return manifest
+
+
+def loadShards(source, out_dir=SHARD_DIR, class_="GTD", top=10, rows_per_shard=65536, workers=None):
+    """Manifest of the shards of source in out_dir, written first if they are missing, outdated or stale."""
+    paths = get_data.racePaths(source)
+    try:
+        manifest = readManifest(out_dir)
+        reason = staleReason(manifest, paths, class_, top)
+    except FileNotFoundError:
+        reason = "no manifest"
+    except ValueError as e:
+        reason = str(e)
+    if reason is None:
+        return manifest
+    print("building shards in %s: %s" % (out_dir, reason), file=sys.stderr)
+    return writeShards(paths, out_dir, class_, top, rows_per_shard, workers)
+
+
+def splitRaces(manifest, test_races=None, test_count=1):
+    """Train and test race ids; the last test_count races are held out unless test_races is given."""
+    races = [entry["race"] for entry in manifest["races"]]
+    if len(races) < 2:
+        raise ValueError("holding out whole races needs at least two races, the shards have %d" % len(races))
+    if test_races is None:
+        test_races = races[-test_count:]
+    missing = set(test_races) - set(races)
+    if missing:
+        raise ValueError("no shards for races %s" % sorted(missing))
+    train_races = [r for r in races if r not in test_races]
+    if not train_races:
+        raise ValueError("every race is held out, none is left to train on")
+    return train_races, list(test_races)
+
+
+def raceEntries(manifest, races):
+    by_id = {entry["race"]: entry for entry in manifest["races"]}
+    return [by_id[r] for r in races]
+
+
+def trainingMeans(manifest, races):
+    """Means of the numerical columns over the rows of races."""
+    entries = raceEntries(manifest, races)
+    rows = sum(entry["rows"] for entry in entries)
+    if rows == 0:
+        raise ValueError("races %s have no rows to take means over" % list(races))
+    return {c: sum(entry["sums"][c] for entry in entries) / rows for c in get_data.NUMERICAL_COLUMNS}
+
+
+def classWeights(manifest, races):
+    """
+    The 'balanced' class weights of the labels of races, from the manifest
+    counts; unit weights when the races lack one of the classes.
+    """
+    entries = raceEntries(manifest, races)
+    return balancedWeights(sum(entry["rows"] for entry in entries), sum(entry["positives"] for entry in entries))
+
+
+def balancedWeights(rows, positives):
+    """'balanced' class weights of rows labels of which positives are 1; unit weights without both classes."""
+    if positives == 0 or positives == rows:
+        return {0: 1.0, 1: 1.0}
+    return {0: rows / (2 * (rows - positives)), 1: rows / (2 * positives)}
+
+
+def makeDataset(manifest, races, means, out_dir=SHARD_DIR, batch_size=256, shuffle=True,
+                shuffle_buffer=50000, seed=0):
+    """
+    tf.data pipeline of (features, label) batches over the shards of races:
+    shard files are read interleaved, records shuffled through a bounded
+    buffer, decoded a batch at a time in parallel and prefetched.
+    """
+    import tensorflow as tf # writing shards does not need TensorFlow
+
+    n_columns = len(manifest["columns"])
+    offset = np.zeros(n_columns, dtype=np.float32)
+    for c in get_data.NUMERICAL_COLUMNS:
+        offset[manifest["columns"].index(c)] = means[c]
+    offset = tf.constant(offset)
+
+    files = [os.path.join(out_dir, name) for entry in raceEntries(manifest, races) for name in entry["files"]]
+    record_bytes = 4 * (n_columns + 1)
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    if shuffle:
+        dataset = dataset.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.interleave(lambda f: tf.data.FixedLengthRecordDataset(f, record_bytes),
+                                 cycle_length=min(len(files), 4) if shuffle else 1,
+                                 num_parallel_calls=tf.data.AUTOTUNE,
+                                 deterministic=not shuffle)
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    def decode(records):
+        values = tf.io.decode_raw(records, tf.float32)
+        return values[:, :n_columns] - offset, values[:, n_columns]
+
+    dataset = dataset.batch(batch_size).map(decode, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+if __name__ == "__main__":
+    import time
+    start = time.perf_counter()
+    manifest = writeShards("./data")
+    print("%d races, %d rows in %.2f s" % (len(manifest["races"]), sum(e["rows"] for e in manifest["races"]),
+                                          time.perf_counter() - start))
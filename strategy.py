@@ -0,0 +1,246 @@
+"""
+Monte Carlo simulation of pit strategies over the rest of a race.
+
+RaceModel fits everything the simulation draws from on the recorded laps
+of a few cars: the fresh tire pace and the degradation per lap of their
+stints (degradation.fitStints), the lap to lap noise, how often a caution
+starts and how many laps it lasts, the lap times under yellow, and the
+time lost by a green and by a yellow stop (pits.PitStops.timeLost).
+
+A strategy is the list of laps on which the car stops. simulateBatch steps
+a batch of scenarios lap by lap as candidates x scenarios arrays; every
+candidate sees the same scenarios (pace, cautions, noise), so differences
+between candidates are not sampling noise. runStrategies splits the
+scenarios into batches over a process pool and returns the time every
+candidate needs for the remaining laps in every scenario.
+
+    python strategy.py --cars 27 --from-lap 400 --stops 6 7 8
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from degradation import cleanLaps, fitStints, referenceLaps
+from pits import extractPitStops, MAX_PIT_LOSS
+from race import loadRace, RaceIndex, finishingOrder
+
+MIN_STINT_LAPS = 5 # stints shorter than this do not count towards the pace fit
+STINT_PERCENTILE = 95 # of the observed stints, the longest a tank of fuel is taken to last
+
+
+class RaceModel:
+    """
+    The distributions of a race, fitted on the laps of cars.
+
+    base_mean, base_sd     fresh tire lap time (s) of a stint
+    slope_mean, slope_sd   lap time gained per lap of tire age (s)
+    spread                 lap to lap noise around the stint trend (s)
+    yellow_hazard          chance a caution starts on a green lap
+    yellow_laps            observed caution lengths (laps), drawn from
+    yellow_times           observed lap times under yellow (s), drawn from
+    green_losses,
+    yellow_losses          observed time lost by green and yellow stops (s)
+    max_stint              longest stint (laps) a strategy may plan, from
+                           the observed stints (fuel, not tires, sets it)
+    driver_change          extra time (s) of a green stop with a driver change
+    """
+
+    def __init__(self, race, index, cars, max_loss=MAX_PIT_LOSS):
+        stints = fitStints(race, index, cars)
+        stints = stints[stints["Laps"] >= MIN_STINT_LAPS]
+        codes = np.array([race.code("Car", c) for c in cars])
+        reference = referenceLaps(race, index)
+        lap_hours = np.nanmedian(reference[codes]) / 3600
+        self.base_mean = float(stints["Intercept"].mean())
+        self.base_sd = float(stints["Intercept"].std())
+        self.slope_mean = float(stints["Slope"].mean() * lap_hours)
+        self.slope_sd = float(stints["Slope"].std() * lap_hours)
+        self.spread = float(stints["Spread"].median())
+
+        order, first, _ = cleanLaps(race, index, cars)
+        yellow = race.mask("Flag", "Yellow")[order]
+        started = yellow & ~(np.r_[False, yellow[:-1]] & ~first)
+        ended = yellow & ~(np.r_[yellow[1:], False] & ~np.r_[first[1:], True])
+        self.yellow_hazard = float(started.sum() / max((~yellow).sum(), 1))
+        self.yellow_laps = np.flatnonzero(ended) - np.flatnonzero(started) + 1
+        on_track = race.mask("Location", "Track")[order]
+        self.yellow_times = race.lap_time[order[yellow & on_track]]
+
+        pits = extractPitStops(race, index)
+        stops = np.isin(pits.car, codes)
+        under_yellow = pits.flag == race.code("Flag", "Yellow")
+        lost = pits.timeLost(np.where(under_yellow, np.median(self.yellow_times), reference[pits.car]))
+        usable = stops & (lost > 0) & (lost < max_loss) # NaN (never left) drops out too
+        self.green_losses = lost[usable & ~under_yellow]
+        self.yellow_losses = lost[usable & under_yellow]
+        if not len(self.yellow_losses): # no stop under yellow to learn from
+            self.yellow_losses = self.green_losses
+        self.max_stint = int(np.percentile(pits.stint[stops], STINT_PERCENTILE))
+        left = pits.exit_row >= 0
+        changed = left & (race.driver[pits.entry_row] != race.driver[np.maximum(pits.exit_row, 0)])
+        green = usable & ~under_yellow
+        with_change, without = lost[green & changed], lost[green & ~changed]
+        self.driver_change = max(0.0, float(np.median(with_change) - np.median(without))) \
+            if len(with_change) and len(without) else 0.0
+
+    def describe(self):
+        return {"base pace": self.base_mean, "base sd": self.base_sd, "degradation per lap": self.slope_mean,
+                "degradation sd": self.slope_sd, "lap noise": self.spread, "caution hazard": self.yellow_hazard,
+                "caution laps": float(self.yellow_laps.mean()) if len(self.yellow_laps) else 0.0,
+                "yellow lap": float(np.median(self.yellow_times)) if len(self.yellow_times) else float("nan"),
+                "green pit loss": float(np.median(self.green_losses)),
+                "yellow pit loss": float(np.median(self.yellow_losses)), "max stint": self.max_stint,
+                "driver change": self.driver_change}
+
+
+def evenStrategies(start_lap, end_lap, stops, tire_age=0):
+    """
+    One strategy per count in stops, splitting the laps left, plus the
+    tire_age laps already run on the current tires, into even stints.
+    """
+    laps = end_lap - start_lap + 1 + tire_age
+    origin = start_lap - tire_age - 1
+    return [[max(start_lap, origin + int(round(k * laps / (n + 1)))) for k in range(1, n + 1)] for n in stops]
+
+
+def minimumStops(start_lap, end_lap, max_stint, tire_age=0):
+    """Fewest stops that keep every stint within max_stint laps."""
+    return max(0, -(-(end_lap - start_lap + 1 + tire_age) // max_stint) - 1)
+
+
+def longestStint(stops, start_lap, end_lap, tire_age=0):
+    """Longest run of laps on one set of tires (and fuel) that the stops leave."""
+    laps = sorted(lap for lap in stops if start_lap <= lap <= end_lap)
+    bounds = [start_lap - tire_age - 1] + laps + [end_lap]
+    return max(b - a for a, b in zip(bounds[:-1], bounds[1:]))
+
+
+def pitMatrix(candidates, start_lap, end_lap):
+    """candidates x laps mask of the stops of every strategy within start_lap..end_lap."""
+    pit = np.zeros((len(candidates), end_lap - start_lap + 1), dtype=bool)
+    for c, stops in enumerate(candidates):
+        laps = np.array([lap for lap in stops if start_lap <= lap <= end_lap], dtype=np.intp)
+        pit[c, laps - start_lap] = True
+    return pit
+
+
+def simulateBatch(model, pit, tire_age, n_scenarios, seed):
+    """
+    Remaining race time (s) of every candidate (rows of the pit mask) in
+    n_scenarios scenarios, candidates x scenarios. Every scenario draws its
+    own fresh tire pace and degradation, then every lap its cautions, noise
+    and pit losses, the same for all candidates.
+    """
+    rng = np.random.default_rng(seed)
+    n_candidates, laps = pit.shape
+    base = model.base_mean + model.base_sd * rng.standard_normal(n_scenarios)
+    slope = model.slope_mean + model.slope_sd * rng.standard_normal(n_scenarios)
+    has_yellow = len(model.yellow_laps) > 0 and len(model.yellow_times) > 0
+
+    age = np.full((n_candidates, n_scenarios), float(tire_age))
+    total = np.zeros((n_candidates, n_scenarios))
+    caution = np.zeros(n_scenarios, dtype=np.int64) # caution laps left
+    for lap in range(laps):
+        if has_yellow:
+            start = (caution == 0) & (rng.random(n_scenarios) < model.yellow_hazard)
+            caution[start] = rng.choice(model.yellow_laps, int(start.sum()))
+        yellow = caution > 0
+        green = base + model.spread * rng.standard_normal(n_scenarios)
+        lap_time = green + slope*age
+        if yellow.any():
+            lap_time[:, yellow] = rng.choice(model.yellow_times, int(yellow.sum()))
+
+        stopping = pit[:, lap]
+        if stopping.any():
+            loss = np.where(yellow, rng.choice(model.yellow_losses, n_scenarios),
+                            rng.choice(model.green_losses, n_scenarios))
+            lap_time[stopping] += loss
+            age[stopping] = 0
+        total += lap_time
+        age += 1
+        caution -= yellow
+    return total
+
+
+def runStrategies(model, candidates, start_lap, end_lap, tire_age=0, n_scenarios=10000, workers=None,
+                  batch_size=2000, seed=0):
+    """
+    Time (s) each candidate (a list of pit laps) needs from the start of
+    start_lap to the end of end_lap in every scenario, candidates x
+    n_scenarios. The batches get their own seeds, so the result does not
+    depend on the number of workers.
+    """
+    pit = pitMatrix(candidates, start_lap, end_lap)
+    sizes = [min(batch_size, n_scenarios - k) for k in range(0, n_scenarios, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    n = len(sizes)
+    if workers == 1 or n == 1:
+        batches = [simulateBatch(model, pit, tire_age, size, s) for size, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            batches = list(pool.map(simulateBatch, [model]*n, [pit]*n, [tire_age]*n, sizes, seeds))
+    return np.concatenate(batches, axis=1)
+
+
+def summarize(candidates, times, model=None, start_lap=None, end_lap=None, tire_age=0):
+    """
+    One row per candidate: its stops, the mean, spread and quantiles of its
+    time and the share of scenarios in which it is the fastest candidate.
+    With the model and the lap range, also its longest stint and whether
+    that fits the model's max_stint; infeasible candidates are left out of
+    the fastest share.
+    """
+    summary = pd.DataFrame({"Stops": [len(c) for c in candidates],
+                            "Pit laps": [" ".join(str(lap) for lap in c) for c in candidates]})
+    feasible = np.ones(len(candidates), dtype=bool)
+    if model is not None:
+        summary["Longest stint"] = [longestStint(c, start_lap, end_lap, tire_age) for c in candidates]
+        feasible = summary["Longest stint"].to_numpy() <= model.max_stint
+        summary["Feasible"] = feasible
+    p10, p50, p90 = np.percentile(times, [10, 50, 90], axis=1)
+    summary["Mean"], summary["Std"] = times.mean(axis=1), times.std(axis=1)
+    summary["P10"], summary["P50"], summary["P90"] = p10, p50, p90
+    fastest = np.zeros(len(candidates))
+    if feasible.any():
+        best = np.flatnonzero(feasible)[times[feasible].argmin(axis=0)]
+        fastest = np.bincount(best, minlength=len(candidates)) / times.shape[1]
+    summary["Fastest share"] = fastest
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the rest of a race for several pit strategies.")
+    parser.add_argument("--race", default="./data/Daytona_24hrs_GTD_replay(2023).csv")
+    parser.add_argument("--class", dest="class_", default="GTD")
+    parser.add_argument("--cars", nargs='+', help="cars the model is fitted on (default: the class finishers)")
+    parser.add_argument("--from-lap", type=int, default=1)
+    parser.add_argument("--to-lap", type=int, help="last lap (default: the last lap of the race)")
+    parser.add_argument("--tire-age", type=int, default=0, help="laps on the tires at --from-lap")
+    parser.add_argument("--stops", nargs='+', type=int, help="stop counts to try (default: the fewest feasible and 3 more)")
+    parser.add_argument("--scenarios", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    race = loadRace(args.race)
+    index = RaceIndex(race)
+    model = RaceModel(race, index, args.cars or finishingOrder(race, args.class_))
+    to_lap = args.to_lap or int(race.lap.max())
+    for name, value in model.describe().items():
+        print("%-20s %10.4f" % (name, value))
+    fewest = minimumStops(args.from_lap, to_lap, model.max_stint, args.tire_age)
+    candidates = evenStrategies(args.from_lap, to_lap, args.stops or range(fewest, fewest + 4), args.tire_age)
+    start = time.perf_counter()
+    times = runStrategies(model, candidates, args.from_lap, to_lap, args.tire_age, args.scenarios,
+                          args.workers, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    summary = summarize(candidates, times, model, args.from_lap, to_lap, args.tire_age)
+    print(summary.drop(columns="Pit laps").to_string(index=False))
+    laps = times.size * (to_lap - args.from_lap + 1)
+    print("%d scenarios x %d strategies x %d laps in %.2f s, %.1f M laps/s"
+          % (args.scenarios, len(candidates), to_lap - args.from_lap + 1, elapsed, laps / elapsed / 1e6))
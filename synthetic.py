@@ -0,0 +1,220 @@
+"""
+Seeded synthetic races in the timing CSV schema, for load tests.
+
+Rows come out in the order cars cross the line, exactly like the real
+files: "mm:ss.s" lap times, session times without the hour (readRace
+rebuilds it from the rollover), Green/Yellow/Finish flags, Track/Pit
+locations and S01-S03 sectors adding up to the lap time. Every car runs
+stints of a fuel window length with tire degradation, stops early when a
+yellow comes out late in a stint, hands over to the next driver every few
+stops and takes the flag on its first crossing after the leader's.
+
+Only one pending crossing per car is held in memory, so the size of the
+file is limited by the disk, not the RAM.
+
+    python synthetic.py out.csv --cars 60 --classes 3 --hours 24 --seed 1
+"""
+
+import argparse
+import heapq
+import random
+
+HEADER = "Car,Class,Driver,Lap,Lap Time,Session Time,Flag,Location,S01,S02,S03\n"
+
+# name, green lap (s), fuel window (laps), share of the field
+CLASSES = [("GTP", 96.0, 26, 0.2), ("LMP2", 100.0, 30, 0.15), ("LMP3", 104.0, 34, 0.1),
+           ("GTD PRO", 107.5, 28, 0.15), ("GTD", 108.5, 28, 0.4)]
+SECTOR_SHARES = (0.238, 0.467, 0.295) # of the lap, from the Daytona GTD sectors
+FIRST_NAMES = ("Alex", "Ben", "Carla", "Dario", "Elena", "Felipe", "Gina", "Hugo", "Ines", "Jan",
+               "Kenta", "Lena", "Marco", "Nina", "Oscar", "Pia", "Raul", "Sara", "Tom", "Vera")
+LAST_NAMES = ("Abt", "Bauer", "Costa", "Duval", "Eklund", "Ferraz", "Grant", "Hayes", "Ito", "Jensen",
+              "Kovac", "Laurent", "Moreau", "Novak", "Olsen", "Price", "Rossi", "Silva", "Tanaka", "Weber")
+
+YELLOW_SLOWDOWN = 1.45 # lap time factor behind the safety car
+PIT_IN_LOSS = 14.0 # extra seconds in the last sector of the in lap
+PIT_OUT_LOSS = 20.0 # extra seconds in the first sector of the out lap, on top of the stationary time
+PIT_SERVICE = 35.0 # stationary seconds for fuel and tires
+DRIVER_CHANGE = 8.0 # extra stationary seconds for a driver change
+DEGRADATION = 0.045 # seconds per lap of tire age
+
+
+def raceClasses(n_classes):
+    """(name, pace, window, share) of n_classes classes, ending with GTD."""
+    classes = CLASSES[-n_classes:] if n_classes <= len(CLASSES) else list(CLASSES)
+    for k in range(len(classes), n_classes):
+        classes.append(("C%d" % (k + 1), 100.0 + 2*k, 30, 0.1))
+    return classes
+
+
+def formatTime(tenths):
+    """"mm:ss.s" of a time in tenths of a second, dropping whole hours like the timing feed."""
+    tenths %= 36000
+    return "%02d:%02d.%d" % (tenths // 600, tenths // 10 % 60, tenths % 10)
+
+
+class Yellows:
+    """Full course yellow periods, drawn lazily as the race time moves on."""
+
+    def __init__(self, rng, per_hour=0.6, mean_length=900.0):
+        self.rng = rng
+        self.per_hour = per_hour
+        self.mean_length = mean_length
+        self.start = 0.0
+        self.end = 0.0
+        self.draw(600.0) # no yellow in the first ten minutes
+
+    def draw(self, after):
+        self.start = after + self.rng.expovariate(self.per_hour / 3600)
+        self.end = self.start + max(240.0, self.rng.gauss(self.mean_length, self.mean_length / 3))
+
+    def active(self, t):
+        while t >= self.end:
+            self.draw(self.end + 300.0)
+        return self.start <= t
+
+
+class Car:
+    def __init__(self, number, class_, pace, window, drivers, rng, grid_slot):
+        self.number = number
+        self.class_ = class_
+        self.pace = pace + rng.gauss(0.8, 0.6) # a little slower than the class benchmark
+        self.window = window
+        self.drivers = drivers
+        self.skill = [rng.gauss(0, 0.4) for _ in drivers]
+        self.rng = rng
+        self.lap = 0
+        self.tire_age = 0
+        self.stint_laps = 0
+        self.stops = 0
+        self.driver = 0
+        self.stint_target = window - rng.randint(0, 3)
+        self.stationary = 0.0 # service time added to the next out lap
+        self.time = grid_slot # tenths, so the field crosses the start line in order
+
+    def nextLap(self, yellow):
+        """Lap time (tenths), sectors (ms), location and driver of the next lap."""
+        rng = self.rng
+        self.lap += 1
+        driver = self.drivers[self.driver]
+        green = self.pace + self.skill[self.driver] + DEGRADATION * self.tire_age + abs(rng.gauss(0, 0.35))
+        if self.lap == 1:
+            green += 25.0 # standing start behind the pace car
+        lap = green * YELLOW_SLOWDOWN * rng.uniform(0.95, 1.2) if yellow else green
+        sectors = [lap * share * rng.uniform(0.99, 1.01) for share in SECTOR_SHARES]
+
+        if self.stationary:
+            sectors[0] += PIT_OUT_LOSS + self.stationary
+            self.stationary = 0.0
+        self.tire_age += 1
+        self.stint_laps += 1
+
+        # box when the fuel runs out, or early for a cheap stop under yellow
+        pit = self.stint_laps >= self.stint_target or (yellow and self.stint_laps >= 0.6 * self.stint_target)
+        if pit:
+            sectors[2] += PIT_IN_LOSS
+            self.stops += 1
+            self.stationary = PIT_SERVICE + rng.uniform(-3, 6)
+            self.stint_laps = 0
+            self.stint_target = self.window - rng.randint(0, 3)
+            if rng.random() < 0.85: # tires are sometimes double stinted
+                self.tire_age = 0
+            if self.stops % rng.choice((2, 3)) == 0:
+                self.driver = (self.driver + 1) % len(self.drivers)
+                self.stationary += DRIVER_CHANGE
+
+        sector_ms = [int(round(s * 1000)) for s in sectors]
+        tenths = int(round(sum(sector_ms) / 100))
+        sector_ms[2] += tenths * 100 - sum(sector_ms) # sectors add up to the displayed lap time
+        return tenths, sector_ms, "Pit" if pit else "Track", driver
+
+
+def driverNames(n, rng):
+    """
+    n different driver names in random order, drawn without replacement from
+    every first and last name pair (numbered "Alex Abt 2" once those run out)."""
+    pairs = ["%s %s" % (first, last) for first in FIRST_NAMES for last in LAST_NAMES]
+    rounds = -(-n // len(pairs))
+    pool = [name if k == 0 else "%s %d" % (name, k + 1) for k in range(rounds) for name in pairs]
+    return rng.sample(pool, n)
+
+
+def makeField(n_cars, n_classes, seed):
+    """Cars of every class with numbers, drivers and their own random streams."""
+    classes = raceClasses(n_classes)
+    total = sum(c[3] for c in classes)
+    counts = [max(1, int(round(n_cars * c[3] / total))) for c in classes]
+    counts[-1] += n_cars - sum(counts)
+    n = sum(max(count, 0) for count in counts)
+    names = driverNames(sum(3 + (i % 2) for i in range(n)), random.Random(seed))
+    cars = []
+    for (class_, pace, window, _), count in zip(classes, counts):
+        for _ in range(max(count, 0)):
+            i = len(cars)
+            drivers = [names.pop() for _ in range(3 + (i % 2))]
+            rng = random.Random(seed * 1000003 + i)
+            cars.append(Car(str(2 + i), class_, pace, window, drivers, rng, grid_slot=3 * i))
+    return cars
+
+
+def generateRows(n_cars=40, n_classes=1, hours=24.0, seed=0):
+    """Yield the CSV lines of a synthetic race, one crossing at a time in session time order."""
+    cars = makeField(n_cars, n_classes, seed)
+    yellows = Yellows(random.Random(seed * 1000003 - 1))
+    end = int(hours * 36000)
+    checkered = False
+    leader_lap = 0
+    queue = [] # (time of the next crossing, car index, lap data)
+
+    def schedule(i):
+        car = cars[i]
+        yellow = yellows.active(car.time / 10)
+        tenths, sectors, location, driver = car.nextLap(yellow)
+        car.time += tenths
+        heapq.heappush(queue, (car.time, i, yellow, tenths, sectors, location, driver))
+
+    for i in range(len(cars)):
+        schedule(i)
+    while queue:
+        time, i, yellow, tenths, sectors, location, driver = heapq.heappop(queue)
+        car = cars[i]
+        leader_lap = max(leader_lap, car.lap)
+        # the flag comes out for the leader; everyone else finishes on their next crossing
+        checkered = checkered or (time >= end and car.lap == leader_lap)
+        flag = "Finish" if checkered else ("Yellow" if yellow else "Green")
+        yield "%s,%s,%s,%d,%s,%s,%s,%s,%.3f,%.3f,%.3f\n" % (
+            car.number, car.class_, driver, car.lap, formatTime(tenths), formatTime(time), flag, location,
+            sectors[0] / 1000, sectors[1] / 1000, sectors[2] / 1000)
+        if not checkered:
+            schedule(i)
+
+
+def writeRace(path, n_cars=40, n_classes=1, hours=24.0, seed=0, buffer_rows=4096):
+    """Write a synthetic race to path and return the number of rows."""
+    rows = 0
+    with open(path, 'w', newline='') as file:
+        file.write(HEADER)
+        chunk = []
+        for line in generateRows(n_cars, n_classes, hours, seed):
+            chunk.append(line)
+            if len(chunk) == buffer_rows:
+                file.write("".join(chunk))
+                rows += len(chunk)
+                chunk = []
+        file.write("".join(chunk))
+        rows += len(chunk)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic race in the timing CSV schema.")
+    parser.add_argument("out", help="CSV file to write")
+    parser.add_argument("--cars", type=int, default=40)
+    parser.add_argument("--classes", type=int, default=1)
+    parser.add_argument("--hours", type=float, default=24.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import time
+    start = time.perf_counter()
+    rows = writeRace(args.out, args.cars, args.classes, args.hours, args.seed)
+    print("%d rows in %.1f s" % (rows, time.perf_counter() - start))
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import race
+
+DATA_DIR = os.path.join(ROOT, "data")
+RACE_2022 = os.path.join(DATA_DIR, "Daytona_24hrs_GTD_replay(2022).csv")
+RACE_2023 = os.path.join(DATA_DIR, "Daytona_24hrs_GTD_replay(2023).csv")
+
+
+def copyRace(path, out_path, lines=None):
+    """Copy the race CSV at path to out_path, only its first lines (header included) if given."""
+    with open(path) as file, open(out_path, 'w') as out:
+        for i, line in enumerate(file):
+            if lines is not None and i >= lines:
+                break
+            out.write(line)
+    return out_path
+
+
+@pytest.fixture(autouse=True)
+def race_cache(tmp_path, monkeypatch):
+    """Parsed races of a test go to its own cache, never into the repository one."""
+    monkeypatch.setattr(race, "CACHE_DIR", str(tmp_path / "race_cache"))
+
+
+@pytest.fixture
+def short_races(tmp_path):
+    """The first 3000 rows of both races, in their own directory."""
+    out_dir = tmp_path / "races"
+    out_dir.mkdir()
+    return [copyRace(path, str(out_dir / os.path.basename(path)), 3001) for path in (RACE_2022, RACE_2023)]
@@ -0,0 +1,44 @@
+import numpy as np
+
+import get_data
+from conftest import copyRace, RACE_2023
+
+
+def corruptLapTime(path, car, lap):
+    """Replace the lap time of car on lap with an unparseable one, return the original."""
+    with open(path) as file:
+        lines = file.read().splitlines()
+    for i, line in enumerate(lines):
+        fields = line.split(",")
+        if fields[0] == car and fields[3] == str(lap):
+            original, fields[4] = fields[4], "1:xx.x"
+            lines[i] = ",".join(fields)
+            break
+    with open(path, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+    return original
+
+
+def test_group_cumsum_restarts_per_group():
+    values = np.array([1.0, 2.0, np.nan, 4.0, 5.0, 6.0])
+    start = np.array([True, False, False, False, True, False])
+    assert np.array_equal(get_data.groupCumsum(values, start), [1.0, 3.0, 3.0, 7.0, 5.0, 11.0])
+
+
+def test_malformed_lap_time_stays_in_its_row(tmp_path):
+    clean = get_data.Dataset(copyRace(RACE_2023, str(tmp_path / "clean.csv"), 3001))
+    path = copyRace(RACE_2023, str(tmp_path / "malformed.csv"), 3001)
+    original = corruptLapTime(path, "27", 10)
+    malformed = get_data.Dataset(path)
+    assert [(m.column, m.value) for m in malformed.data.malformed] == [("Lap Time", "1:xx.x")]
+
+    tire_age, clean_age = malformed.getTireAge(), clean.getTireAge()
+    assert not np.isnan(tire_age).any()
+    car = malformed.data.car == malformed.data.code("Car", "27")
+    assert np.array_equal(tire_age[~car], clean_age[~car])
+    # the car's stint only misses the wear of the malformed lap
+    missing = clean_age[car] - tire_age[car]
+    minutes, seconds = original.split(":")
+    wear = (int(minutes)*60 + float(seconds)) / get_data.RACE_SECONDS
+    assert np.all(np.isclose(missing, 0) | np.isclose(missing, wear))
+    assert np.isclose(missing, wear).any()
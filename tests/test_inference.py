@@ -0,0 +1,85 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import cli
+import get_data
+from conftest import copyRace, RACE_2023
+from inference import exportModel, PitModel
+
+COLUMNS = ["Race Progress", "Tire age", "Driver duration", "Remaing pit stops", "Position", "Laps down",
+           "Yellow flag_False", "Yellow flag_True", "Is close ahead_False", "Is close ahead_True",
+           "Pursuer tire change_False", "Pursuer tire change_True"]
+
+
+@pytest.fixture(scope="module")
+def keras_model():
+    from model import buildModel
+    import tensorflow as tf
+    tf.random.set_seed(0)
+    return buildModel(len(COLUMNS), layers=(16, 8))
+
+
+@pytest.fixture
+def exported(keras_model, tmp_path):
+    path = str(tmp_path / "pit_model.npz")
+    exportModel(keras_model, path, COLUMNS, {c: 0.1 for c in get_data.NUMERICAL_COLUMNS})
+    return path
+
+
+def setFeatureVersion(path, version):
+    """Rewrite the schema of an exported model as if trained on another feature version."""
+    with np.load(path) as file:
+        arrays = {k: file[k] for k in file.files}
+    schema = json.loads(arrays["schema"].tobytes().decode())
+    schema["feature_version"] = version
+    arrays["schema"] = np.frombuffer(json.dumps(schema).encode(), dtype=np.uint8)
+    np.savez_compressed(path, **arrays)
+
+
+def test_export_records_feature_version(exported):
+    assert PitModel(exported).schema["feature_version"] == get_data.FEATURE_VERSION
+
+
+def test_older_feature_version_is_refused(exported, tmp_path):
+    setFeatureVersion(exported, get_data.FEATURE_VERSION - 1)
+    with pytest.raises(ValueError, match="feature version"):
+        PitModel(exported)
+    race = copyRace(RACE_2023, str(tmp_path / "race.csv"), 3001)
+    with pytest.raises(ValueError, match="feature version"):
+        cli.main(["predict", exported, race])
+
+
+def test_numpy_model_matches_keras(short_races, tmp_path):
+    from model import buildModel
+    import tensorflow as tf
+    import live
+    import shards
+
+    out_dir = str(tmp_path / "shards")
+    manifest = shards.loadShards(short_races, out_dir, workers=1)
+    races = [entry["race"] for entry in manifest["races"]]
+    means = shards.trainingMeans(manifest, races)
+    tf.random.set_seed(0)
+    net = buildModel(len(manifest["columns"]), layers=(16, 8))
+    net.fit(shards.makeDataset(manifest, races, means, out_dir, 256), epochs=1, verbose=0)
+    path = str(tmp_path / "pit_model.npz")
+    exportModel(net, path, manifest["columns"], means)
+    pit_model = PitModel(path)
+
+    # the NumPy encoding of the features is exactly what the training pipeline decodes from the shards
+    race = races[1]
+    features = get_data.Dataset(short_races[1]).makeData()
+    X = pit_model.encodeColumns(features)
+    piped = np.concatenate([x.numpy() for x, _ in shards.makeDataset(manifest, [race], means, out_dir, 256,
+                                                                      shuffle=False)])
+    assert np.array_equal(X, piped)
+    records = np.concatenate([np.fromfile(os.path.join(out_dir, name), dtype=np.float32)
+                              for name in shards.raceEntries(manifest, [race])[0]["files"]])
+    assert np.array_equal(X, records.reshape(len(X), -1)[:, :-1] - pit_model.offset)
+
+    keras_pred = net.predict(X, verbose=0).reshape(-1)
+    assert np.allclose(keras_pred, pit_model.predict(X), atol=1e-5)
+    assert np.allclose(keras_pred, pit_model.predictRecords(live.replay(short_races[1]).to_dict("records")), atol=1e-5)
@@ -0,0 +1,16 @@
+import pytest
+
+import live
+from conftest import copyRace, RACE_2022, RACE_2023
+from get_data import Dataset
+
+
+@pytest.mark.parametrize("path", [RACE_2022, RACE_2023])
+def test_replay_matches_dataset(path):
+    """Replaying a whole race row by row gives exactly the batch features (2023 logs crossings late)."""
+    assert set(live.mismatches(Dataset(path).makeData(), live.replay(path)).values()) == {0}
+
+
+def test_replay_of_a_race_in_progress(tmp_path):
+    path = copyRace(RACE_2023, str(tmp_path / "race.csv"), 5001)
+    assert set(live.mismatches(Dataset(path).makeData(), live.replay(path)).values()) == {0}
@@ -0,0 +1,16 @@
+import numpy as np
+from sklearn.utils.class_weight import compute_class_weight
+
+import model
+
+
+def test_class_weights_match_sklearn():
+    y = np.array([0]*90 + [1]*10)
+    expected = compute_class_weight('balanced', classes=np.array([0, 1]), y=y)
+    weights = model.classWeights(y)
+    assert np.allclose([weights[0], weights[1]], expected)
+
+
+def test_class_weights_of_one_class():
+    assert model.classWeights(np.zeros(50, dtype=bool)) == {0: 1.0, 1: 1.0}
+    assert model.classWeights(np.ones(50)) == {0: 1.0, 1: 1.0}
@@ -0,0 +1,114 @@
+"""
+The service over real TCP connections, with an asyncio client (the service
+is plain asyncio, no HTTP framework).
+"""
+
+import asyncio
+import json
+
+import numpy as np
+
+from serve import PitService
+
+WIDTH = 3
+
+
+class CountingModel:
+    """Sum of the features as the probability, counting the forward passes."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, x):
+        self.batches.append(len(x))
+        return x.sum(axis=1)
+
+
+async def request(port, method, path, body=None):
+    """(status, payload) of one HTTP request; body is sent as is if bytes, else as JSON."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b""
+    writer.write(b"%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                 % (method.encode(), path.encode(), len(data)) + data)
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+    payload = json.loads(await reader.readexactly(length))
+    writer.close()
+    return int(head.split(b" ")[1]), payload
+
+
+def withService(client, max_batch=64, max_wait=0.002, max_request=8):
+    """Run client(port) against a PitService on a free port, return its result, the service and the model."""
+    model = CountingModel()
+    service = PitService(model, WIDTH, max_batch, max_wait, max_request)
+
+    async def main():
+        batcher = asyncio.ensure_future(service.batcher.run())
+        server = await asyncio.start_server(service.connection, "127.0.0.1", 0)
+        try:
+            return await client(server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            batcher.cancel()
+
+    return asyncio.run(main()), service, model
+
+
+def test_predict():
+    async def client(port):
+        return (await request(port, "POST", "/predict", {"car": "27", "features": [0.1, 0.2, 0.3]}),
+                await request(port, "POST", "/predict", {"vectors": [[1, 2, 3], [0, 0, 1]]}))
+
+    (single, several), _, _ = withService(client)
+    assert single[0] == 200 and single[1]["car"] == "27" and np.isclose(single[1]["probability"], 0.6)
+    assert several == (200, {"probabilities": [6.0, 1.0]})
+
+
+def test_bad_requests():
+    bodies = [b"{not json", # bad JSON
+              {"car": "27"}, # no features
+              {"features": [0.1, 0.2]}, # too few features
+              {"features": [0.1, 0.2, 0.3, 0.4]}, # unknown extra feature
+              {"features": ["fast", 0.2, 0.3]}, # not a number
+              {"vectors": []},
+              {"vectors": [[0.1, 0.2, 0.3]] * 9}] # more than max_request
+
+    async def client(port):
+        return [await request(port, "POST", "/predict", body) for body in bodies]
+
+    responses, service, model = withService(client)
+    assert [status for status, _ in responses] == [400] * len(bodies)
+    assert all("error" in payload for _, payload in responses)
+    assert "at most 8 vectors" in responses[-1][1]["error"]
+    assert model.batches == [] # nothing invalid reaches the model
+    assert service.batcher.errors == len(bodies) - 2 # bad JSON and no features never get to the batcher
+
+
+def test_unknown_path():
+    (status, _), _, _ = withService(lambda port: request(port, "GET", "/nothing"))
+    assert status == 404
+
+
+def test_concurrent_requests_share_a_batch():
+    async def client(port):
+        bodies = [{"car": str(k), "features": [k, 0, 0]} for k in range(10)]
+        return await asyncio.gather(*(request(port, "POST", "/predict", body) for body in bodies))
+
+    responses, service, model = withService(client, max_batch=64, max_wait=0.2)
+    assert [payload["probability"] for _, payload in responses] == list(range(10))
+    assert [payload["car"] for _, payload in responses] == [str(k) for k in range(10)]
+    assert sum(model.batches) == 10 and len(model.batches) < 10
+
+
+def test_stats():
+    async def client(port):
+        await request(port, "POST", "/predict", {"vectors": [[1, 2, 3], [4, 5, 6]]})
+        await request(port, "POST", "/predict", {"features": [1, 2]})
+        return await request(port, "GET", "/stats")
+
+    (status, stats), _, _ = withService(client)
+    assert status == 200
+    assert (stats["requests"], stats["vectors"], stats["batches"], stats["errors"]) == (1, 2, 1, 1)
+    assert stats["failed_batches"] == 0 and stats["mean_batch"] == 2
+    assert stats["p50_ms"] is not None and stats["p99_ms"] >= stats["p50_ms"]
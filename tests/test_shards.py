@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+import get_data
+import shards
+
+
+def readRows(path):
+    with open(path) as file:
+        return file.read().splitlines()
+
+
+def test_manifest_records_sources(short_races, tmp_path):
+    manifest = shards.loadShards(os.path.dirname(short_races[0]), str(tmp_path / "shards"), workers=1)
+    assert manifest["key"] == shards.shardKey(get_data.racePaths(short_races), "GTD", 10)
+    assert [entry["race"] for entry in manifest["races"]] == [get_data.raceId(p) for p in short_races]
+    assert all(0 < len(entry["cars"]) <= 10 for entry in manifest["races"])
+    assert set(manifest["means"]) == set(get_data.NUMERICAL_COLUMNS)
+    assert shards.staleReason(manifest) is None
+
+
+def test_edited_race_rebuilds_shards(short_races, tmp_path):
+    source, out_dir = os.path.dirname(short_races[0]), str(tmp_path / "shards")
+    first = shards.loadShards(source, out_dir, workers=1)
+    assert shards.loadShards(source, out_dir, workers=1) == first
+
+    # slow one lap of the 2023 race down by ten seconds
+    lines = readRows(short_races[1])
+    fields = lines[100].split(",")
+    assert fields[4].startswith("01:5")
+    fields[4] = "02:0" + fields[4][4:]
+    lines[100] = ",".join(fields)
+    with open(short_races[1], 'w') as file:
+        file.write("\n".join(lines) + "\n")
+
+    with pytest.raises(ValueError, match="stale"):
+        shards.readManifest(out_dir, verify=True)
+    rebuilt = shards.loadShards(source, out_dir, workers=1)
+    assert rebuilt["key"]["sources"][0] == first["key"]["sources"][0]
+    assert rebuilt["key"]["sources"][1] != first["key"]["sources"][1]
+    with open(os.path.join(out_dir, "manifest.json")) as file:
+        assert json.load(file) == rebuilt
+    shards.readManifest(out_dir, verify=True)
+
+
+def test_new_selection_rebuilds_shards(short_races, tmp_path):
+    source, out_dir = os.path.dirname(short_races[0]), str(tmp_path / "shards")
+    shards.loadShards(source, out_dir, workers=1)
+    manifest = shards.loadShards(source, out_dir, top=5, workers=1)
+    assert manifest["top"] == 5
+    assert all(len(entry["cars"]) <= 5 for entry in manifest["races"])
+
+
+def fakeManifest(rows):
+    """Manifest of races with the given row counts, every numerical column summing to the rows."""
+    return {"races": [{"race": "race%d" % k, "rows": n, "positives": n // 10,
+                       "sums": {c: float(n) for c in get_data.NUMERICAL_COLUMNS}} for k, n in enumerate(rows)]}
+
+
+def test_split_needs_two_races():
+    with pytest.raises(ValueError, match="at least two races"):
+        shards.splitRaces(fakeManifest([100]))
+    with pytest.raises(ValueError, match="none is left to train on"):
+        shards.splitRaces(fakeManifest([100, 200]), ["race0", "race1"])
+    assert shards.splitRaces(fakeManifest([100, 200])) == (["race0"], ["race1"])
+
+
+def test_training_means_without_rows():
+    with pytest.raises(ValueError, match="no rows"):
+        shards.trainingMeans(fakeManifest([0, 100]), ["race0"])
+    assert shards.trainingMeans(fakeManifest([0, 100]), ["race0", "race1"])["Tire age"] == 1.0
+
+
+def test_class_weights_of_one_class():
+    manifest = fakeManifest([5, 100])
+    assert shards.classWeights(manifest, ["race0"]) == {0: 1.0, 1: 1.0}
+    assert shards.classWeights(manifest, ["race1"]) == {0: 100 / 180, 1: 100 / 20}
@@ -0,0 +1,12 @@
+import synthetic
+
+
+def test_every_driver_is_unique():
+    for n_cars in (60, 150): # 150 cars need more drivers than there are name pairs
+        drivers = [driver for car in synthetic.makeField(n_cars, 5, seed=0) for driver in car.drivers]
+        assert len(set(drivers)) == len(drivers)
+
+
+def test_field_is_reproducible():
+    first, second = synthetic.makeField(40, 2, seed=3), synthetic.makeField(40, 2, seed=3)
+    assert [car.drivers for car in first] == [car.drivers for car in second]
@@ -0,0 +1,182 @@
+"""
+Undercut and overcut picture of a whole class, lap by lap.
+
+For every pair of cars (car, rival) of the class and every lap of a range,
+UndercutMatrix projects what a stop at the end of that lap does:
+
+    gap           car behind rival (s) when the lap is completed
+    gap_after     the same gap once the car has made its stop and the rival
+                  stayed out: gap plus the car's pit loss
+    answered_gap  the gap once the rival answers on the next lap: the car
+                  makes up the rival's pit loss and its fresh tire lap
+                  against the rival's current pace
+    position_after
+                  class position of the car after its stop, everyone else
+                  staying out
+
+as cars x cars x laps (cars x laps for positions) arrays, all taken from
+the gaps.GapMatrix session times. Pit losses are measured per car and flag on
+the race itself (pitLosses), fresh tire pace is the car's first clean lap
+after its stops (freshPace), current pace the median of its last clean laps.
+"""
+
+import numpy as np
+import pandas as pd
+
+from degradation import cleanLaps, referenceLaps
+from pits import MAX_PIT_LOSS
+from sectors import rollingMedian
+
+PACE_WINDOW = 3 # clean laps in the current pace
+
+
+def pitLosses(race, index, pits, max_loss=MAX_PIT_LOSS):
+    """
+    Median time (s) lost by the green and by the yellow stops of every car
+    (two arrays by car code, see PitStops.timeLost). A car without such
+    stops gets the median over the field; without any yellow stop at all
+    the yellow loss is the green one.
+    """
+    reference = referenceLaps(race, index)
+    under_yellow = pits.flag == race.code("Flag", "Yellow")
+    yellow_laps = race.mask("Location", "Track") & race.mask("Flag", "Yellow")
+    yellow_lap = np.median(race.lap_time[yellow_laps]) if yellow_laps.any() else np.nan
+    lost = pits.timeLost(np.where(under_yellow, yellow_lap, reference[pits.car]))
+    usable = (lost > 0) & (lost < max_loss) # NaN (never left) drops out too
+
+    n_cars = len(race.categories["Car"])
+    losses = []
+    for flagged in (~under_yellow, under_yellow):
+        stops = usable & flagged
+        loss = np.full(n_cars, np.median(lost[stops]) if stops.any() else np.nan)
+        car = pits.car[stops]
+        for c in np.unique(car):
+            loss[c] = np.median(lost[stops][car == c])
+        losses.append(loss)
+    green, yellow = losses
+    return green, np.where(np.isnan(yellow), green, yellow)
+
+
+def freshPace(race, index, pits):
+    """Median lap time (s) of the first clean lap after each stop of every car (by car code), NaN if none."""
+    order, first, clean = cleanLaps(race, index)
+    stint = pits.stopsStarted()[order]
+    car = race.car[order]
+    new = first | np.r_[True, stint[1:] != stint[:-1]]
+    rows = np.flatnonzero(clean & (stint > 0))
+    # first clean row of every stint after a stop
+    segment = np.cumsum(new)[rows]
+    rows = rows[np.r_[True, segment[1:] != segment[:-1]]] if len(rows) else rows
+    pace = np.full(len(race.categories["Car"]), np.nan)
+    for c in np.unique(car[rows]):
+        pace[c] = np.median(race.lap_time[order[rows[car[rows] == c]]])
+    return pace
+
+
+def currentPace(race, index, gaps, window=PACE_WINDOW):
+    """Median of the last `window` clean lap times of every car up to every lap, cars x laps (as gaps.times)."""
+    order, _, clean = cleanLaps(race, index)
+    rows = order[clean]
+    laps = np.full(gaps.times.shape, np.nan)
+    laps[race.car[rows], race.lap[rows]] = race.lap_time[rows]
+    return rollingMedian(laps.T, window).T
+
+
+class UndercutMatrix:
+    """
+    The projections of every car of class_ against every other one on every
+    lap of laprange (see the module docstring). cars are in code order and
+    laps are the lap numbers of the last axis. Only the cars x laps inputs
+    are kept (times, loss, next_loss, pace and fresh per car); the pairwise
+    arrays are built when asked for. NaN wherever a car has no time on a
+    lap, and position -1.
+    """
+
+    def __init__(self, race, index, pits, gaps, class_, laprange, window=PACE_WINDOW):
+        codes = np.flatnonzero(gaps.car_class == race.code("Class", class_))
+        self.cars = race.names("Car", codes)
+        self.laps = gaps.laps(laprange)
+        laps = gaps.lapSlice(laprange)
+        self.times = gaps.times[codes, laps]
+
+        green, yellow = pitLosses(race, index, pits)
+        under_yellow = gaps.flags[codes, laps] == race.code("Flag", "Yellow")
+        self.loss = np.where(under_yellow, yellow[codes, None], green[codes, None])
+        # the rival answers a lap later, with the loss of the flag of that lap
+        self.next_loss = np.concatenate([self.loss[:, 1:], self.loss[:, -1:]], axis=1)
+        self.pace = currentPace(race, index, gaps, window)[codes, laps]
+        self.fresh = freshPace(race, index, pits)[codes]
+
+        n = len(codes)
+        running = ~np.isnan(self.times)
+        others = ~np.eye(n, dtype=bool)[:, :, None]
+        ahead_now = (self.times[None, :, :] < self.times[:, None, :]) & others # [car, other]: other is ahead
+        ahead_after = (self.times[None, :, :] < (self.times + self.loss)[:, None, :]) & others
+        self.position = np.where(running, 1 + ahead_now.sum(axis=1), -1)
+        self.position_after = np.where(running & ~np.isnan(self.loss), 1 + ahead_after.sum(axis=1), -1)
+
+    def projections(self, car, rival, lap):
+        """gap, gap_after, answered_gap and overcut gap of the (car, rival, lap) index arrays."""
+        gap = self.times[car, lap] - self.times[rival, lap]
+        gap_after = gap + self.loss[car, lap]
+        answered = gap_after - self.next_loss[rival, lap] + self.fresh[car] - self.pace[rival, lap]
+        # the other way round: the rival stops first and the car a lap later
+        overcut = gap - self.loss[rival, lap] + self.next_loss[car, lap] - self.fresh[rival] + self.pace[car, lap]
+        return gap, gap_after, answered, overcut
+
+    def pairs(self):
+        """Index arrays of every (car, rival, lap) with car != rival, broadcasting to cars x cars x laps."""
+        n = len(self.cars)
+        return np.arange(n)[:, None, None], np.arange(n)[None, :, None], np.arange(len(self.laps))[None, None, :]
+
+    def gap(self):
+        """cars x cars x laps, car behind rival (s) now."""
+        return self.projections(*self.pairs())[0]
+
+    def gapAfter(self):
+        """cars x cars x laps, car behind rival once the car has stopped."""
+        return self.projections(*self.pairs())[1]
+
+    def answeredGap(self):
+        """cars x cars x laps, car behind rival once the rival stopped a lap later too."""
+        return self.projections(*self.pairs())[2]
+
+    def overcutGap(self):
+        """cars x cars x laps, car behind rival once the rival stopped first and the car a lap later."""
+        return self.projections(*self.pairs())[3]
+
+    def table(self, cars=None, laps=None, max_gap=None):
+        """
+        One row per (lap, car, rival): the gaps, the positions and whether
+        the undercut (car behind, ahead once both stopped) or the overcut
+        works. cars and laps restrict the pitting car and the laps,
+        max_gap the rivals to those within that many seconds now.
+        """
+        car_at = np.flatnonzero([c in cars for c in self.cars]) if cars else np.arange(len(self.cars))
+        lap_at = np.flatnonzero(np.isin(self.laps, laps)) if laps is not None else np.arange(len(self.laps))
+        lap, car, rival = [a.ravel() for a in np.meshgrid(lap_at, car_at, np.arange(len(self.cars)), indexing='ij')]
+        gap = self.times[car, lap] - self.times[rival, lap]
+        keep = (car != rival) & ~np.isnan(gap)
+        if max_gap is not None:
+            keep &= np.abs(gap) <= max_gap
+        car, rival, lap = car[keep], rival[keep], lap[keep]
+
+        gap, gap_after, answered, overcut = self.projections(car, rival, lap)
+        names = np.array(self.cars, dtype=object)
+        return pd.DataFrame({"Lap": self.laps[lap], "Car": names[car], "Rival": names[rival],
+                             "Position": self.position[car, lap], "Gap": gap,
+                             "Pit loss": self.loss[car, lap], "Gap after stop": gap_after,
+                             "Position after stop": self.position_after[car, lap],
+                             "Gap if answered": answered, "Undercut": (gap > 0) & (answered < 0),
+                             "Gap if overcut": overcut, "Overcut": (gap > 0) & (overcut < 0)})
+
+
+if __name__ == "__main__":
+    import time
+    import analysis
+    ra = analysis.RaceAnalysis()
+    start = time.perf_counter()
+    undercut = UndercutMatrix(ra.race, ra.index, ra.pits, ra.gaps, "GTD", (1, ra.gaps.max_lap))
+    print("%d cars x %d laps in %.1f ms" % (len(undercut.cars), len(undercut.laps),
+                                             (time.perf_counter() - start) * 1000))
+    print(undercut.table(laps=[300], max_gap=30).to_string(index=False))